@@ -0,0 +1,140 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Integer address math for the IPAM hot path.
+
+netaddr is convenient but building IPNetwork/IPAddress/EUI objects (and
+converting between v4 and v6) costs far more than the arithmetic the
+allocator needs. These helpers work on plain ints and (first, last,
+version) tuples instead. Addresses are either "native" (a v4 int for v4)
+or v6 mapped, which is how the database stores every address.
+"""
+
+import socket
+import struct
+
+import netaddr
+
+V4_MAPPED = 0xffff00000000
+V4_MAX = 0xffffffff
+_U64 = 0xffffffffffffffff
+
+# CIDRs seen by a process are a small, stable set (subnets and policies)
+_CIDR_CACHE = {}
+_CIDR_CACHE_MAX = 4096
+
+
+def parse_ip(ip):
+    """Returns (value, version) for an address string or IPAddress."""
+    if isinstance(ip, netaddr.IPAddress):
+        return ip.value, ip.version
+    try:
+        return struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip))[0], 4
+    except (socket.error, TypeError):
+        pass
+    try:
+        hi, lo = struct.unpack("!QQ", socket.inet_pton(socket.AF_INET6, ip))
+        return (hi << 64) | lo, 6
+    except (socket.error, TypeError):
+        # Odd legacy forms netaddr still understands
+        ip = netaddr.IPAddress(ip)
+        return ip.value, ip.version
+
+
+def to_v6(value, version):
+    """Returns the v6 (mapped, for v4) form stored in the database."""
+    if version == 4:
+        return value | V4_MAPPED
+    return value
+
+
+def to_native(value, version):
+    """Returns the value in the given version, unmapping v4 if needed."""
+    if version == 4 and is_v4_mapped(value):
+        return value & V4_MAX
+    return value
+
+
+def is_v4_mapped(value):
+    return (value & ~V4_MAX) == V4_MAPPED
+
+
+def cidr_range(cidr):
+    """Returns (first, last, version) of a CIDR string, in native form."""
+    cached = _CIDR_CACHE.get(cidr)
+    if cached is not None:
+        return cached
+
+    addr, _sep, prefix = str(cidr).partition("/")
+    value, version = parse_ip(addr)
+    bits = 32 if version == 4 else 128
+    prefix = int(prefix) if prefix else bits
+    host_mask = (1 << (bits - prefix)) - 1
+    first = value & ~host_mask
+    result = (first, first | host_mask, version)
+
+    if len(_CIDR_CACHE) >= _CIDR_CACHE_MAX:
+        _CIDR_CACHE.clear()
+    _CIDR_CACHE[cidr] = result
+    return result
+
+
+def cidr_value(cidr):
+    """Returns the address part of a CIDR, as netaddr.IPNetwork.value."""
+    return parse_ip(str(cidr).partition("/")[0])[0]
+
+
+def cidr_size(cidr):
+    first, last, _version = cidr_range(cidr)
+    return last - first + 1
+
+
+def in_range(value, first, last):
+    return first <= value <= last
+
+
+def format_ip(value, version):
+    """Formats an int the same way str(netaddr.IPAddress) does."""
+    if version == 4:
+        return socket.inet_ntop(socket.AF_INET, struct.pack("!I", value))
+    return socket.inet_ntop(socket.AF_INET6,
+                            struct.pack("!QQ", value >> 64, value & _U64))
+
+
+def mac_to_int(mac):
+    """Returns a MAC as an int from an int, netaddr.EUI or string."""
+    if isinstance(mac, (int, long)):
+        return mac
+    if isinstance(mac, netaddr.EUI):
+        return mac.value
+    digits = mac.replace(":", "").replace("-", "").replace(".", "")
+    try:
+        if len(digits) == 12:
+            return int(digits, 16)
+    except ValueError:
+        pass
+    # Let netaddr handle (or reject) anything unusual
+    return netaddr.EUI(mac).value
+
+
+def format_mac(value, sep="-"):
+    """Formats an int MAC as upper case hex pairs, like str(netaddr.EUI)."""
+    digits = "%012X" % value
+    return sep.join(digits[i:i + 2] for i in xrange(0, 12, 2))
+
+
+def eui64(mac):
+    """Returns the EUI-64 of an int MAC, as netaddr.EUI.eui64().value."""
+    return ((mac >> 24) << 40) | (0xfffe << 24) | (mac & 0xffffff)
@@ -20,6 +20,9 @@ from neutron_lib import exceptions as n_exc
 from oslo_log import log as logging
 import webob
 
+from quark.api import streaming
+from quark.db import pagination
+
 RESOURCE_NAME = 'ip_address'
 RESOURCE_COLLECTION = RESOURCE_NAME + "es"
 EXTENDED_ATTRIBUTES_2_0 = {
@@ -49,8 +52,32 @@ class IpAddressesController(wsgi.Controller):
 
     def index(self, request):
         context = request.context
-        return {"ip_addresses":
-                self._plugin.get_ip_addresses(context, **request.GET)}
+        if streaming.should_stream(context, request.GET):
+            chunks = self._plugin.get_ip_addresses_chunks(context,
+                                                          **request.GET)
+            return streaming.json_response("ip_addresses", chunks)
+        params = dict(request.GET)
+        limit = params.pop("limit", None)
+        marker = params.pop("marker", None)
+        if limit is None and marker is None:
+            return {"ip_addresses":
+                    self._plugin.get_ip_addresses(context, **params)}
+
+        try:
+            limit = int(limit) if limit is not None else None
+        except ValueError:
+            raise webob.exc.HTTPBadRequest("limit must be an integer")
+        try:
+            addresses = self._plugin.get_ip_addresses(
+                context, limit=limit, marker=marker, **params)
+        except n_exc.BadRequest as e:
+            raise webob.exc.HTTPBadRequest(e)
+        body = {"ip_addresses": addresses}
+        link = pagination.next_link(request.path_url, request.GET.items(),
+                                    addresses, limit)
+        if link:
+            body["ip_addresses_links"] = [link]
+        return body
 
     def show(self, request, id):
         context = request.context
@@ -0,0 +1,151 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Chunked JSON responses for listings too large to build in memory.
+
+A streamed listing takes an iterable of lists of dicts, such as the
+plugin's *_chunks calls yield, and encodes {collection: [...]} one chunk
+at a time as the WSGI server sends it. The response has no Content-Length,
+so it goes out with chunked transfer encoding.
+
+The ip_addresses extension streams its own index. GET /ports is served by
+neutron's core controller, so PortsStreamingMiddleware answers the
+listings that should be streamed before they reach it.
+"""
+
+import itertools
+import json
+import re
+
+from neutron.api import api_common
+from neutron.api.v2 import attributes
+from neutron import manager
+from neutron import policy
+from neutron import wsgi
+from oslo_config import cfg
+from oslo_log import log as logging
+import webob
+import webob.dec
+
+from quark import plugin_views  # noqa, registers the stream_* options
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+_PORTS_PATH = re.compile(r"^(/v2\.0)?/ports(\.json)?$")
+# Listings the core controller has to page, sort or trim itself
+_UNSTREAMED = set(["fields", "limit", "marker", "sort_key", "sort_dir",
+                   "page_reverse"])
+
+
+def should_stream(context, params):
+    """Whether a listing request is served as a stream.
+
+    Only admin listings without a limit or marker are unbounded enough to
+    need it.
+    """
+    return (CONF.QUARK.stream_listings and context.is_admin and
+            "limit" not in params and "marker" not in params)
+
+
+def encode(collection, chunks):
+    """Yields the JSON of {collection: [...]} a chunk at a time."""
+    yield '{"%s": [' % collection
+    separator = ""
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            yield separator + ", ".join(json.dumps(item) for item in chunk)
+            separator = ", "
+    except Exception:
+        # The status line has gone out already, all that is left is to
+        # cut the body short
+        LOG.exception("Streaming %s failed" % collection)
+        raise
+    yield "]}"
+
+
+def json_response(collection, chunks):
+    """Returns a chunked response listing chunks under collection.
+
+    The first chunk is read before the response is built, so bad filters
+    and other early errors still get their proper error response.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, [])
+    return webob.Response(
+        app_iter=encode(collection, itertools.chain([first], chunks)),
+        content_type="application/json")
+
+
+def _policy_filtered(context, plugin, chunks):
+    """Applies the policy checks of the core controller's index to chunks.
+
+    Ports the context may not get are dropped. Attributes that aren't
+    visible, or that policy hides, are stripped from every port; like the
+    controller, that is decided on the first port of the listing.
+    """
+    attr_info = attributes.RESOURCE_ATTRIBUTE_MAP["ports"]
+    excluded = None
+    for chunk in chunks:
+        chunk = [port for port in chunk
+                 if policy.check(context, "get_port", port, plugin=plugin,
+                                 pluralized="ports")]
+        if chunk and excluded is None:
+            first = chunk[0]
+            excluded = set(
+                name for name in first
+                if not (attr_info.get(name, {}).get("is_visible") and
+                        policy.check(context, "get_port:%s" % name, first,
+                                     might_not_exist=True,
+                                     pluralized="ports")))
+        if excluded:
+            chunk = [dict((name, value) for name, value in port.items()
+                          if name not in excluded) for port in chunk]
+        yield chunk
+
+
+class PortsStreamingMiddleware(wsgi.Middleware):
+    """Streams GET /ports listings that should_stream picks.
+
+    Goes in the api-paste.ini pipeline after the filter that sets
+    neutron.context, e.g.
+
+        [filter:quark_streaming]
+        paste.filter_factory =
+            quark.api.streaming:PortsStreamingMiddleware.factory
+
+    Everything else, and every listing that pages, sorts or asks for
+    fields, is passed on to neutron. Streamed ports go through the same
+    policy checks the core controller applies, so the body is the one it
+    would have sent.
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, request):
+        context = request.environ.get("neutron.context")
+        if (request.method != "GET" or context is None or
+                not _PORTS_PATH.match(request.path_info) or
+                _UNSTREAMED.intersection(request.GET) or
+                not should_stream(context, request.GET)):
+            return self.application
+
+        filters = api_common.get_filters(
+            request, attributes.RESOURCE_ATTRIBUTE_MAP["ports"])
+        plugin = manager.NeutronManager.get_plugin()
+        return json_response("ports", _policy_filtered(
+            context, plugin,
+            plugin.get_ports_chunks(context, filters=filters)))
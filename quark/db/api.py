@@ -13,24 +13,34 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import datetime
 import inspect
 
 import json
 import netaddr
+from neutron.db import api as neutron_db_api
 from neutron.db.sqlalchemyutils import paginate_query
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
+from sqlalchemy import bindparam
 from sqlalchemy import event
 from sqlalchemy import func as sql_func
+from sqlalchemy import inspect as sa_inspect
 from sqlalchemy import and_, asc, desc, orm, or_, not_
+from sqlalchemy import cast, exists, false, Numeric
+from sqlalchemy.ext import baked
 from sqlalchemy.orm import class_mapper
 
+from quark import address_math
 from quark.db import models
+from quark.db import pagination
+from quark import ip_policy_cache
 from quark import network_strategy
 from quark import protocols
+from quark import provider_cache
 from quark import tags
 
 PORT_TAG_REGISTRY = tags.PORT_TAG_REGISTRY
@@ -38,6 +48,18 @@ STRATEGY = network_strategy.STRATEGY
 LOG = logging.getLogger(__name__)
 CONF = cfg.CONF
 
+quark_opts = [
+    cfg.StrOpt('inet_range_reads',
+               default='char',
+               choices=['char', 'dual', 'binary'],
+               help=_('Which address columns range comparisons read. char'
+                      ' uses the decimal INET columns, binary the BINARY(16)'
+                      ' *_bin columns, and dual the binary columns where'
+                      ' they are filled in and the decimal ones elsewhere,'
+                      ' for use while quark-inet-backfill runs.'))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
 
 ONE = "one"
 ALL = "all"
@@ -47,6 +69,22 @@ _NO_TENANT_MODELS = (
     models.LockHolder,
     models.SegmentAllocationRange)
 
+_EQ_FILTERS = frozenset([
+    "address", "cidr", "deallocated", "ip_version", "service",
+    "mac_address_range_id", "transaction_id", "lock_id", "address_type"])
+_IN_FILTERS = frozenset([
+    "device_id", "device_owner", "group_id", "id", "mac_address", "name",
+    "network_id", "segment_id", "subnet_id", "used_by_tenant_id", "version"])
+_SG_RULE_EQ_FILTERS = frozenset([
+    "direction", "port_range_max", "port_range_min"])
+
+# Mappers don't change once configured, so the attribute names and the
+# filter keys each model accepts are only worked out once per process.
+_MODEL_ATTRS = {}
+_MODEL_FILTER_KEYS = {}
+
+_BAKERY = baked.bakery()
+
 
 # NOTE(jkoelker) init event listener that will ensure id is filled in
 #                on object creation (prior to commit).
@@ -78,36 +116,45 @@ def _listify(filters):
 
 
 def _model_attrs(model):
-    model_map = class_mapper(model)
-    model_attrs = [x.key for x in model_map.column_attrs]
-    if "_cidr" in model_attrs:
-        model_attrs.append("cidr")
-    if "_deallocated" in model_attrs:
-        model_attrs.append("deallocated")
+    model_attrs = _MODEL_ATTRS.get(model)
+    if model_attrs is None:
+        model_map = class_mapper(model)
+        model_attrs = set(x.key for x in model_map.column_attrs)
+        if "_cidr" in model_attrs:
+            model_attrs.add("cidr")
+        if "_deallocated" in model_attrs:
+            model_attrs.add("deallocated")
+        model_attrs = _MODEL_ATTRS[model] = frozenset(model_attrs)
     return model_attrs
 
 
+def _model_filter_keys(model):
+    """Returns (allowed, eq, in) filter key sets for a model."""
+    keys = _MODEL_FILTER_KEYS.get(model)
+    if keys is None:
+        # NOTE: When the filter key != attribute key, it must be added to
+        #       the allowed keys here.
+        allowed = set(_model_attrs(model))
+        if model == models.IPAddress:
+            allowed.update(["tenant_id", "ip_address"])
+        if model in (models.IPAddress, models.MacAddress):
+            allowed.add("reuse_after")
+        eq_filters = _EQ_FILTERS
+        if model == models.SecurityGroupRule:
+            eq_filters = eq_filters | _SG_RULE_EQ_FILTERS
+        keys = (frozenset(allowed), eq_filters, _IN_FILTERS)
+        _MODEL_FILTER_KEYS[model] = keys
+    return keys
+
+
 def _model_query(context, model, filters, fields=None):
     filters = filters or {}
     model_filters = []
-    eq_filters = ["address", "cidr", "deallocated", "ip_version", "service",
-                  "mac_address_range_id", "transaction_id", "lock_id",
-                  "address_type"]
-    in_filters = ["device_id", "device_owner", "group_id", "id", "mac_address",
-                  "name", "network_id", "segment_id", "subnet_id",
-                  "used_by_tenant_id", "version"]
+    allowed, eq_filters, in_filters = _model_filter_keys(model)
 
     # Sanitize incoming filters to only attributes that exist in the model.
     # NOTE: Filters for unusable attributes are silently dropped here.
-    # NOTE: When the filter key != attribute key, a conditional must be added
-    #       here.
-    model_attrs = _model_attrs(model)
-    filters = {x: y for x, y in filters.items()
-               if x in model_attrs or
-               (x == "tenant_id" and model == models.IPAddress) or
-               (x == "ip_address" and model == models.IPAddress) or
-               (x == "reuse_after" and model in (models.IPAddress,
-                                                 models.MacAddress))}
+    filters = {x: y for x, y in filters.items() if x in allowed}
 
     # Inject the tenant id if none is set. We don't need unqualified queries.
     # This works even when a non-shared, other-tenant owned network is passed
@@ -116,10 +163,6 @@ def _model_query(context, model, filters, fields=None):
     if not filters.get("tenant_id") and not context.is_admin:
         filters["tenant_id"] = [context.tenant_id]
 
-    if model == models.SecurityGroupRule:
-        sg_rule_attribs = ["direction", "port_range_max", "port_range_min"]
-        eq_filters.extend(sg_rule_attribs)
-
     for key, value in filters.items():
         if key in in_filters:
             model_type = getattr(model, key)
@@ -164,6 +207,35 @@ def _model_query(context, model, filters, fields=None):
     return model_filters
 
 
+def _paginate(query, model, limit, sorts, marker):
+    """Pages query after marker, a model object, cursor or id string."""
+    if pagination.is_cursor(marker):
+        return pagination.keyset_query(query, model, limit, sorts, marker)
+    return paginate_query(query, model, limit, sorts, marker)
+
+
+def _find_chunks(page, chunk_size):
+    """Yields the lists page(limit, marker) returns, in id order.
+
+    Each chunk is a keyset page after the last row of the one before, so
+    a listing of any size is read without holding more than one chunk of
+    models, and whatever page() eager loads for them, at a time.
+    """
+    marker = None
+    while True:
+        chunk = page(chunk_size, marker) or []
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        marker = pagination.cursor_for(chunk[-1])
+
+
+def _project(query, model, columns):
+    """Selects only the named columns of model, as tuples, in query."""
+    return query.with_entities(*[getattr(model, c) for c in columns])
+
+
 def scoped(f):
     def wrapped(*args, **kwargs):
         scope = None
@@ -191,11 +263,54 @@ def scoped(f):
     return wrapped
 
 
+def _port_view_loads():
+    """Eager loads for everything the port views read.
+
+    Tags, security groups and IP associations are each fetched for the
+    whole result page in one extra query, so rendering a page costs the
+    same number of queries however many ports it holds.
+    """
+    return [
+        orm.joinedload(models.Port.ip_addresses).subqueryload(
+            models.IPAddress.associations),
+        orm.subqueryload(models.Port.associations),
+        orm.subqueryload(models.Port.security_groups),
+        orm.joinedload(models.Port.tag_association).subqueryload(
+            "tags_association")]
+
+
+def _port_find_by_id(context, port_id, join_views=False):
+    """Baked equivalent of port_find(context, id=port_id).
+
+    Fetching a single port is the most common lookup, so its compiled SQL
+    is cached instead of rebuilt on every call.
+    """
+    bq = _BAKERY(lambda s: s.query(models.Port).options(
+        orm.joinedload(models.Port.ip_addresses)))
+    if join_views:
+        bq += lambda q: q.options(*_port_view_loads())
+    bq += lambda q: q.filter(models.Port.id == bindparam("id"))
+    params = {"id": port_id}
+    if not context.is_admin:
+        bq += lambda q: q.filter(models.Port.tenant_id == bindparam("tenant"))
+        params["tenant"] = context.tenant_id
+    return bq(context.session).params(**params)
+
+
 @scoped
 def port_find(context, limit=None, sorts=None, marker_obj=None, fields=None,
-              **filters):
-    query = context.session.query(models.Port).options(
-        orm.joinedload(models.Port.ip_addresses))
+              columns=None, **filters):
+    join_views = "join_security_groups" in filters and not columns
+    if (set(filters) - set(["join_security_groups"]) == set(["id"]) and
+            isinstance(filters["id"], list) and len(filters["id"]) == 1 and
+            not (limit or sorts or marker_obj or fields or columns)):
+        return _port_find_by_id(context, filters["id"][0], join_views)
+
+    query = context.session.query(models.Port)
+    if columns:
+        query = _project(query, models.Port, columns)
+    else:
+        query = query.options(orm.joinedload(models.Port.ip_addresses))
     model_filters = _model_query(context, models.Port, filters)
     if filters.get("ip_address_id"):
         model_filters.append(models.Port.ip_addresses.any(
@@ -208,17 +323,26 @@ def port_find(context, limit=None, sorts=None, marker_obj=None, fields=None,
         model_filters.append(models.Port.associations.any(
             models.PortIpAssociation.service == filters["service"]))
 
-    if "join_security_groups" in filters:
-        query = query.options(orm.joinedload(models.Port.security_groups))
+    if join_views:
+        query = query.options(*_port_view_loads())
 
-    if fields and "port_subnets" in fields:
+    if fields and "port_subnets" in fields and not columns:
         query = query.options(orm.joinedload("ip_addresses.subnet"))
         query = query.options(
             orm.joinedload("ip_addresses.subnet.dns_nameservers"))
         query = query.options(
             orm.joinedload("ip_addresses.subnet.routes"))
-    return paginate_query(query.filter(*model_filters), models.Port, limit,
-                          sorts, marker_obj)
+    return _paginate(query.filter(*model_filters), models.Port, limit, sorts,
+                     marker_obj)
+
+
+def port_find_chunks(context, chunk_size, fields=None, **filters):
+    """Yields port_find's ports, with their view loads, chunk by chunk."""
+    def page(limit, marker):
+        return port_find(context, limit, [("id", True)], marker,
+                         fields=fields, join_security_groups=True,
+                         scope=ALL, **filters)
+    return _find_chunks(page, chunk_size)
 
 
 @scoped
@@ -309,20 +433,100 @@ def ip_address_update(context, address, **kwargs):
     return address
 
 
-def ip_address_create(context, **address_dict):
+def ip_address_create(context, count_used=True, **address_dict):
+    """Creates an address row.
+
+    Addresses handed out through next_auto_assign_ip were already added to
+    their subnet's used_count by the update that reserved them, so callers
+    pass count_used=False for those instead of updating the subnet row
+    again.
+    """
     ip_address = models.IPAddress()
     address = address_dict.pop("address")
     ip_address.update(address_dict)
-    ip_address["address"] = int(address.ipv6())
-    ip_address["address_readable"] = str(address)
+    value, version = address_math.parse_ip(address)
+    ip_address["address"] = address_math.to_v6(value, version)
+    ip_address["address_readable"] = address_math.format_ip(value, version)
     ip_address["used_by_tenant_id"] = context.tenant_id
     ip_address["_deallocated"] = 0
     ip_address["allocated_at"] = timeutils.utcnow()
     context.session.add(ip_address)
+    if count_used and ip_address["subnet_id"]:
+        subnet_update_used_count(context, ip_address["subnet_id"], 1)
     return ip_address
 
 
+def ip_address_find_existing(context, subnet_id, addresses):
+    """Returns the subset of addresses that already have a row in subnet."""
+    if not addresses:
+        return set()
+    query = context.session.query(models.IPAddress.address)
+    query = query.filter(models.IPAddress.subnet_id == subnet_id)
+    query = query.filter(models.IPAddress.address.in_(addresses))
+    return set(row.address for row in query)
+
+
+def _ip_address_mapping(subnet, address, **address_dict):
+    version = subnet["ip_version"]
+    readable = address_math.format_ip(
+        address_math.to_native(address, version), version)
+    mapping = dict(id=uuidutils.generate_uuid(),
+                   address=address,
+                   address_readable=readable,
+                   subnet_id=subnet["id"],
+                   network_id=subnet["network_id"],
+                   version=subnet["ip_version"])
+    mapping.update(address_dict)
+    return mapping
+
+
+def ip_address_create_bulk(context, subnet, addresses, **address_dict):
+    """Bulk-insert newly allocated addresses into a subnet.
+
+    Addresses are integers in the same (v6 mapped) form as the address
+    column. They aren't added to the subnet's used_count, the lease that
+    reserved them already was. Returns the created IPAddress models.
+    """
+    if not addresses:
+        return []
+
+    row = dict(used_by_tenant_id=context.tenant_id,
+               _deallocated=0,
+               allocated_at=timeutils.utcnow())
+    row.update(address_dict)
+    mappings = [_ip_address_mapping(subnet, address, **row)
+                for address in addresses]
+    context.session.bulk_insert_mappings(models.IPAddress, mappings)
+
+    query = context.session.query(models.IPAddress)
+    query = query.filter(models.IPAddress.id.in_([m["id"] for m in mappings]))
+    return query.all()
+
+
+def ip_address_create_deallocated_bulk(context, subnet, addresses):
+    """Bulk-insert addresses directly into the deallocated pool.
+
+    Addresses are integers in the same (v6 mapped) form as the address
+    column. Rows are back-dated by ipam_reuse_after so they can be
+    reallocated immediately. Addresses that already have a row in the
+    subnet are skipped. The addresses come from leased blocks, which were
+    added to used_count when they were leased.
+    """
+    existing = ip_address_find_existing(context, subnet["id"], addresses)
+    reusable_at = timeutils.utcnow() - datetime.timedelta(
+        seconds=CONF.QUARK.ipam_reuse_after)
+    mappings = [_ip_address_mapping(subnet, address, _deallocated=1,
+                                    deallocated_at=reusable_at)
+                for address in addresses if address not in existing]
+    if not mappings:
+        return 0
+    context.session.bulk_insert_mappings(models.IPAddress, mappings)
+    return len(mappings)
+
+
 def ip_address_delete(context, addr):
+    if addr["subnet_id"]:
+        subnet_update_used_count(context, addr["subnet_id"], -1)
     context.session.delete(addr)
 
 
@@ -332,8 +536,43 @@ def ip_address_deallocate(context, address, **kwargs):
     return ip_address_update(context, address, **kwargs)
 
 
+def ip_address_deallocate_all(context, addresses):
+    """Marks addresses deallocated with a single UPDATE.
+
+    The loaded models are given the new values as their committed state,
+    as if they had been refreshed, so flushing doesn't update them again.
+    allocated_at is left alone; billing needs it for the usage sent when
+    the addresses are deallocated, and reallocation sets it again.
+    """
+    values = {"_deallocated": 1,
+              "deallocated_at": timeutils.utcnow(),
+              "address_type": None}
+    query = context.session.query(models.IPAddress)
+    query = query.filter(models.IPAddress.id.in_([a.id for a in addresses]))
+    row_count = query.update(values, synchronize_session=False)
+    for address in addresses:
+        for key, value in values.items():
+            orm.attributes.set_committed_value(address, key, value)
+    return row_count
+
+
+def ip_address_delete_all(context, addresses):
+    """Deletes addresses with a single DELETE.
+
+    Their association rows must already be gone.
+    """
+    freed = collections.Counter(a["subnet_id"] for a in addresses
+                                if a["subnet_id"])
+    for subnet_id, count in freed.items():
+        subnet_update_used_count(context, subnet_id, -count)
+    query = context.session.query(models.IPAddress)
+    query = query.filter(models.IPAddress.id.in_([a.id for a in addresses]))
+    return query.delete(synchronize_session=False)
+
+
 @scoped
-def ip_address_find(context, lock_mode=False, **filters):
+def ip_address_find(context, lock_mode=False, limit=None, sorts=None,
+                    marker=None, **filters):
     query = context.session.query(models.IPAddress)
 
     if lock_mode:
@@ -357,7 +596,21 @@ def ip_address_find(context, lock_mode=False, **filters):
         model_filters.append(models.IPAddress.ports.any(
             models.Port.id == filters['port_id']))
 
-    return query.filter(*model_filters)
+    query = query.filter(*model_filters)
+    if limit or marker:
+        return _paginate(query, models.IPAddress, limit, sorts, marker)
+    return query
+
+
+def ip_address_find_chunks(context, chunk_size, **filters):
+    """Yields ip_address_find's addresses chunk by chunk."""
+    query = ip_address_find(context, **filters).options(
+        orm.subqueryload(models.IPAddress.associations))
+
+    def page(limit, marker):
+        return _paginate(query, models.IPAddress, limit, [("id", True)],
+                         marker).all()
+    return _find_chunks(page, chunk_size)
 
 
 def ip_address_count_all(context, filters):
@@ -378,6 +631,96 @@ def ip_address_reallocate(context, update_kwargs, **filters):
     return row_count == 1
 
 
+def _inet_numeric(column):
+    # NOTE: INET is stored as CHAR, so column to column range comparisons
+    #       have to be done numerically or they become string comparisons.
+    return cast(column, Numeric(39, 0))
+
+
+def _inet_binary(column):
+    return getattr(column.class_, column.key + "_bin")
+
+
+def inet_within(address, first, last):
+    """Returns a clause for first <= address <= last.
+
+    The arguments are INET model attributes. Which columns are compared
+    depends on inet_range_reads.
+    """
+    reads = CONF.QUARK.inet_range_reads
+    char = and_(_inet_numeric(address) >= _inet_numeric(first),
+                _inet_numeric(address) <= _inet_numeric(last))
+    if reads == "char":
+        return char
+
+    columns = [_inet_binary(c) for c in (address, first, last)]
+    binary = and_(columns[0] >= columns[1], columns[0] <= columns[2])
+    if reads == "binary":
+        return binary
+
+    filled = and_(*[c.isnot(None) for c in columns])
+    return or_(and_(filled, binary), and_(not_(filled), char))
+
+
+def _supports_skip_locked(context):
+    """Whether the server accepts FOR UPDATE SKIP LOCKED.
+
+    MySQL added it in 8.0.1. MariaDB reports its own version numbers and
+    is left out.
+    """
+    dialect = context.session.get_bind().dialect
+    if dialect.name != "mysql":
+        return False
+    version = dialect.server_version_info or ()
+    if "MariaDB" in version:
+        return False
+    return tuple(version[:3]) >= (8, 0, 1)
+
+
+def ip_address_reallocate_claim(context, update_kwargs, skip_locked=True,
+                                **filters):
+    """Claims a reallocatable address with a single locking SELECT.
+
+    Addresses in do_not_use subnets, outside of their subnet's CIDR or
+    covered by the subnet's IP policy are filtered out in SQL. The subnet
+    conditions sit in an EXISTS subquery so only the address row is
+    locked; locking the joined subnet rows as well would make concurrent
+    claimers in the same subnet skip, or wait on, every candidate. Where
+    the server supports it the select uses SKIP LOCKED so concurrent
+    claimers never wait on a row another worker is claiming. Returns the
+    updated address, or None if nothing could be claimed.
+
+    Unlike ip_address_reallocate_find, policy violating rows are skipped
+    rather than deleted.
+    """
+    ippc = models.IPPolicyCIDR
+    subnet = models.Subnet
+    address = models.IPAddress.address
+
+    usable_subnet = exists().where(and_(
+        subnet.id == models.IPAddress.subnet_id,
+        or_(subnet.do_not_use == false(), subnet.do_not_use.is_(None)),
+        inet_within(address, subnet.first_ip, subnet.last_ip),
+        ~exists().where(and_(
+            ippc.ip_policy_id == subnet.ip_policy_id,
+            inet_within(address, ippc.first_ip, ippc.last_ip))
+        ).correlate_except(ippc)))
+
+    query = context.session.query(models.IPAddress)
+    model_filters = _model_query(context, models.IPAddress, filters)
+    query = query.filter(*model_filters)
+    query = query.filter(usable_subnet)
+    query = query.limit(1).with_for_update()
+    if skip_locked and _supports_skip_locked(context):
+        query = query.suffix_with("SKIP LOCKED")
+
+    address = query.first()
+    if not address:
+        return
+    address.update(update_kwargs)
+    return address
+
+
 def ip_address_reallocate_find(context, transaction_id):
     address = ip_address_find(context, transaction_id=transaction_id,
                               scope=ONE)
@@ -396,32 +739,29 @@ def ip_address_reallocate_find(context, transaction_id):
         LOG.debug("Subnet marked as do_not_use")
         return
 
-    addr = netaddr.IPAddress(int(address["address"]))
-    if address["subnet"]["ip_version"] == 4:
-        addr = addr.ipv4()
-    else:
-        addr = addr.ipv6()
-
+    addr = address_math.to_v6(int(address["address"]),
+                              subnet["ip_version"])
     if subnet and subnet["ip_policy"]:
-        policy = subnet["ip_policy"].get_cidrs_ip_set()
+        policy = subnet["ip_policy"].get_compiled_set()
     else:
-        policy = netaddr.IPSet([])
+        policy = ip_policy_cache.EMPTY_POLICY
 
-    if policy is not None and addr in policy:
+    if addr in policy:
         LOG.info("Deleting Address {0} due to policy "
                  "violation".format(
                      address["address_readable"]))
-        context.session.delete(address)
+        ip_address_delete(context, address)
         return
 
     # TODO(amir): performance test replacing this with SQL in
     #             ip_address_reallocate's UPDATE statement
-    cidr = netaddr.IPNetwork(address["subnet"]["cidr"])
-    if addr not in cidr:
+    first, last, version = address_math.cidr_range(subnet["cidr"])
+    if not address_math.in_range(address_math.to_native(addr, version),
+                                 first, last):
         LOG.info("Address {0} isn't in the subnet "
                  "it claims to be in".format(
                      address["address_readable"]))
-        context.session.delete(address)
+        ip_address_delete(context, address)
         return
 
     return address
@@ -437,6 +777,9 @@ def mac_address_find(context, lock_mode=False, **filters):
 
 
 def mac_address_delete(context, mac_address):
+    if mac_address["mac_address_range_id"]:
+        mac_range_update_allocated_count(
+            context, mac_address["mac_address_range_id"], -1)
     context.session.delete(mac_address)
 
 
@@ -472,11 +815,9 @@ def mac_address_reallocate_find(context, transaction_id):
 
 def mac_address_range_find_allocation_counts(context, address=None,
                                              use_forbidden_mac_range=False):
-    count = sql_func.count(models.MacAddress.address)
+    count = models.MacAddressRange.allocated_count
     query = context.session.query(models.MacAddressRange,
                                   count.label("count")).with_lockmode("update")
-    query = query.outerjoin(models.MacAddress)
-    query = query.group_by(models.MacAddressRange.id)
     query = query.order_by(desc(count))
     if address:
         query = query.filter(models.MacAddressRange.last_address >= address)
@@ -512,7 +853,50 @@ def mac_address_range_update(context, mac_range, **kwargs):
     return mac_range
 
 
-def mac_range_update_next_auto_assign_mac(context, mac_range):
+def mac_range_update_allocated_count(context, mac_range_id, delta):
+    query = context.session.query(models.MacAddressRange)
+    query = query.filter(models.MacAddressRange.id == mac_range_id)
+    return query.update(
+        {"allocated_count": models.MacAddressRange.allocated_count + delta},
+        synchronize_session=False)
+
+
+def mac_range_lease_next_auto_assign_macs(context, mac_range, count):
+    """Atomically reserve up to count MACs from next_auto_assign_mac.
+
+    Like subnet_lease_next_auto_assign_ips, the update only matches if
+    next_auto_assign_mac hasn't moved since the range was read, and adds
+    the whole block to allocated_count. Returns the (first, last) inclusive
+    range that was reserved, or None.
+    """
+    first = mac_range["next_auto_assign_mac"]
+    if first == -1 or first > mac_range["last_address"]:
+        return
+    last = min(first + count - 1, mac_range["last_address"])
+
+    query = context.session.query(models.MacAddressRange)
+    query = query.filter(models.MacAddressRange.id == mac_range["id"])
+    query = query.filter(models.MacAddressRange.next_auto_assign_mac == first)
+    row_count = query.update(
+        {"next_auto_assign_mac":
+         models.MacAddressRange.next_auto_assign_mac + (last - first + 1),
+         "allocated_count":
+         models.MacAddressRange.allocated_count + (last - first + 1)},
+        synchronize_session=False)
+    if row_count != 1:
+        return
+    return first, last
+
+
+def mac_range_update_next_auto_assign_mac(context, mac_range, count=1,
+                                          allocated=None):
+    """Moves next_auto_assign_mac count MACs on.
+
+    allocated, the number of those MACs that will be created (all of them
+    by default), is added to allocated_count in the same update.
+    """
+    if allocated is None:
+        allocated = count
     query = context.session.query(models.MacAddressRange)
     query = query.filter(models.MacAddressRange.id == mac_range["id"])
     query = query.filter(models.MacAddressRange.next_auto_assign_mac != -1)
@@ -521,14 +905,21 @@ def mac_range_update_next_auto_assign_mac(context, mac_range):
     # http://docs.sqlalchemy.org/en/rel_0_8/orm/query.html
     query = query.update(
         {"next_auto_assign_mac":
-         models.MacAddressRange.next_auto_assign_mac + 1},
+         models.MacAddressRange.next_auto_assign_mac + count,
+         "allocated_count":
+         models.MacAddressRange.allocated_count + allocated},
         synchronize_session=False)
 
     # Returns a count of the rows matched in the update
     return query
 
 
-def mac_range_update_set_full(context, mac_range):
+def mac_range_update_set_full(context, mac_range, allocated=0):
+    """Marks the range full.
+
+    allocated is the number of MACs taken from the end of the range by the
+    caller, added to allocated_count in the same update.
+    """
     query = context.session.query(models.MacAddressRange)
     query = query.filter_by(id=mac_range["id"])
     query = query.filter(models.MacAddressRange.next_auto_assign_mac != -1)
@@ -536,7 +927,9 @@ def mac_range_update_set_full(context, mac_range):
     # For details on synchronize_session, see:
     # http://docs.sqlalchemy.org/en/rel_0_8/orm/query.html
     query = query.update(
-        {"next_auto_assign_mac": -1},
+        {"next_auto_assign_mac": -1,
+         "allocated_count":
+         models.MacAddressRange.allocated_count + allocated},
         synchronize_session=False)
 
     # Returns a count of the rows matched in the update
@@ -549,22 +942,144 @@ def mac_address_update(context, mac, **kwargs):
     return mac
 
 
-def mac_address_create(context, **mac_dict):
+def mac_address_find_existing(context, addresses):
+    """Returns the subset of addresses that already have a row."""
+    if not addresses:
+        return set()
+    query = context.session.query(models.MacAddress.address)
+    query = query.filter(models.MacAddress.address.in_(addresses))
+    return set(row.address for row in query)
+
+
+def mac_address_create_bulk(context, mac_address_range_id, addresses):
+    """Bulk-insert newly allocated MACs. Returns the MacAddress models.
+
+    They aren't added to the range's allocated_count, the update that moved
+    next_auto_assign_mac past them already was.
+    """
+    if not addresses:
+        return []
+    mappings = [dict(address=address,
+                     mac_address_range_id=mac_address_range_id,
+                     tenant_id=context.tenant_id,
+                     deallocated=False,
+                     deallocated_at=None)
+                for address in addresses]
+    context.session.bulk_insert_mappings(models.MacAddress, mappings)
+
+    query = context.session.query(models.MacAddress)
+    query = query.filter(models.MacAddress.address.in_(addresses))
+    return query.all()
+
+
+def mac_address_create_deallocated_bulk(context, mac_address_range_id,
+                                        addresses):
+    """Bulk-insert MACs directly into the deallocated pool.
+
+    Rows are back-dated by ipam_reuse_after so they can be reallocated
+    immediately. Addresses that already have a row are skipped. The
+    addresses come from leased blocks, which were added to allocated_count
+    when they were leased.
+    """
+    existing = mac_address_find_existing(context, addresses)
+    reusable_at = timeutils.utcnow() - datetime.timedelta(
+        seconds=CONF.QUARK.ipam_reuse_after)
+    mappings = [dict(address=address,
+                     mac_address_range_id=mac_address_range_id,
+                     tenant_id=context.tenant_id,
+                     deallocated=True,
+                     deallocated_at=reusable_at)
+                for address in addresses if address not in existing]
+    if not mappings:
+        return 0
+    context.session.bulk_insert_mappings(models.MacAddress, mappings)
+    return len(mappings)
+
+
+def mac_address_create(context, count_allocated=True, **mac_dict):
+    """Creates a MAC row.
+
+    MACs handed out through next_auto_assign_mac were already added to
+    their range's allocated_count by the update that reserved them, so
+    callers pass count_allocated=False for those.
+    """
     mac_address = models.MacAddress()
     mac_address.update(mac_dict)
     mac_address["tenant_id"] = context.tenant_id
     mac_address["deallocated"] = False
     mac_address["deallocated_at"] = None
     context.session.add(mac_address)
+    if count_allocated and mac_address["mac_address_range_id"]:
+        mac_range_update_allocated_count(
+            context, mac_address["mac_address_range_id"], 1)
     return mac_address
 
 
 INVERT_DEFAULTS = 'invert_defaults'
 
 
+def _merge_cached(session, instance):
+    """Merges a detached, loaded instance into session without a query.
+
+    merge() only carries over the relationships that cascade merges, so
+    the other loaded ones are merged and set here, one level deep.
+    """
+    state = sa_inspect(instance)
+    merged = session.merge(instance, load=False)
+    for rel in state.mapper.relationships:
+        if rel.key in state.unloaded or "merge" in rel.cascade:
+            continue
+        value = state.dict.get(rel.key)
+        if rel.uselist:
+            value = [session.merge(v, load=False) for v in value or []]
+        elif value is not None:
+            value = session.merge(value, load=False)
+        orm.attributes.set_committed_value(merged, rel.key, value)
+    return merged
+
+
+def _provider_find(context, model, ids, options):
+    """Returns the provider models with ids, from the cache if possible.
+
+    Misses are loaded with options in a session of their own, so the
+    cached copies are detached and fully loaded. Each caller gets a copy
+    merged into its own session, without a query.
+    """
+    found = {}
+    missing = []
+    for model_id in set(ids):
+        cached = provider_cache.CACHE.get(model, model_id)
+        if cached is None:
+            missing.append(model_id)
+        else:
+            found[model_id] = cached
+
+    if missing:
+        session = neutron_db_api.get_session()
+        try:
+            query = session.query(model).options(*options)
+            loaded = query.filter(model.id.in_(missing)).all()
+            session.expunge_all()
+        finally:
+            session.close()
+        for instance in loaded:
+            provider_cache.CACHE.put(model, instance.id, instance)
+            found[instance.id] = instance
+
+    return [_merge_cached(context.session, found[model_id])
+            for model_id in sorted(found)]
+
+
 @scoped
 def network_find(context, limit=None, sorts=None, marker=None,
-                 page_reverse=False, fields=None, **filters):
+                 page_reverse=False, fields=None, columns=None, cached=False,
+                 **filters):
+    """Finds networks.
+
+    With cached, a lookup of provider networks by id alone is served from
+    provider_cache.CACHE when it is enabled. Only read paths, such as
+    get_network(s), pass it; the caller must only read what it gets back.
+    """
     ids = []
     defaults = []
     provider_query = False
@@ -588,14 +1103,21 @@ def network_find(context, limit=None, sorts=None, marker=None,
         else:
             defaults.insert(0, INVERT_DEFAULTS)
         filters.pop("shared")
+    if cached and provider_query and not (limit or marker or columns):
+        if provider_cache.CACHE.enabled:
+            return _provider_find(context, models.Network, defaults,
+                                  [orm.joinedload(models.Network.subnets)])
     return _network_find(context, limit, sorts, marker, page_reverse, fields,
                          defaults=defaults, provider_query=provider_query,
-                         **filters)
+                         columns=columns, **filters)
 
 
 def _network_find(context, limit, sorts, marker, page_reverse, fields,
-                  defaults=None, provider_query=False, **filters):
+                  defaults=None, provider_query=False, columns=None,
+                  **filters):
     query = context.session.query(models.Network)
+    if columns:
+        query = _project(query, models.Network, columns)
     model_filters = _model_query(context, models.Network, filters, query)
 
     if defaults:
@@ -615,10 +1137,10 @@ def _network_find(context, limit, sorts, marker, page_reverse, fields,
     else:
         query = query.filter(*model_filters)
 
-    if "join_subnets" in filters:
+    if "join_subnets" in filters and not columns:
         query = query.options(orm.joinedload(models.Network.subnets))
 
-    return paginate_query(query, models.Network, limit, sorts, marker)
+    return _paginate(query, models.Network, limit, sorts, marker)
 
 
 def network_create(context, **network):
@@ -629,6 +1151,7 @@ def network_create(context, **network):
 
 
 def network_update(context, network, **kwargs):
+    provider_cache.CACHE.invalidate(models.Network, network["id"])
     network.update(kwargs)
     context.session.add(network)
     return network
@@ -641,24 +1164,23 @@ def network_count_all(context):
 
 
 def network_delete(context, network):
+    provider_cache.CACHE.invalidate(models.Network, network["id"])
     context.session.delete(network)
 
 
 def _subnet_find_ordered_by_used_ips(context, net_id, lock_subnets=True,
                                      order="asc", unused=False, **filters):
-    count = sql_func.count(models.IPAddress.address).label("count")
+    count = models.Subnet.used_count
     size = (models.Subnet.last_ip - models.Subnet.first_ip)
     query = context.session.query(models.Subnet, count)
     if lock_subnets:
         query = query.with_lockmode("update")
     query = query.filter_by(do_not_use=False)
-    query = query.outerjoin(models.Subnet.generated_ips)
-    query = query.group_by(models.Subnet.id)
 
     query = query.order_by(asc(models.Subnet.ip_version))
 
     if unused:  # find unused subnets
-        query = query.having(count == 0)
+        query = query.filter(count == 0)
     else:  # otherwise, order used subnets
         if order == "desc":
             query = query.order_by(desc(size - count))
@@ -695,22 +1217,70 @@ def subnet_find_unused(context, net_id, lock_subnets=True,
         context, net_id, lock_subnets=lock_subnets, unused=True, **filters)
 
 
-def subnet_update_next_auto_assign_ip(context, subnet):
+def subnet_update_used_count(context, subnet_id, delta):
+    query = context.session.query(models.Subnet)
+    query = query.filter(models.Subnet.id == subnet_id)
+    return query.update(
+        {"used_count": models.Subnet.used_count + delta},
+        synchronize_session=False)
+
+
+def subnet_update_next_auto_assign_ip(context, subnet, step=1,
+                                      conditional=False):
     query = context.session.query(models.Subnet)
     query = query.filter(models.Subnet.id == subnet["id"])
     query = query.filter(models.Subnet.next_auto_assign_ip != -1)
-
+    if conditional or step != 1:
+        # A jump is computed from the value we read, and an unlocked read
+        # may be stale, so only apply it if nobody has moved the pointer
+        # since.
+        query = query.filter(models.Subnet.next_auto_assign_ip ==
+                             subnet["next_auto_assign_ip"])
+
+    # Each call hands out one address, so that is what used_count gains.
+    # Excluded addresses stepped over are never created.
     # For details on synchronize_session, see:
     # http://docs.sqlalchemy.org/en/rel_0_8/orm/query.html
     query = query.update(
         {"next_auto_assign_ip":
-         models.Subnet.next_auto_assign_ip + 1},
+         models.Subnet.next_auto_assign_ip + step,
+         "used_count": models.Subnet.used_count + 1},
         synchronize_session=False)
 
     # Returns a count of the rows matched in the update
     return query
 
 
+def subnet_lease_next_auto_assign_ips(context, subnet, count, used=None):
+    """Atomically reserve up to count addresses from next_auto_assign_ip.
+
+    The update only matches if next_auto_assign_ip hasn't moved since the
+    subnet was read, so two workers can never lease overlapping blocks.
+    The same update adds used, the number of addresses in the block that
+    will be handed out (all of them by default), to used_count.
+    Returns the (first, last) inclusive integer range that was reserved,
+    or None if the subnet is full or the row changed underneath us.
+    """
+    first = subnet["next_auto_assign_ip"]
+    if first == -1 or first > subnet["last_ip"]:
+        return
+    last = min(first + count - 1, subnet["last_ip"])
+
+    query = context.session.query(models.Subnet)
+    query = query.filter(models.Subnet.id == subnet["id"])
+    query = query.filter(models.Subnet.next_auto_assign_ip == first)
+    if used is None:
+        used = last - first + 1
+    row_count = query.update(
+        {"next_auto_assign_ip":
+         models.Subnet.next_auto_assign_ip + (last - first + 1),
+         "used_count": models.Subnet.used_count + used},
+        synchronize_session=False)
+    if row_count != 1:
+        return
+    return first, last
+
+
 def subnet_update_set_full(context, subnet):
     query = context.session.query(models.Subnet)
     query = query.filter_by(id=subnet["id"])
@@ -730,6 +1300,7 @@ def subnet_update_set_alloc_pool_cache(context, subnet, cache_data=None):
     if cache_data is not None:
         cache_data = json.dumps(cache_data)
     update_kwargs = {"_allocation_pool_cache": cache_data}
+    provider_cache.CACHE.invalidate(models.Subnet, subnet.id)
     query = context.session.query(models.Subnet)
     query = query.filter(models.Subnet.id == subnet.id)
     row_count = query.update(update_kwargs,
@@ -741,7 +1312,12 @@ def subnet_update_set_alloc_pool_cache(context, subnet, cache_data=None):
 
 @scoped
 def subnet_find(context, limit=None, page_reverse=False, sorts=None,
-                marker_obj=None, fields=None, **filters):
+                marker_obj=None, fields=None, columns=None, cached=False,
+                **filters):
+    """Finds subnets.
+
+    cached works as it does for network_find.
+    """
     ids = []
     defaults = []
     provider_query = False
@@ -765,14 +1341,25 @@ def subnet_find(context, limit=None, page_reverse=False, sorts=None,
         else:
             defaults.insert(0, INVERT_DEFAULTS)
         filters.pop("shared")
+    if cached and provider_query and not (limit or marker_obj or columns):
+        if provider_cache.CACHE.enabled:
+            return _provider_find(
+                context, models.Subnet, defaults,
+                [orm.joinedload(models.Subnet.dns_nameservers),
+                 orm.joinedload(models.Subnet.routes),
+                 orm.undefer("_allocation_pool_cache")])
     return _subnet_find(context, limit, sorts, marker_obj, page_reverse,
                         fields, defaults=defaults,
-                        provider_query=provider_query, **filters)
+                        provider_query=provider_query, columns=columns,
+                        **filters)
 
 
 def _subnet_find(context, limit, sorts, marker, page_reverse, fields,
-                 defaults=None, provider_query=False, **filters):
+                 defaults=None, provider_query=False, columns=None,
+                 **filters):
     query = context.session.query(models.Subnet)
+    if columns:
+        query = _project(query, models.Subnet, columns)
     model_filters = _model_query(context, models.Subnet, filters, query)
 
     if defaults:
@@ -792,16 +1379,16 @@ def _subnet_find(context, limit, sorts, marker, page_reverse, fields,
     else:
         query = query.filter(*model_filters)
 
-    if "join_dns" in filters:
+    if "join_dns" in filters and not columns:
         query = query.options(orm.joinedload(models.Subnet.dns_nameservers))
 
-    if "join_routes" in filters:
+    if "join_routes" in filters and not columns:
         query = query.options(orm.joinedload(models.Subnet.routes))
 
-    if "join_pool" in filters:
+    if "join_pool" in filters and not columns:
         query = query.options(orm.undefer('_allocation_pool_cache'))
 
-    return paginate_query(query, models.Subnet, limit, sorts, marker)
+    return _paginate(query, models.Subnet, limit, sorts, marker)
 
 
 def subnet_count_all(context, **filters):
@@ -814,6 +1401,8 @@ def subnet_count_all(context, **filters):
 
 
 def subnet_delete(context, subnet):
+    provider_cache.CACHE.invalidate(models.Subnet, subnet["id"])
+    provider_cache.CACHE.invalidate(models.Network, subnet["network_id"])
     context.session.delete(subnet)
 
 
@@ -822,10 +1411,13 @@ def subnet_create(context, **subnet_dict):
     subnet.update(subnet_dict)
     subnet["tenant_id"] = context.tenant_id
     context.session.add(subnet)
+    if subnet["network_id"]:
+        provider_cache.CACHE.invalidate(models.Network, subnet["network_id"])
     return subnet
 
 
 def subnet_update(context, subnet, **kwargs):
+    provider_cache.CACHE.invalidate(models.Subnet, subnet["id"])
     subnet.update(kwargs)
     context.session.add(subnet)
     return subnet
@@ -843,16 +1435,19 @@ def route_create(context, **route_dict):
     new_route.update(route_dict)
     new_route["tenant_id"] = context.tenant_id
     context.session.add(new_route)
+    provider_cache.CACHE.invalidate(models.Subnet, new_route["subnet_id"])
     return new_route
 
 
 def route_update(context, route, **kwargs):
+    provider_cache.CACHE.invalidate(models.Subnet, route["subnet_id"])
     route.update(kwargs)
     context.session.add(route)
     return route
 
 
 def route_delete(context, route):
+    provider_cache.CACHE.invalidate(models.Subnet, route["subnet_id"])
     context.session.delete(route)
 
 
@@ -863,10 +1458,13 @@ def dns_create(context, **dns_dict):
     dns_nameserver["ip"] = int(ip)
     dns_nameserver["tenant_id"] = context.tenant_id
     context.session.add(dns_nameserver)
+    provider_cache.CACHE.invalidate(models.Subnet,
+                                    dns_nameserver["subnet_id"])
     return dns_nameserver
 
 
 def dns_delete(context, dns):
+    provider_cache.CACHE.invalidate(models.Subnet, dns["subnet_id"])
     context.session.delete(dns)
 
 
@@ -953,6 +1551,9 @@ def ip_policy_create(context, **ip_policy_dict):
     new_policy.update(ip_policy_dict)
     new_policy["tenant_id"] = context.tenant_id
     context.session.add(new_policy)
+    # Subnet views show their policy, and policy changes are rare enough
+    # to just drop every cached provider view
+    provider_cache.CACHE.clear()
     return new_policy
 
 
@@ -976,13 +1577,18 @@ def ip_policy_update(context, ip_policy, **ip_policy_dict):
                                     last_ip=cidr_net.last))
             ip_set.add(excluded_cidr)
         ip_policy_dict["size"] = ip_set.size
+        # Compiled copies of this policy are keyed on the revision, so
+        # bumping it retires them in every process.
+        ip_policy_dict["revision"] = (ip_policy["revision"] or 0) + 1
 
     ip_policy.update(ip_policy_dict)
     context.session.add(ip_policy)
+    provider_cache.CACHE.clear()
     return ip_policy
 
 
 def ip_policy_delete(context, ip_policy):
+    provider_cache.CACHE.clear()
     context.session.delete(ip_policy)
 
 
@@ -1010,8 +1616,8 @@ def floating_ip_find(context, lock_mode=False, limit=None, sorts=None,
         model_filters.append(
             models.IPAddress.transaction_id == filters['transaction_id'])
 
-    return paginate_query(query.filter(*model_filters), models.IPAddress,
-                          limit, sorts, marker)
+    return _paginate(query.filter(*model_filters), models.IPAddress, limit,
+                     sorts, marker)
 
 
 def floating_ip_associate_fixed_ip(context, floating_ip, fixed_ip):
@@ -13,9 +13,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import struct
+
 from sqlalchemy.dialects import sqlite
 from sqlalchemy import types
 
+_UINT64_MASK = (1 << 64) - 1
+
+
+def pack_inet(value):
+    """Packs an integer address into 16 big endian bytes.
+
+    Fixed width big endian keeps byte order and numeric order the same, so
+    the packed values index and range compare like the integers.
+    """
+    value = long(value)
+    return struct.pack("!QQ", value >> 64, value & _UINT64_MASK)
+
+
+def unpack_inet(raw):
+    high, low = struct.unpack("!QQ", raw)
+    return (high << 64) | low
+
 
 class INET(types.TypeDecorator):
     impl = types.CHAR
@@ -45,6 +64,30 @@ class INET(types.TypeDecorator):
         return self
 
 
+class BinaryINET(types.TypeDecorator):
+    """An integer address stored as BINARY(16) instead of decimal CHAR(39)."""
+    impl = types.BINARY
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'sqlite':
+            return dialect.type_descriptor(types.LargeBinary())
+        return dialect.type_descriptor(types.BINARY(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return value
+        return pack_inet(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return value
+        return unpack_inet(bytes(value))
+
+    def coerce_compared_value(self, op, value):
+        # Compared integers have to be packed the same way as the column
+        return self
+
+
 class MACAddress(types.TypeDecorator):
     impl = types.BigInteger
 
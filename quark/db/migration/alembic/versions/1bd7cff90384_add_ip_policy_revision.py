@@ -0,0 +1,24 @@
+"""Add revision to quark_ip_policy
+
+Revision ID: 1bd7cff90384
+Revises: 3c2fa8a10b34
+Create Date: 2016-07-19 14:02:37.611254
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1bd7cff90384'
+down_revision = '3c2fa8a10b34'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('quark_ip_policy', sa.Column('revision', sa.Integer(),
+                                               nullable=False,
+                                               server_default='0'))
+
+
+def downgrade():
+    op.drop_column('quark_ip_policy', 'revision')
@@ -0,0 +1,40 @@
+"""Add BINARY(16) copies of the INET address columns
+
+Revision ID: 2e9cf60b0ef6
+Revises: 5a8c0b2d7e61
+Create Date: 2016-08-02 14:31:07.120933
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2e9cf60b0ef6'
+down_revision = '5a8c0b2d7e61'
+
+from alembic import op
+import sqlalchemy as sa
+
+from quark.db.custom_types import BinaryINET
+
+# The columns are nullable and left empty so adding them is an online
+# change. quark-inet-backfill fills in existing rows afterwards, in
+# batches, while new rows get them on insert.
+COLUMNS = [("quark_ip_addresses", "address"),
+           ("quark_subnets", "first_ip"),
+           ("quark_subnets", "last_ip"),
+           ("quark_ip_policy_cidrs", "first_ip"),
+           ("quark_ip_policy_cidrs", "last_ip")]
+
+
+def upgrade():
+    for table, column in COLUMNS:
+        op.add_column(table, sa.Column(column + "_bin", BinaryINET(),
+                                       nullable=True))
+    op.create_index(op.f('ix_quark_ip_addresses_address_bin'),
+                    'quark_ip_addresses', ['address_bin'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_quark_ip_addresses_address_bin'),
+                  table_name='quark_ip_addresses')
+    for table, column in reversed(COLUMNS):
+        op.drop_column(table, column + "_bin")
@@ -0,0 +1,34 @@
+"""Add used_count to quark_subnets
+
+Revision ID: 3c2fa8a10b34
+Revises: 2a116b962c95
+Create Date: 2016-07-12 10:41:18.204117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c2fa8a10b34'
+down_revision = '2a116b962c95'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import column, select, table
+
+
+def upgrade():
+    op.add_column('quark_subnets', sa.Column('used_count', sa.BigInteger(),
+                                             nullable=False,
+                                             server_default='0'))
+
+    subnets = table('quark_subnets',
+                    column('id', sa.String(length=36)),
+                    column('used_count', sa.BigInteger()))
+    ip_addresses = table('quark_ip_addresses',
+                         column('subnet_id', sa.String(length=36)))
+    count = select([sa.func.count()]).where(
+        ip_addresses.c.subnet_id == subnets.c.id).as_scalar()
+    op.execute(subnets.update().values(used_count=count))
+
+
+def downgrade():
+    op.drop_column('quark_subnets', 'used_count')
@@ -0,0 +1,33 @@
+"""Add composite indexes for IP reallocation and availability
+
+Revision ID: 4b2a1d9c6e30
+Revises: 2e9cf60b0ef6
+Create Date: 2016-08-09 10:52:31.604418
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b2a1d9c6e30'
+down_revision = '2e9cf60b0ef6'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(op.f('ix_quark_ip_addresses_reallocation'),
+                    'quark_ip_addresses',
+                    ['network_id', '_deallocated', 'version', 'lock_id',
+                     'subnet_id', 'deallocated_at'],
+                    unique=False)
+    op.create_index(op.f('ix_quark_ip_addresses_availability'),
+                    'quark_ip_addresses',
+                    ['subnet_id', '_deallocated', 'lock_id', 'deallocated_at',
+                     'address'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_quark_ip_addresses_availability'),
+                  table_name='quark_ip_addresses')
+    op.drop_index(op.f('ix_quark_ip_addresses_reallocation'),
+                  table_name='quark_ip_addresses')
@@ -0,0 +1,34 @@
+"""Add allocated_count to quark_mac_address_ranges
+
+Revision ID: 5a8c0b2d7e61
+Revises: 1bd7cff90384
+Create Date: 2016-07-26 09:12:44.380519
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a8c0b2d7e61'
+down_revision = '1bd7cff90384'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql import column, select, table
+
+
+def upgrade():
+    op.add_column('quark_mac_address_ranges',
+                  sa.Column('allocated_count', sa.BigInteger(),
+                            nullable=False, server_default='0'))
+
+    ranges = table('quark_mac_address_ranges',
+                   column('id', sa.String(length=36)),
+                   column('allocated_count', sa.BigInteger()))
+    macs = table('quark_mac_addresses',
+                 column('mac_address_range_id', sa.String(length=36)))
+    count = select([sa.func.count()]).where(
+        macs.c.mac_address_range_id == ranges.c.id).as_scalar()
+    op.execute(ranges.update().values(allocated_count=count))
+
+
+def downgrade():
+    op.drop_column('quark_mac_address_ranges', 'allocated_count')
@@ -33,6 +33,7 @@ from sqlalchemy import orm
 
 from quark.db import custom_types
 from quark.db import ip_types
+from quark import ip_policy_cache
 # NOTE(mdietz): This is the only way to actually create the quotas table,
 #              regardless if we need it. This is how it's done upstream.
 # NOTE(jhammond): If it isn't obvious quota_driver is unused and that's ok.
@@ -60,6 +61,19 @@ def _default_list_getset(collection_class, proxy):
     return getter, setter
 
 
+def _copy_of(column):
+    """Insert default that copies another column's value.
+
+    The *_bin columns hold the same addresses as their INET counterparts
+    in BINARY(16) form. Addresses and ranges are never updated in place,
+    so filling them in on insert, bulk inserts included, keeps them in
+    step.
+    """
+    def default(context):
+        return context.current_parameters.get(column)
+    return default
+
+
 class QuarkBase(neutron.db.model_base.NeutronBaseV2):
     created_at = sa.Column(sa.DateTime(), default=timeutils.utcnow)
     __table_args__ = TABLE_KWARGS
@@ -152,6 +166,8 @@ class IPAddress(BASEV2, models.HasId):
                       TABLE_KWARGS)
     address_readable = sa.Column(sa.String(128), nullable=False)
     address = sa.Column(custom_types.INET(), nullable=False, index=True)
+    address_bin = sa.Column(custom_types.BinaryINET(), index=True,
+                            default=_copy_of("address"))
     subnet_id = sa.Column(sa.String(36),
                           sa.ForeignKey("quark_subnets.id",
                                         ondelete="CASCADE"))
@@ -229,6 +245,20 @@ class IPAddress(BASEV2, models.HasId):
     fixed_ip = None
 
 
+# Equality columns of the reallocation UPDATE/claim first, then the
+# deallocated_at range.
+sa.Index("ix_quark_ip_addresses_reallocation",
+         IPAddress.__table__.c.network_id, IPAddress.__table__.c._deallocated,
+         IPAddress.__table__.c.version, IPAddress.__table__.c.lock_id,
+         IPAddress.__table__.c.subnet_id,
+         IPAddress.__table__.c.deallocated_at)
+# Covers the quark_ip_addresses side of ip_availability.get_used_ips
+sa.Index("ix_quark_ip_addresses_availability",
+         IPAddress.__table__.c.subnet_id, IPAddress.__table__.c._deallocated,
+         IPAddress.__table__.c.lock_id, IPAddress.__table__.c.deallocated_at,
+         IPAddress.__table__.c.address)
+
+
 class FloatingToFixedIPAssociation(object):
     pass
 
@@ -353,8 +383,19 @@ class Subnet(BASEV2, models.HasId, IsHazTags):
 
     first_ip = sa.Column(custom_types.INET())
     last_ip = sa.Column(custom_types.INET())
+    first_ip_bin = sa.Column(custom_types.BinaryINET(),
+                             default=_copy_of("first_ip"))
+    last_ip_bin = sa.Column(custom_types.BinaryINET(),
+                            default=_copy_of("last_ip"))
     ip_version = sa.Column(sa.Integer())
     next_auto_assign_ip = sa.Column(custom_types.INET())
+    # NOTE: number of quark_ip_addresses rows (allocated or not) generated
+    #       in this subnet, plus addresses leased but not yet created.
+    #       Maintained by the db api so subnet selection doesn't have to
+    #       count them. Auto assigned addresses are counted by the update
+    #       that moves next_auto_assign_ip, not when their row is added.
+    used_count = sa.Column(sa.BigInteger(), nullable=False, default=0,
+                           server_default="0")
 
     allocated_ips = orm.relationship(IPAddress,
                                      primaryjoin='and_(Subnet.id=='
@@ -490,6 +531,12 @@ class MacAddressRange(BASEV2, models.HasId):
                                       backref="mac_address_range")
     do_not_use = sa.Column(sa.Boolean(), default=False, nullable=False,
                            server_default='0')
+    # NOTE: number of quark_mac_addresses rows in this range, plus MACs
+    #       leased but not yet created. Auto assigned MACs are counted by
+    #       the update that moves next_auto_assign_mac, not when their row
+    #       is added.
+    allocated_count = sa.Column(sa.BigInteger(), nullable=False, default=0,
+                                server_default="0")
 
 
 class IPPolicy(BASEV2, models.HasId, models.HasTenant):
@@ -509,12 +556,46 @@ class IPPolicy(BASEV2, models.HasId, models.HasTenant):
     name = sa.Column(sa.String(255), nullable=True)
     description = sa.Column(sa.String(255), nullable=True)
     size = sa.Column(custom_types.INET())
+    revision = sa.Column(sa.Integer(), nullable=False, default=0,
+                         server_default="0")
 
     def get_cidrs_ip_set(self):
         ip_policies = self.get("exclude", [])
         ip_policy_cidrs = [ip_policy.cidr for ip_policy in ip_policies]
         return netaddr.IPSet(ip_policy_cidrs)
 
+    def get_exclude_intervals(self):
+        """Returns the excluded ranges as sorted, merged (first, last) pairs.
+
+        Bounds are inclusive integers in the same v6 mapped form as
+        Subnet.next_auto_assign_ip.
+        """
+        ranges = []
+        for ip_policy_cidr in self.get("exclude", []):
+            first = ip_policy_cidr.first_ip
+            last = ip_policy_cidr.last_ip
+            if first is None or last is None:
+                net = netaddr.IPNetwork(ip_policy_cidr.cidr).ipv6()
+                first, last = net.first, net.last
+            ranges.append((first, last))
+        ranges.sort()
+
+        intervals = []
+        for first, last in ranges:
+            if intervals and first <= intervals[-1][1] + 1:
+                if last > intervals[-1][1]:
+                    intervals[-1] = (intervals[-1][0], last)
+            else:
+                intervals.append((first, last))
+        return intervals
+
+    def get_compiled_set(self):
+        """Returns the cached CompiledIPPolicy for this policy revision."""
+        return ip_policy_cache.CACHE.get(
+            self.get("id"), self.get("revision"),
+            lambda: ip_policy_cache.CompiledIPPolicy(
+                self.get_exclude_intervals()))
+
 
 class IPPolicyCIDR(BASEV2, models.HasId):
     __tablename__ = "quark_ip_policy_cidrs"
@@ -523,6 +604,10 @@ class IPPolicyCIDR(BASEV2, models.HasId):
     cidr = sa.Column(sa.String(64))
     first_ip = sa.Column(custom_types.INET())
     last_ip = sa.Column(custom_types.INET())
+    first_ip_bin = sa.Column(custom_types.BinaryINET(),
+                             default=_copy_of("first_ip"))
+    last_ip_bin = sa.Column(custom_types.BinaryINET(),
+                            default=_copy_of("last_ip"))
 
 
 class Network(BASEV2, models.HasId):
@@ -0,0 +1,193 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Keyset (seek) pagination with opaque cursors.
+
+A cursor holds the sort column values of the last row of a page, plus its
+id as a tie breaker. The next page is then a range scan starting at those
+values, so it costs the same however deep it is, and the marker row never
+has to be loaded. Listing functions take a cursor wherever they take a
+marker; model object markers keep using neutron's paginate_query.
+
+NULLs sort before every other value, as MySQL orders them: first when
+ascending and last when descending.
+"""
+
+import base64
+import datetime
+import json
+import urllib
+
+from neutron_lib import exceptions as n_exc
+from sqlalchemy import and_, asc, desc, false, or_, true
+
+CURSOR_PREFIX = "k1."
+_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {"dt": value.strftime(_DATETIME_FORMAT)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.datetime.strptime(value["dt"], _DATETIME_FORMAT)
+    return value
+
+
+def is_cursor(marker):
+    return isinstance(marker, basestring)
+
+
+def sort_keys(sorts):
+    """Returns [(key, ascending)] for sorts, always ending with id."""
+    keys = []
+    for key, direction in sorts or []:
+        # neutron passes True for ascending, direct callers use "asc"
+        keys.append((key, direction not in (False, "desc")))
+    if "id" not in [key for key, _ascending in keys]:
+        ascending = keys[-1][1] if keys else True
+        keys.append(("id", ascending))
+    return keys
+
+
+def encode_cursor(values):
+    data = json.dumps([_encode_value(v) for v in values])
+    return CURSOR_PREFIX + base64.urlsafe_b64encode(data)
+
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(str(cursor[len(CURSOR_PREFIX):]))
+        return [_decode_value(v) for v in json.loads(data)]
+    except (TypeError, ValueError):
+        raise n_exc.BadRequest(resource="pagination",
+                               msg="Invalid pagination cursor")
+
+
+def cursor_for(item, sorts=None):
+    """Returns the cursor of the page that follows item.
+
+    item is a model or a dict view of one, e.g. the last element of a
+    get_ports result, and sorts the sorts the page was listed with.
+    """
+    return encode_cursor([item[key] for key, _asc in sort_keys(sorts)])
+
+
+def _columns(model, keys):
+    try:
+        return [getattr(model, key) for key, _asc in keys]
+    except AttributeError as e:
+        raise n_exc.BadRequest(resource="pagination", msg=str(e))
+
+
+def _marker_values(query, model, keys, marker):
+    if marker.startswith(CURSOR_PREFIX):
+        values = decode_cursor(marker)
+        if len(values) != len(keys):
+            raise n_exc.BadRequest(resource="pagination",
+                                   msg="Cursor doesn't match the sort keys")
+        return values
+
+    # A plain id, as neutron passes for native pagination. Only the sort
+    # columns are loaded, not the whole marker row.
+    columns = _columns(model, keys)
+    row = query.session.query(*columns).filter(model.id == marker).first()
+    if row is None:
+        raise n_exc.BadRequest(resource="pagination",
+                               msg="Unknown pagination marker %s" % marker)
+    return list(row)
+
+
+def next_link(url, params, items, limit, sorts=None):
+    """Returns the next link of a page of items listed with limit.
+
+    The link is url with params and a marker holding the cursor of the
+    last item, in the {"rel": "next", "href": ...} form neutron uses for
+    <collection>_links. A page shorter than limit is the last one and
+    gets None.
+    """
+    if not limit or len(items) < limit:
+        return
+    params = dict(params)
+    params["marker"] = cursor_for(items[-1], sorts)
+    return {"rel": "next",
+            "href": "%s?%s" % (url, urllib.urlencode(sorted(params.items())))}
+
+
+def _nullable(column):
+    return getattr(column, "nullable", True)
+
+
+def _equal(column, value):
+    if value is None:
+        return column.is_(None)
+    return column == value
+
+
+def _past(column, value, ascending):
+    """Rows of column strictly after value in the sort order."""
+    if ascending:
+        if value is None:
+            return column.isnot(None)
+        return column > value
+    if value is None:
+        return false()
+    if _nullable(column):
+        return or_(column < value, column.is_(None))
+    return column < value
+
+
+def _lead(column, value, ascending):
+    """Rows of column at or after value in the sort order."""
+    if ascending:
+        if value is None:
+            return true()
+        return column >= value
+    if value is None:
+        return column.is_(None)
+    if _nullable(column):
+        return or_(column <= value, column.is_(None))
+    return column <= value
+
+
+def keyset_query(query, model, limit, sorts, marker):
+    """Orders query by sorts and returns the page after marker.
+
+    marker is a cursor from cursor_for or the id of the previous page's
+    last row.
+    """
+    keys = sort_keys(sorts)
+    columns = _columns(model, keys)
+    values = _marker_values(query, model, keys, marker)
+
+    after = []
+    for i, (column, (_key, ascending)) in enumerate(zip(columns, keys)):
+        equal = [_equal(c, v) for c, v in zip(columns[:i], values[:i])]
+        past = _past(column, values[i], ascending)
+        after.append(and_(*(equal + [past])))
+
+    # Bounding the leading column on its own lets the database start the
+    # index range scan at the cursor instead of filtering from the start.
+    lead = _lead(columns[0], values[0], keys[0][1])
+    query = query.filter(lead, or_(*after))
+
+    for column, (_key, ascending) in zip(columns, keys):
+        query = query.order_by(asc(column) if ascending else desc(column))
+    if limit:
+        query = query.limit(limit)
+    return query
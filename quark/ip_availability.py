@@ -26,6 +26,7 @@ from oslo_log import log as logging
 from oslo_utils import timeutils
 from sqlalchemy import and_, or_, func, not_
 
+from quark.db import api as db_api
 from quark.db import models
 
 LOG = logging.getLogger(__name__)
@@ -117,8 +118,9 @@ def get_used_ips(session, **kwargs):
             models.IPPolicyCIDR,
             and_(
                 models.Subnet.ip_policy_id == models.IPPolicyCIDR.ip_policy_id,
-                models.IPAddress.address >= models.IPPolicyCIDR.first_ip,
-                models.IPAddress.address <= models.IPPolicyCIDR.last_ip))
+                db_api.inet_within(models.IPAddress.address,
+                                   models.IPPolicyCIDR.first_ip,
+                                   models.IPPolicyCIDR.last_ip)))
         # NOTE(asadoughi): (address is allocated) OR
         # (address is deallocated and not inside subnet's IP policy)
         query = query.filter(or_(
@@ -0,0 +1,136 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import collections
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from quark import address_math
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.IntOpt('ip_policy_cache_size',
+               default=1024,
+               help=_('Number of compiled IP policies to keep in memory per '
+                      'process. 0 disables the cache.'))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+
+def _to_int(ip):
+    if isinstance(ip, (int, long)):
+        return ip
+    return address_math.to_v6(*address_math.parse_ip(ip))
+
+
+class CompiledIPPolicy(object):
+    """Excluded ranges of an IP policy as sorted integer intervals.
+
+    Supports the membership and truthiness checks the IPAM code performs
+    against netaddr.IPSet, but without building the set on every call.
+    v4 addresses are compared in their v6 mapped form, so an IPAddress of
+    either version, its string form or the stored integer may be tested.
+    """
+    __slots__ = ["starts", "ends", "size"]
+
+    def __init__(self, intervals):
+        self.starts = [first for first, last in intervals]
+        self.ends = [last for first, last in intervals]
+        self.size = sum(last - first + 1 for first, last in intervals)
+
+    def __contains__(self, ip):
+        value = _to_int(ip)
+        idx = bisect.bisect_right(self.starts, value) - 1
+        return idx >= 0 and value <= self.ends[idx]
+
+    def next_allowed(self, ip):
+        """Returns the first address >= ip that isn't excluded."""
+        value = _to_int(ip)
+        idx = bisect.bisect_right(self.starts, value) - 1
+        if idx >= 0 and value <= self.ends[idx]:
+            # Intervals are merged, so the next one can't be adjacent
+            return self.ends[idx] + 1
+        return value
+
+    def __nonzero__(self):
+        return bool(self.starts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def intervals(self):
+        return zip(self.starts, self.ends)
+
+
+EMPTY_POLICY = CompiledIPPolicy([])
+
+
+class IPPolicyCache(object):
+    """LRU of compiled policies keyed on (policy id, revision).
+
+    The revision is bumped whenever a policy's excluded CIDRs change, so a
+    stale entry is never returned even if another process made the change.
+    Local invalidation just frees the superseded entries early.
+    """
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return CONF.QUARK.ip_policy_cache_size
+
+    def get(self, policy_id, revision, compile_fn):
+        if self.max_size <= 0 or policy_id is None:
+            return compile_fn()
+
+        key = (policy_id, revision)
+        with self._lock:
+            compiled = self._entries.pop(key, None)
+            if compiled is not None:
+                self._entries[key] = compiled
+                return compiled
+
+        compiled = compile_fn()
+        with self._lock:
+            self._entries[key] = compiled
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def invalidate(self, policy_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == policy_id]:
+                del self._entries[key]
+        LOG.debug("Invalidated compiled IP policy {0}".format(policy_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+CACHE = IPPolicyCache()
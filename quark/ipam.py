@@ -17,14 +17,18 @@
 Quark Pluggable IPAM
 """
 
+import atexit
+import collections
 import functools
 import itertools
 import random
+import threading
 import time
 import uuid
 
 import netaddr
 from neutron.common import exceptions as n_exc_ext
+from neutron import context as neutron_context
 from neutron_lib import exceptions as n_exc
 from oslo_concurrency import lockutils
 from oslo_config import cfg
@@ -32,13 +36,17 @@ from oslo_db import exception as db_exception
 from oslo_log import log as logging
 from oslo_utils import timeutils
 
+from quark import address_math
 from quark.billing import notify
 from quark.db import api as db_api
 from quark.db import ip_types
 from quark.db import models
 from quark.drivers import floating_ip_registry as registry
 from quark import exceptions as q_exc
+from quark import ip_policy_cache
+from quark import ipam_metrics
 from quark import network_strategy
+from quark import subnet_selection
 from quark import utils
 
 LOG = logging.getLogger(__name__)
@@ -52,6 +60,13 @@ quark_opts = [
                       ' before failure. Also implicitly controls how many'
                       ' v6 addresses we assign to any port, as the random'
                       ' values generated will be the same every time.')),
+    cfg.IntOpt('v6_allocation_probe_batch',
+               default=1,
+               help=_('Number of generated v6 candidates to check against'
+                      ' policy and existing addresses with a single query'
+                      ' before inserting the first free one. Values less'
+                      ' than 2 insert candidates one at a time, relying on'
+                      ' duplicate entry errors to detect collisions.')),
     cfg.IntOpt("mac_address_retry_max",
                default=20,
                help=_("Number of times to attempt to allocate a new MAC"
@@ -67,7 +82,45 @@ quark_opts = [
     cfg.BoolOpt("ipam_select_subnet_v6_locking",
                 default=True,
                 help=_("Controls whether or not SELECT ... FOR UPDATE is used"
-                       " when retrieving v6 subnets explicitly."))
+                       " when retrieving v6 subnets explicitly.")),
+    cfg.BoolOpt("ipam_optimistic_subnet_selection",
+                default=False,
+                help=_("Read candidate subnets without SELECT ... FOR UPDATE"
+                       " and claim one with a conditional UPDATE of"
+                       " next_auto_assign_ip. Losing a race moves on to the"
+                       " next candidate instead of waiting on its lock.")),
+    cfg.IntOpt("ipam_v4_lease_block_size",
+               default=0,
+               help=_("Number of v4 addresses a worker reserves from a"
+                      " subnet's next_auto_assign_ip in a single update."
+                      " Addresses are then handed out from the worker's"
+                      " block without locking the subnet again. Values"
+                      " less than 2 disable leasing.")),
+    cfg.IntOpt("ipam_v4_lease_ttl",
+               default=300,
+               help=_("Seconds a leased block of v4 addresses is served from"
+                      " before its unused addresses are returned to the"
+                      " deallocated pool.")),
+    cfg.IntOpt("mac_address_lease_block_size",
+               default=0,
+               help=_("Number of MACs a worker reserves from a MAC range's"
+                      " next_auto_assign_mac in a single update. MACs are"
+                      " then handed out from the worker's block without"
+                      " locking the range again. Values less than 2"
+                      " disable leasing.")),
+    cfg.IntOpt("mac_address_lease_ttl",
+               default=300,
+               help=_("Seconds a leased block of MACs is served from before"
+                      " its unused MACs are returned to the deallocated"
+                      " pool.")),
+    cfg.BoolOpt("ipam_reallocate_single_claim",
+                default=False,
+                help=_("Claim reallocatable IPs with a single SELECT ... FOR"
+                       " UPDATE (SKIP LOCKED on MySQL 8.0.1 and later)"
+                       " instead of tagging a row with a transaction and"
+                       " reading it back. The transaction based path is used"
+                       " as a fallback if the claim fails or finds"
+                       " nothing."))
 ]
 
 CONF.register_opts(quark_opts, "QUARK")
@@ -99,10 +152,11 @@ else:
 
 def rfc2462_ip(mac, cidr):
     # NOTE(mdietz): see RFC2462
-    int_val = netaddr.IPNetwork(cidr).value
-    mac = netaddr.EUI(mac)
-    LOG.info("Using RFC2462 method to generate a v6 with MAC %s" % mac)
-    int_val += mac.eui64().value
+    int_val = address_math.cidr_value(cidr)
+    mac = address_math.mac_to_int(mac)
+    LOG.info("Using RFC2462 method to generate a v6 with MAC %s" %
+             address_math.format_mac(mac))
+    int_val += address_math.eui64(mac)
     int_val ^= MAGIC_INT
     return int_val
 
@@ -113,7 +167,7 @@ def rfc3041_ip(port_id, cidr):
     else:
         random_stuff = uuid.UUID(port_id)
     random.seed(int(random_stuff))
-    int_val = netaddr.IPNetwork(cidr).value
+    int_val = address_math.cidr_value(cidr)
     while True:
         rand_bits = random.getrandbits(64)
         LOG.info("Using RFC3041 method to generate a v6 with bits %s" %
@@ -146,7 +200,7 @@ def generate_v6(mac, port_id, cidr):
 
 def ipam_logged(fx):
     def wrap(self, *args, **kwargs):
-        log = QuarkIPAMLog()
+        log = QuarkIPAMLog(strategy=getattr(self, "name", None))
         kwargs['ipam_log'] = log
         try:
             return fx(self, *args, **kwargs)
@@ -156,9 +210,13 @@ def ipam_logged(fx):
 
 
 class QuarkIPAMLog(object):
-    def __init__(self):
+    def __init__(self, strategy=None):
         self.entries = {}
         self.success = True
+        self.strategy = strategy or "unknown"
+        self.start_time = time.time()
+        self.reallocated = 0
+        self.created = 0
 
     def make_entry(self, fx_name):
         if fx_name not in self.entries:
@@ -187,6 +245,31 @@ class QuarkIPAMLog(object):
                 else:
                     fails += 1
         self._output(self.success, total, fails, successes)
+        self._publish()
+
+    def _publish(self):
+        strategy = self.strategy
+        ipam_metrics.observe("allocation", time.time() - self.start_time,
+                             strategy=strategy)
+        ipam_metrics.increment(
+            "allocations", strategy=strategy,
+            result="success" if self.success else "failure")
+        if self.reallocated:
+            ipam_metrics.increment("addresses", self.reallocated,
+                                   strategy=strategy, source="reallocated")
+        if self.created:
+            ipam_metrics.increment("addresses", self.created,
+                                   strategy=strategy, source="created")
+        for fx, entries in self.entries.items():
+            fails = len([e for e in entries if not e.success])
+            ipam_metrics.increment("step_attempts", len(entries),
+                                   strategy=strategy, step=fx)
+            if len(entries) > 1:
+                ipam_metrics.increment("step_retries", len(entries) - 1,
+                                       strategy=strategy, step=fx)
+            if fails:
+                ipam_metrics.increment("step_failures", fails,
+                                       strategy=strategy, step=fx)
 
     def failed(self):
         self.success = False
@@ -211,7 +294,204 @@ class QuarkIPAMLogEntry(object):
         return self.end_time - self.start_time
 
 
+class AddressBlockLease(object):
+    """A contiguous block of addresses reserved by this worker.
+
+    first and last are inclusive integers. key identifies the subnet or
+    MAC range the block was reserved from.
+    """
+    def __init__(self, key, first, last, ttl):
+        self.key = key
+        self.next = first
+        self.last = last
+        self.expires_at = time.time() + ttl
+
+    def expired(self, now=None):
+        return (now or time.time()) >= self.expires_at
+
+    def exhausted(self):
+        return self.next > self.last
+
+    def take(self):
+        if self.exhausted():
+            return
+        address = self.next
+        self.next += 1
+        return address
+
+    def unused(self):
+        return range(self.next, self.last + 1)
+
+    def matches(self, *args, **kwargs):
+        return True
+
+
+class V4AddressLease(AddressBlockLease):
+    """A leased block of v4 addresses.
+
+    first and last are in the same v6 mapped integer form as
+    Subnet.next_auto_assign_ip.
+    """
+    def __init__(self, subnet_id, network_id, segment_id, first, last,
+                 ttl=None):
+        if ttl is None:
+            ttl = CONF.QUARK.ipam_v4_lease_ttl
+        super(V4AddressLease, self).__init__(subnet_id, first, last, ttl)
+        self.subnet_id = subnet_id
+        self.network_id = network_id
+        self.segment_id = segment_id
+
+    def matches(self, network_id, segment_id, subnet_ids=None):
+        if self.network_id != network_id:
+            return False
+        if subnet_ids:
+            return self.subnet_id in subnet_ids
+        return self.segment_id == segment_id
+
+
+class MacAddressLease(AddressBlockLease):
+    """A leased block of MACs from a MacAddressRange."""
+    def __init__(self, mac_address_range_id, do_not_use, first, last,
+                 ttl=None):
+        if ttl is None:
+            ttl = CONF.QUARK.mac_address_lease_ttl
+        super(MacAddressLease, self).__init__(mac_address_range_id, first,
+                                              last, ttl)
+        self.mac_address_range_id = mac_address_range_id
+        self.do_not_use = do_not_use
+
+    def matches(self, use_forbidden_mac_range=False):
+        return use_forbidden_mac_range or not self.do_not_use
+
+
+class LeaseRegistry(object):
+    """Per-process registry of leased address blocks, one per key."""
+    def __init__(self):
+        self._leases = {}
+        self._releasable = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._leases) + len(self._releasable)
+
+    def _retire(self, key):
+        lease = self._leases.pop(key, None)
+        if lease and not lease.exhausted():
+            self._releasable.append(lease)
+
+    def add(self, lease):
+        with self._lock:
+            self._retire(lease.key)
+            self._leases[lease.key] = lease
+
+    def find(self, *args, **kwargs):
+        """Returns the key of a live lease matching the criteria."""
+        now = time.time()
+        with self._lock:
+            for key, lease in self._leases.items():
+                if lease.expired(now) or lease.exhausted():
+                    self._retire(key)
+                    continue
+                if lease.matches(*args, **kwargs):
+                    return key
+
+    def take(self, key):
+        with self._lock:
+            lease = self._leases.get(key)
+            if not lease:
+                return
+            if lease.expired():
+                self._retire(key)
+                return
+            address = lease.take()
+            if lease.exhausted():
+                self._leases.pop(key)
+            return address
+
+    def retire(self, key):
+        with self._lock:
+            self._retire(key)
+
+    def pop_releasable(self, expired_only=True):
+        now = time.time()
+        with self._lock:
+            for key, lease in self._leases.items():
+                if not expired_only or lease.expired(now):
+                    self._retire(key)
+            releasable, self._releasable = self._releasable, []
+        return releasable
+
+
+V4_LEASES = LeaseRegistry()
+MAC_LEASES = LeaseRegistry()
+
+
+def release_v4_leases(context, expired_only=True):
+    """Returns unused addresses from leased blocks to the deallocated pool.
+
+    Expects an admin context. Addresses covered by the subnet's IP policy
+    are dropped rather than returned.
+    """
+    for lease in V4_LEASES.pop_releasable(expired_only=expired_only):
+        try:
+            with context.session.begin():
+                subnet = db_api.subnet_find(context, id=lease.subnet_id,
+                                            scope=db_api.ONE)
+                if not subnet:
+                    continue
+                if subnet["ip_policy"]:
+                    policy = subnet["ip_policy"].get_compiled_set()
+                else:
+                    policy = ip_policy_cache.EMPTY_POLICY
+                addresses = [a for a in lease.unused()
+                             if address_math.to_v6(a, 4) not in policy]
+                count = db_api.ip_address_create_deallocated_bulk(
+                    context, subnet, addresses)
+            LOG.info("Returned {0} leased addresses to subnet {1}".format(
+                count, lease.subnet_id))
+        except Exception:
+            LOG.exception("Failed to return leased addresses to subnet "
+                          "{0}".format(lease.subnet_id))
+
+
+def release_mac_leases(context, expired_only=True):
+    """Returns unused MACs from leased blocks to the deallocated pool.
+
+    Expects an admin context.
+    """
+    for lease in MAC_LEASES.pop_releasable(expired_only=expired_only):
+        try:
+            with context.session.begin():
+                count = db_api.mac_address_create_deallocated_bulk(
+                    context, lease.mac_address_range_id, lease.unused())
+            LOG.info("Returned {0} leased MACs to range {1}".format(
+                count, lease.mac_address_range_id))
+        except Exception:
+            LOG.exception("Failed to return leased MACs to range "
+                          "{0}".format(lease.mac_address_range_id))
+
+
+def _release_leases_at_exit():
+    if not len(V4_LEASES) and not len(MAC_LEASES):
+        return
+    admin_context = neutron_context.get_admin_context()
+    release_v4_leases(admin_context, expired_only=False)
+    release_mac_leases(admin_context, expired_only=False)
+
+
+atexit.register(_release_leases_at_exit)
+
+
 class QuarkIpam(object):
+    def __init__(self, selection=None):
+        self.subnet_selection = subnet_selection.get_selection(selection)
+        # The name the strategy is registered under. get_name is the base
+        # strategy, variants with another subnet selection add its name.
+        self.name = self.get_name()
+        selection_name = self.subnet_selection.get_name()
+        if selection_name != subnet_selection.MostFull.get_name():
+            self.name = "%s_%s" % (self.name, selection_name)
+
     @synchronized(named("allocate_mac_address"))
     def allocate_mac_address(self, context, net_id, port_id, reuse_after,
                              mac_address=None,
@@ -269,62 +549,96 @@ class QuarkIpam(object):
         # This could fail if a large chunk of MACs were chosen explicitly,
         # but under concurrent load enough MAC creates should iterate without
         # any given thread exhausting its retry count.
+        leasing = self._mac_leasing_enabled() and not mac_address
+        if leasing:
+            release_mac_leases(context.elevated())
+
         for retry in xrange(CONF.QUARK.mac_address_retry_max):
             LOG.info("Attemping to find a range to create a new MAC in "
                      "(step 2 of 3), attempt {0} of {1}".format(
                          retry + 1, CONF.QUARK.mac_address_retry_max))
             next_address = None
-            with context.session.begin():
-                try:
-                    fn = db_api.mac_address_range_find_allocation_counts
-                    mac_range = \
-                        fn(context, address=mac_address,
-                           use_forbidden_mac_range=use_forbidden_mac_range)
-
-                    if not mac_range:
-                        LOG.info("No MAC ranges could be found given "
-                                 "the criteria")
-                        break
-
-                    rng, addr_count = mac_range
-                    LOG.info("Found a MAC range {0}".format(rng["cidr"]))
-
-                    last = rng["last_address"]
-                    first = rng["first_address"]
-                    if (last - first + 1) <= addr_count:
-                        # Somehow, the range got filled up without us
-                        # knowing, so set the next_auto_assign to be -1
-                        # so we never try to create new ones
-                        # in this range
-                        db_api.mac_range_update_set_full(context, rng)
-                        LOG.info("MAC range {0} is full".format(rng["cidr"]))
-                        continue
-
-                    if mac_address:
-                        next_address = mac_address
-                    else:
-                        next_address = rng["next_auto_assign_mac"]
-                        if next_address + 1 > rng["last_address"]:
+            leased = None
+            if leasing:
+                range_id = MAC_LEASES.find(use_forbidden_mac_range)
+                if range_id:
+                    next_address = MAC_LEASES.take(range_id)
+            if next_address is None:
+                with context.session.begin():
+                    try:
+                        fn = db_api.mac_address_range_find_allocation_counts
+                        mac_range = \
+                            fn(context, address=mac_address,
+                               use_forbidden_mac_range=use_forbidden_mac_range)
+
+                        if not mac_range:
+                            LOG.info("No MAC ranges could be found given "
+                                     "the criteria")
+                            break
+
+                        rng, addr_count = mac_range
+                        range_id = rng["id"]
+                        LOG.info("Found a MAC range {0}".format(rng["cidr"]))
+
+                        last = rng["last_address"]
+                        first = rng["first_address"]
+                        if (last - first + 1) <= addr_count:
+                            # Somehow, the range got filled up without us
+                            # knowing, so set the next_auto_assign to be -1
+                            # so we never try to create new ones
+                            # in this range
                             db_api.mac_range_update_set_full(context, rng)
+                            LOG.info("MAC range {0} is full".format(
+                                rng["cidr"]))
+                            continue
+
+                        if mac_address:
+                            next_address = mac_address
+                        elif leasing:
+                            lease_fn = \
+                                db_api.mac_range_lease_next_auto_assign_macs
+                            leased = lease_fn(
+                                context, rng,
+                                CONF.QUARK.mac_address_lease_block_size)
+                            if not leased:
+                                continue
+                            next_address = leased[0]
+                            if leased[1] + 1 > rng["last_address"]:
+                                db_api.mac_range_update_set_full(context, rng)
+                            context.session.refresh(rng)
                         else:
-                            db_api.mac_range_update_next_auto_assign_mac(
-                                context, rng)
-                        context.session.refresh(rng)
-                except Exception:
-                    LOG.exception("Error in updating mac range")
-                    continue
+                            next_address = rng["next_auto_assign_mac"]
+                            if next_address + 1 > rng["last_address"]:
+                                db_api.mac_range_update_set_full(
+                                    context, rng, allocated=1)
+                            else:
+                                db_api.mac_range_update_next_auto_assign_mac(
+                                    context, rng)
+                            context.session.refresh(rng)
+                    except Exception:
+                        LOG.exception("Error in updating mac range")
+                        continue
+
+                if leased and leased[0] < leased[1]:
+                    # Only register the rest of the block once the update
+                    # that reserved it has been committed.
+                    MAC_LEASES.add(MacAddressLease(
+                        range_id, rng["do_not_use"], leased[0] + 1,
+                        leased[1]))
 
             # Based on the above, this should only fail if a MAC was
             # was explicitly chosen at some point. As such, fall through
             # here and get in line for a new MAC address to try
             try:
-                mac_readable = str(netaddr.EUI(next_address))
+                mac_readable = address_math.format_mac(next_address)
                 LOG.info("Attempting to create new MAC {0} "
                          "(step 3 of 3)".format(mac_readable))
                 with context.session.begin():
+                    # Auto assigned MACs were counted by the update that
+                    # moved next_auto_assign_mac past them.
                     address = db_api.mac_address_create(
-                        context, address=next_address,
-                        mac_address_range_id=rng["id"])
+                        context, count_allocated=mac_address is not None,
+                        address=next_address, mac_address_range_id=range_id)
                     LOG.info("MAC assignment for port ID {0} completed with "
                              "address {1}".format(port_id, mac_readable))
                     return address
@@ -394,6 +708,18 @@ class QuarkIpam(object):
 
         ipam_log = kwargs.get('ipam_log', None)
 
+        if CONF.QUARK.ipam_reallocate_single_claim:
+            try:
+                claimed = self._claim_reallocatable_ip(context, elevated,
+                                                       ip_kwargs, ipam_log,
+                                                       **kwargs)
+                if claimed:
+                    return claimed
+                LOG.info("Falling back to transaction based reallocation")
+            except Exception:
+                LOG.exception("Error claiming a reallocatable ip, falling "
+                              "back to transaction based reallocation")
+
         for retry in xrange(CONF.QUARK.ip_address_retry_max):
             attempt = None
             if ipam_log:
@@ -440,6 +766,38 @@ class QuarkIpam(object):
                     attempt.end()
         return []
 
+    def _claim_reallocatable_ip(self, context, elevated, ip_kwargs,
+                                ipam_log=None, **kwargs):
+        attempt = None
+        if ipam_log:
+            attempt = ipam_log.make_entry("claim_reallocatable_ip")
+        update_kwargs = {
+            "address_type": kwargs.get("address_type", ip_types.FIXED),
+            "_deallocated": False,
+            "deallocated_at": None,
+            "used_by_tenant_id": context.tenant_id,
+            "allocated_at": timeutils.utcnow(),
+        }
+        address = None
+        try:
+            with context.session.begin():
+                address = db_api.ip_address_reallocate_claim(
+                    elevated, update_kwargs, **ip_kwargs)
+        finally:
+            if attempt:
+                if not address:
+                    attempt.failed()
+                attempt.end()
+
+        if not address:
+            LOG.info("Couldn't claim any reallocatable addresses given the "
+                     "criteria")
+            return []
+
+        LOG.info("Address {0} is reallocated".format(
+            address["address_readable"]))
+        return [address]
+
     def is_strategy_satisfied(self, ip_addresses, allocate_complete=False):
         return ip_addresses
 
@@ -453,28 +811,38 @@ class QuarkIpam(object):
                                                  ip_address=ip_address)))
 
         if subnet and subnet["ip_policy"]:
-            ip_policy_cidrs = subnet["ip_policy"].get_cidrs_ip_set()
+            ip_policy_cidrs = subnet["ip_policy"].get_compiled_set()
         else:
-            ip_policy_cidrs = netaddr.IPSet([])
+            ip_policy_cidrs = ip_policy_cache.EMPTY_POLICY
 
         next_ip = ip_address
         if not next_ip:
-            if subnet["next_auto_assign_ip"] != -1:
-                next_ip = netaddr.IPAddress(subnet["next_auto_assign_ip"] - 1)
+            version = subnet["ip_version"]
+            if self._use_v4_leases(subnet):
+                value = self._take_leased_ip(net_id, subnet, ip_policy_cidrs)
+            elif subnet["next_auto_assign_ip"] != -1:
+                value = subnet["next_auto_assign_ip"] - 1
             else:
-                next_ip = netaddr.IPAddress(subnet["last_ip"])
-            if subnet["ip_version"] == 4:
-                next_ip = next_ip.ipv4()
+                value = subnet["last_ip"]
+            if version == 4:
+                value = address_math.to_v6(value, 4)
+            next_ip = netaddr.IPAddress(
+                address_math.to_native(value, version), version)
+
+            if value in ip_policy_cidrs:
+                LOG.info("Next IP {0} violates policy".format(str(next_ip)))
+                self._uncount_address(context, subnet)
+                raise q_exc.IPAddressPolicyRetryableFailure(ip_addr=next_ip,
+                                                            net_id=net_id)
 
         LOG.info("Next IP is {0}".format(str(next_ip)))
-        if ip_policy_cidrs and next_ip in ip_policy_cidrs and not ip_address:
-            LOG.info("Next IP {0} violates policy".format(str(next_ip)))
-            raise q_exc.IPAddressPolicyRetryableFailure(ip_addr=next_ip,
-                                                        net_id=net_id)
         try:
             with context.session.begin():
+                # Auto assigned addresses were counted by the update that
+                # moved next_auto_assign_ip past them.
                 address = db_api.ip_address_create(
-                    context, address=next_ip, subnet_id=subnet["id"],
+                    context, count_used=bool(ip_address),
+                    address=next_ip, subnet_id=subnet["id"],
                     deallocated=0, version=subnet["ip_version"],
                     network_id=net_id,
                     port_id=port_id,
@@ -484,13 +852,31 @@ class QuarkIpam(object):
                 # allocate_ip_address() when it's clear that the IP
                 # allocation was successful
         except db_exception.DBDuplicateEntry:
+            if not ip_address:
+                self._uncount_address(context, subnet)
             raise n_exc.IpAddressInUse(ip_address=next_ip, net_id=net_id)
         except db_exception.DBError:
+            if not ip_address:
+                self._uncount_address(context, subnet)
             raise q_exc.IPAddressRetryableFailure(ip_addr=next_ip,
                                                   net_id=net_id)
 
         return address
 
+    def _uncount_address(self, context, subnet):
+        """Gives back the used_count of an auto assigned address.
+
+        next_auto_assign_ip and leases count an address as used before its
+        row is inserted, in an earlier transaction, so an insert that fails
+        has to take the count back out again.
+        """
+        try:
+            with context.session.begin():
+                db_api.subnet_update_used_count(context, subnet["id"], -1)
+        except db_exception.DBError:
+            LOG.exception("Failed to decrement used_count of subnet "
+                          "{0}".format(subnet["id"]))
+
     def _allocate_from_v6_subnet(self, context, net_id, subnet,
                                  port_id, reuse_after, ip_address=None,
                                  **kwargs):
@@ -524,9 +910,15 @@ class QuarkIpam(object):
                 mac = kwargs["mac_address"].get("address")
 
             if subnet and subnet["ip_policy"]:
-                ip_policy_cidrs = subnet["ip_policy"].get_cidrs_ip_set()
+                ip_policy_cidrs = subnet["ip_policy"].get_compiled_set()
             else:
-                ip_policy_cidrs = netaddr.IPSet([])
+                ip_policy_cidrs = ip_policy_cache.EMPTY_POLICY
+
+            batch_size = CONF.QUARK.v6_allocation_probe_batch
+            if batch_size > 1:
+                return self._allocate_probed_v6(
+                    context, net_id, subnet, mac, port_id, ip_policy_cidrs,
+                    batch_size, **kwargs)
 
             for tries, ip_address in enumerate(
                     generate_v6(mac, port_id, subnet["cidr"])):
@@ -538,15 +930,14 @@ class QuarkIpam(object):
                     LOG.info("Exceeded v6 allocation attempts, bailing")
                     raise ip_address_failure(net_id)
 
-                ip_address = netaddr.IPAddress(ip_address).ipv6()
                 LOG.info("Generated a new v6 address {0}".format(
-                    str(ip_address)))
+                    address_math.format_ip(ip_address, 6)))
 
-                if (ip_policy_cidrs is not None and
-                        ip_address in ip_policy_cidrs):
+                if ip_address in ip_policy_cidrs:
                     LOG.info("Address {0} excluded by policy".format(
-                        str(ip_address)))
+                        address_math.format_ip(ip_address, 6)))
                     continue
+                ip_address = netaddr.IPAddress(ip_address, 6)
 
                 try:
                     with context.session.begin():
@@ -568,6 +959,51 @@ class QuarkIpam(object):
                     LOG.debug("Duplicate entry found when inserting subnet_id"
                               " %s ip_address %s", subnet["id"], ip_address)
 
+    def _allocate_probed_v6(self, context, net_id, subnet, mac, port_id,
+                            ip_policy_cidrs, batch_size, **kwargs):
+        """Checks generated v6 candidates a batch at a time.
+
+        Each batch is filtered against policy and existing rows with one IN
+        query and only the first free candidate is inserted, so colliding
+        with addresses from a recycled MAC costs a query per batch rather
+        than a rolled back INSERT per candidate.
+        """
+        candidates = itertools.islice(
+            generate_v6(mac, port_id, subnet["cidr"]),
+            CONF.QUARK.v6_allocation_attempts)
+        while True:
+            batch = list(itertools.islice(candidates, batch_size))
+            if not batch:
+                break
+            allowed = [c for c in batch if c not in ip_policy_cidrs]
+            taken = db_api.ip_address_find_existing(context, subnet["id"],
+                                                    allowed)
+            LOG.info("Probed {0} v6 candidates, {1} excluded by policy, "
+                     "{2} already exist".format(
+                         len(batch), len(batch) - len(allowed), len(taken)))
+
+            for candidate in allowed:
+                if candidate in taken:
+                    continue
+                ip_address = netaddr.IPAddress(candidate, 6)
+                try:
+                    with context.session.begin():
+                        address = db_api.ip_address_create(
+                            context, address=ip_address,
+                            subnet_id=subnet["id"],
+                            version=subnet["ip_version"], network_id=net_id,
+                            address_type=kwargs.get('address_type',
+                                                    ip_types.FIXED))
+                        notify(context, 'ip.add', address)
+                        return address
+                except db_exception.DBDuplicateEntry:
+                    # Raced with another allocation since the probe
+                    LOG.info("{0} was allocated concurrently".format(
+                        str(ip_address)))
+
+        LOG.info("Exceeded v6 allocation attempts, bailing")
+        raise ip_address_failure(net_id)
+
     def _allocate_ips_from_subnets(self, context, new_addresses, net_id,
                                    subnets, port_id, reuse_after,
                                    ip_address=None, **kwargs):
@@ -618,7 +1054,7 @@ class QuarkIpam(object):
         ipam_log = kwargs.get('ipam_log', None)
         LOG.info("Starting a new IP address(es) allocation. Strategy "
                  "is {0} - [{1}]".format(
-                     self.get_name(),
+                     self.name,
                      utils.pretty_kwargs(network_id=net_id, port_id=port_id,
                                          new_addresses=new_addresses,
                                          ip_addresses=ip_addresses,
@@ -642,11 +1078,13 @@ class QuarkIpam(object):
                 if not sub:
                     subnets = self._choose_available_subnet(
                         elevated, net_id, version, segment_id=segment_id,
-                        ip_address=ip_addr, reallocated_ips=new_addresses)
+                        ip_address=ip_addr, reallocated_ips=new_addresses,
+                        port_id=port_id)
                 else:
                     subnets = [self.select_subnet(context, net_id,
                                                   ip_addr, segment_id,
-                                                  subnet_ids=[sub])]
+                                                  subnet_ids=[sub],
+                                                  port_id=port_id)]
                 LOG.info("Subnet selection returned {0} viable subnet(s) - "
                          "IDs: {1}".format(len(subnets),
                                            ", ".join([str(s["id"])
@@ -684,12 +1122,13 @@ class QuarkIpam(object):
         else:
             _try_reallocate_ip_address(ipam_log)
 
+        ipam_log.reallocated = len(new_addresses)
         if self.is_strategy_satisfied(new_addresses):
             return
         else:
             LOG.info("Reallocated addresses {0} but still need more addresses "
                      "to satisfy strategy {1}. Falling back to creating "
-                     "IPs".format(new_addresses, self.get_name()))
+                     "IPs".format(new_addresses, self.name))
 
         if ip_addresses or subnets:
             for ip_address, subnet in itertools.izip_longest(ip_addresses,
@@ -698,6 +1137,7 @@ class QuarkIpam(object):
         else:
             _try_allocate_ip_address(ipam_log)
 
+        ipam_log.created = len(new_addresses) - ipam_log.reallocated
         if self.is_strategy_satisfied(new_addresses, allocate_complete=True):
             # Only notify when all went well
             for address in new_addresses:
@@ -711,6 +1151,204 @@ class QuarkIpam(object):
 
         raise ip_address_failure(net_id)
 
+    def allocate_bulk(self, context, port_requests, reuse_after,
+                      segment_id=None, **kwargs):
+        """Allocates a MAC and IP addresses for many ports in one call.
+
+        port_requests is a list of (port_id, net_id, fixed_ips) tuples,
+        where fixed_ips is a dict of the ip_addresses/subnets kwargs
+        allocate_ip_address accepts, or None. Ports on the same network
+        without requested fixed_ips take a single MAC range lock and a
+        single lock on the candidate v4 subnets, and have their rows bulk
+        inserted. New addresses are carved from next_auto_assign; the bulk
+        path doesn't reallocate. Any port it can't satisfy, and every port
+        with fixed_ips, goes through allocate_mac_address and
+        allocate_ip_address as usual.
+
+        Returns one dict per request, in order, with port_id, mac_address,
+        ip_addresses and error. error holds the exception that failed that
+        port, or None. As with create_port, releasing whatever was allocated
+        for a failed port is up to the caller.
+        """
+        results = [dict(port_id=port_id, mac_address=None, ip_addresses=[],
+                        error=None)
+                   for port_id, net_id, fixed_ips in port_requests]
+
+        by_network = collections.OrderedDict()
+        for result, (port_id, net_id, fixed_ips) in zip(results,
+                                                        port_requests):
+            if not fixed_ips:
+                by_network.setdefault(net_id, []).append(result)
+
+        for net_id, group in by_network.items():
+            port_ids = [result["port_id"] for result in group]
+            try:
+                macs = self._allocate_mac_addresses_bulk(context, net_id,
+                                                         port_ids)
+            except Exception:
+                LOG.exception("Bulk MAC allocation failed for network "
+                              "{0}".format(net_id))
+                macs = []
+            for result, mac in zip(group, macs):
+                result["mac_address"] = mac
+
+            try:
+                addresses = self._allocate_v4_bulk(context, net_id, port_ids,
+                                                   segment_id=segment_id,
+                                                   **kwargs)
+            except Exception:
+                LOG.exception("Bulk IP allocation failed for network "
+                              "{0}".format(net_id))
+                addresses = []
+            for result, address in zip(group, addresses):
+                result["ip_addresses"].append(address)
+
+        for result, (port_id, net_id, fixed_ips) in zip(results,
+                                                        port_requests):
+            try:
+                self._complete_bulk_port(context, result, net_id,
+                                         reuse_after, segment_id,
+                                         fixed_ips or {}, **kwargs)
+            except Exception as e:
+                LOG.exception("Bulk allocation failed for port "
+                              "{0}".format(port_id))
+                result["error"] = e
+        return results
+
+    def _complete_bulk_port(self, context, result, net_id, reuse_after,
+                            segment_id, fixed_ips, **kwargs):
+        port_id = result["port_id"]
+        if not result["mac_address"]:
+            result["mac_address"] = self.allocate_mac_address(
+                context, net_id, port_id, reuse_after)
+
+        addresses = result["ip_addresses"]
+        if not addresses:
+            fixed_ips = dict(fixed_ips)
+            fixed_ips.update(kwargs)
+            self.allocate_ip_address(context, addresses, net_id, port_id,
+                                     reuse_after, segment_id=segment_id,
+                                     mac_address=result["mac_address"],
+                                     **fixed_ips)
+            return
+
+        if not self.is_strategy_satisfied(addresses):
+            subnet = self.select_subnet(context, net_id, None, segment_id,
+                                        ip_version=6)
+            if subnet:
+                addresses.append(self._allocate_from_v6_subnet(
+                    context, net_id, subnet, port_id, reuse_after,
+                    mac_address=result["mac_address"], **kwargs))
+        if not self.is_strategy_satisfied(addresses, allocate_complete=True):
+            raise ip_address_failure(net_id)
+
+        # v6 addresses notify from _allocate_from_v6_subnet
+        for address in addresses:
+            if address["version"] == 4:
+                notify(context, 'ip.add', address)
+
+    def _allocate_mac_addresses_bulk(self, context, net_id, port_ids):
+        wanted = len(port_ids)
+        with context.session.begin():
+            mac_range = db_api.mac_address_range_find_allocation_counts(
+                context)
+            if not mac_range:
+                LOG.info("No MAC ranges could be found for bulk allocation")
+                return []
+            rng, addr_count = mac_range
+            if (rng["last_address"] - rng["first_address"] + 1 <=
+                    addr_count):
+                # Same as the single MAC path, the range filled up without
+                # next_auto_assign_mac being moved to -1
+                db_api.mac_range_update_set_full(context, rng)
+                LOG.info("MAC range {0} is full".format(rng["cidr"]))
+                return []
+
+            first = rng["next_auto_assign_mac"]
+            last = rng["last_address"]
+            addresses = []
+            cur = first
+            while len(addresses) < wanted and cur <= last:
+                batch = range(cur, min(cur + wanted - len(addresses),
+                                       last + 1))
+                cur = batch[-1] + 1
+                # MACs can be chosen explicitly, so there may already be
+                # rows ahead of next_auto_assign_mac.
+                taken = db_api.mac_address_find_existing(context, batch)
+                addresses.extend(a for a in batch if a not in taken)
+
+            if cur > last:
+                db_api.mac_range_update_set_full(context, rng,
+                                                 allocated=len(addresses))
+            else:
+                db_api.mac_range_update_next_auto_assign_mac(
+                    context, rng, count=cur - first, allocated=len(addresses))
+            macs = db_api.mac_address_create_bulk(context, rng["id"],
+                                                  addresses)
+        LOG.info("Bulk allocated {0} of {1} MACs from range {2}".format(
+            len(macs), wanted, rng["cidr"]))
+        return macs
+
+    def _carve_v4_addresses(self, context, subnet, wanted):
+        """Finds up to wanted free addresses from next_auto_assign_ip on.
+
+        Returns the addresses and how far next_auto_assign_ip has to move
+        to cover them.
+        """
+        if subnet["ip_policy"]:
+            ip_policy_cidrs = subnet["ip_policy"].get_compiled_set()
+        else:
+            ip_policy_cidrs = ip_policy_cache.EMPTY_POLICY
+
+        first = subnet["next_auto_assign_ip"]
+        last = subnet["last_ip"]
+        addresses = []
+        cur = first
+        while len(addresses) < wanted and cur <= last:
+            batch = []
+            while len(batch) < wanted - len(addresses) and cur <= last:
+                if address_math.to_v6(cur, 4) not in ip_policy_cidrs:
+                    batch.append(cur)
+                cur += 1
+            # Explicitly requested IPs don't move next_auto_assign_ip.
+            taken = db_api.ip_address_find_existing(context, subnet["id"],
+                                                    batch)
+            addresses.extend(a for a in batch if a not in taken)
+        return addresses, cur - first
+
+    def _allocate_v4_bulk(self, context, net_id, port_ids, segment_id=None,
+                          **kwargs):
+        wanted = len(port_ids)
+        elevated = context.elevated()
+        allocated = []
+        with context.session.begin():
+            # Candidates come from the subnet selection strategy, locked or
+            # not as select_subnet would. The lease only matches if
+            # next_auto_assign_ip hasn't moved since it was read, so
+            # subnets another worker got to first are skipped.
+            subnets = self._select_subnet(elevated, net_id, None, segment_id,
+                                          None, ip_version=4)
+            for subnet, ips_in_subnet in subnets:
+                remaining = wanted - len(allocated)
+                if not remaining:
+                    break
+                if subnet is None or subnet["next_auto_assign_ip"] == -1:
+                    continue
+                addresses, count = self._carve_v4_addresses(elevated, subnet,
+                                                            remaining)
+                if not addresses:
+                    continue
+                if not db_api.subnet_lease_next_auto_assign_ips(
+                        elevated, subnet, count, used=len(addresses)):
+                    continue
+                allocated.extend(db_api.ip_address_create_bulk(
+                    elevated, subnet, addresses,
+                    used_by_tenant_id=context.tenant_id,
+                    address_type=kwargs.get("address_type", ip_types.FIXED)))
+        LOG.info("Bulk allocated {0} of {1} v4 addresses on network "
+                 "{2}".format(len(allocated), wanted, net_id))
+        return allocated
+
     def deallocate_ip_address(self, context, address):
         if address["version"] == 6:
             db_api.ip_address_delete(context, address)
@@ -720,6 +1358,22 @@ class QuarkIpam(object):
 
         notify(context, 'ip.delete', address, send_usage=True)
 
+    def deallocate_ip_addresses(self, context, addresses):
+        """Deallocates addresses like deallocate_ip_address, in bulk.
+
+        All v4 addresses are marked deallocated with one UPDATE and all v6
+        addresses deleted with one DELETE. Billing is still notified for
+        every address.
+        """
+        v4 = [a for a in addresses if a["version"] != 6]
+        v6 = [a for a in addresses if a["version"] == 6]
+        if v4:
+            db_api.ip_address_deallocate_all(context, v4)
+        if v6:
+            db_api.ip_address_delete_all(context, v6)
+        for address in addresses:
+            notify(context, 'ip.delete', address, send_usage=True)
+
     def deallocate_ips_by_port(self, context, port=None, **kwargs):
         ips_to_remove = []
         for addr in port["ip_addresses"]:
@@ -737,26 +1391,24 @@ class QuarkIpam(object):
 
         # NCP-1541: We don't need to track v6 IPs the same way. Also, we can't
         # delete them until we've removed the FK on the assoc record first, so
-        # we have to flush the current state of the transaction.
-        # NOTE(mdietz): this does increase traffic to the db because we need
-        #               to flush, fetch the records again and potentially make
-        #               another trip to deallocate each IP, but keeping our
-        #               indices smaller probably provides more value than the
-        #               cost
+        # we have to flush the current state of the transaction. The flush
+        # removes all of the association rows at once, and the addresses are
+        # then deallocated together rather than one at a time.
         # NOTE(aquillin): For floating IPs associated with the port, we do not
         #                 want to deallocate the IP or disassociate the IP from
         #                 the tenant, instead we will disassociate floating's
         #                 fixed IP address.
         context.session.flush()
-        deallocated_ips = []
+        deallocated = []
         flip = None
         for ip in ips_to_remove:
             if ip["address_type"] in (ip_types.FLOATING, ip_types.SCALING):
                 flip = ip
             else:
                 if len(ip["ports"]) == 0:
-                    self.deallocate_ip_address(context, ip)
-                    deallocated_ips.append(ip.id)
+                    deallocated.append(ip)
+        self.deallocate_ip_addresses(context, deallocated)
+        deallocated_ips = [ip.id for ip in deallocated]
         if flip:
             if flip.fixed_ips and len(flip.fixed_ips) == 1:
                 # This is a FLIP or SCIP that is only associated with one
@@ -817,7 +1469,7 @@ class QuarkIpam(object):
                                       deallocated_at=timeutils.utcnow())
 
     def _select_subnet(self, context, net_id, ip_address, segment_id,
-                       subnet_ids, **filters):
+                       subnet_ids, port_id=None, **filters):
         # NCP-1480: Don't need to lock V6 subnets, since we don't use
         # next_auto_assign_ip for them. We already uniquely identified
         # the V6 we're going to get by generating a MAC in a previous step.
@@ -828,17 +1480,21 @@ class QuarkIpam(object):
                 "ip_version" in filters and
                 int(filters["ip_version"]) == 6):
             lock_subnets = False
+        if CONF.QUARK.ipam_optimistic_subnet_selection:
+            lock_subnets = False
 
-        select_api = db_api.subnet_find_ordered_by_most_full
-        # TODO(mdietz): Add configurable, alternate subnet selection here
-        subnets = select_api(context, net_id, lock_subnets=lock_subnets,
-                             segment_id=segment_id, scope=db_api.ALL,
-                             subnet_id=subnet_ids, **filters)
+        selection = self.subnet_selection
+        subnets = selection.find(context, net_id, lock_subnets=lock_subnets,
+                                 segment_id=segment_id, scope=db_api.ALL,
+                                 subnet_id=subnet_ids, **filters)
 
         if not subnets:
             LOG.info("No subnets found given the search criteria!")
             return
 
+        subnets = selection.order(subnets, net_id=net_id,
+                                  segment_id=segment_id, port_id=port_id)
+
         # TODO(mdietz): Making this into an iterator because we want to move
         #               to selecting 1 subnet at a time and paginating rather
         #               than the bulk fetch. Without locks, we need to
@@ -850,6 +1506,7 @@ class QuarkIpam(object):
 
     def _should_mark_subnet_full(self, context, subnet, ipnet, ip_address,
                                  ips_in_subnet):
+        """ipnet is the subnet's (first, last, version) CIDR range."""
         ip = subnet["next_auto_assign_ip"]
         # NOTE(mdietz): When atomically updated, this probably
         #               doesn't need the lower bounds check but
@@ -866,32 +1523,94 @@ class QuarkIpam(object):
 
         policy_size = ip_policy["size"] if ip_policy else 0
 
-        if ipnet.size > (ips_in_subnet + policy_size - 1):
+        first, last, _version = ipnet
+        if last - first + 1 > (ips_in_subnet + policy_size - 1):
             return False
         return True
 
     def _ip_in_subnet(self, subnet, subnet_ids, ipnet, ip_address):
         if ip_address:
-            requested_ip = netaddr.IPAddress(ip_address)
-            if ipnet.version == 4 and requested_ip.version != 4:
-                requested_ip = requested_ip.ipv4()
-            if requested_ip not in ipnet:
+            first, last, version = ipnet
+            value, requested_version = address_math.parse_ip(ip_address)
+            if version == 4 and requested_version != 4:
+                if address_math.is_v4_mapped(value):
+                    value, requested_version = value & address_math.V4_MAX, 4
+            if (requested_version != version or
+                    not address_math.in_range(value, first, last)):
                 if subnet_ids is not None:
                     LOG.info("Requested IP {0} not in subnet {1}, "
-                             "retrying".format(str(requested_ip),
-                                               str(ipnet)))
+                             "retrying".format(str(ip_address),
+                                               subnet["cidr"]))
                     raise q_exc.IPAddressNotInSubnet(
                         ip_addr=ip_address, subnet_id=subnet["id"])
                 return False
         return True
 
+    def _mac_leasing_enabled(self):
+        return CONF.QUARK.mac_address_lease_block_size > 1
+
+    def _v4_leasing_enabled(self):
+        return CONF.QUARK.ipam_v4_lease_block_size > 1
+
+    def _use_v4_leases(self, subnet):
+        return self._v4_leasing_enabled() and subnet["ip_version"] == 4
+
+    def _take_leased_ip(self, net_id, subnet, ip_policy_cidrs):
+        while True:
+            address = V4_LEASES.take(subnet["id"])
+            if address is None:
+                # Another greenthread drained or expired the lease between
+                # select_subnet and here.
+                raise q_exc.IPAddressRetryableFailure(ip_addr=None,
+                                                      net_id=net_id)
+            address = address_math.to_v6(address, 4)
+            if address not in ip_policy_cidrs:
+                return address
+            LOG.info("Skipping leased IP {0}, violates policy".format(
+                address_math.format_ip(address & address_math.V4_MAX, 4)))
+
+    def _leasable_count(self, subnet, block_size):
+        """Counts the addresses a block lease would actually hand out."""
+        first = subnet["next_auto_assign_ip"]
+        last = min(first + block_size - 1, subnet["last_ip"])
+        if not subnet["ip_policy"]:
+            return max(last - first + 1, 0)
+        policy = subnet["ip_policy"].get_compiled_set()
+        return sum(1 for address in xrange(first, last + 1)
+                   if address_math.to_v6(address, 4) not in policy)
+
+    def _select_leased_subnet(self, context, net_id, segment_id, subnet_ids):
+        elevated = context.elevated()
+        release_v4_leases(elevated)
+        while True:
+            subnet_id = V4_LEASES.find(net_id, segment_id, subnet_ids)
+            if not subnet_id:
+                return
+            subnet = db_api.subnet_find(elevated, id=subnet_id,
+                                        scope=db_api.ONE)
+            if subnet and not subnet["do_not_use"]:
+                return subnet
+            V4_LEASES.retire(subnet_id)
+
     def select_subnet(self, context, net_id, ip_address, segment_id,
-                      subnet_ids=None, **filters):
+                      subnet_ids=None, port_id=None, **filters):
         LOG.info("Selecting subnet(s) - (Step 2 of 3) [{0}]".format(
             utils.pretty_kwargs(network_id=net_id, ip_address=ip_address,
                                 segment_id=segment_id, subnet_ids=subnet_ids,
                                 ip_version=filters.get("ip_version"))))
 
+        if (self._v4_leasing_enabled() and not ip_address and
+                int(filters.get("ip_version") or 4) == 4):
+            subnet = self._select_leased_subnet(context, net_id, segment_id,
+                                                subnet_ids)
+            if subnet:
+                LOG.info("Serving from leased block in subnet {0}".format(
+                    subnet["id"]))
+                return subnet
+
+        leased = None
+        optimistic = CONF.QUARK.ipam_optimistic_subnet_selection
+
         # TODO(mdietz): Invert the iterator and the session, should only be
         #               one subnet per attempt. We should also only be fetching
         #               the subnet and usage when we need to. Otherwise
@@ -902,10 +1621,11 @@ class QuarkIpam(object):
                                                              ip_address,
                                                              segment_id,
                                                              subnet_ids,
+                                                             port_id=port_id,
                                                              **filters):
                 if subnet is None:
                     continue
-                ipnet = netaddr.IPNetwork(subnet["cidr"])
+                ipnet = address_math.cidr_range(subnet["cidr"])
                 LOG.info("Trying subnet ID: {0} - CIDR: {1}".format(
                     subnet["id"], subnet["_cidr"]))
 
@@ -920,15 +1640,55 @@ class QuarkIpam(object):
 
                     # Ensure the session is aware of the changes to the subnet
                     if updated:
+                        ipam_metrics.increment("subnet_full",
+                                               strategy=self.name)
                         context.session.refresh(subnet)
                     continue
 
+                if not ip_address and self._use_v4_leases(subnet):
+                    block_size = CONF.QUARK.ipam_v4_lease_block_size
+                    leased = db_api.subnet_lease_next_auto_assign_ips(
+                        context, subnet, block_size,
+                        used=self._leasable_count(subnet, block_size))
+                    if not leased:
+                        if optimistic:
+                            continue
+                        return
+                    context.session.refresh(subnet)
+                    break
+
                 if not ip_address and subnet["ip_version"] == 4:
+                    next_ip = subnet["next_auto_assign_ip"]
+                    if subnet["ip_policy"]:
+                        policy = subnet["ip_policy"].get_compiled_set()
+                        next_ip = policy.next_allowed(next_ip)
+                    if next_ip > subnet["last_ip"]:
+                        LOG.info("Remainder of subnet {0} is excluded by "
+                                 "policy, marking full".format(subnet["id"]))
+                        if db_api.subnet_update_set_full(context, subnet):
+                            ipam_metrics.increment("subnet_full",
+                                                   strategy=self.name)
+                            context.session.refresh(subnet)
+                        continue
+
+                    # Jump over any excluded range in a single update
+                    # rather than failing on policy and retrying.
                     auto_inc = db_api.subnet_update_next_auto_assign_ip
-                    updated = auto_inc(context, subnet)
+                    step = next_ip - subnet["next_auto_assign_ip"] + 1
+                    if optimistic:
+                        updated = auto_inc(context, subnet, step=step,
+                                           conditional=True)
+                    else:
+                        updated = auto_inc(context, subnet, step=step)
 
                     if updated:
                         context.session.refresh(subnet)
+                    elif optimistic:
+                        # The subnet was read without a lock and another
+                        # worker claimed it first, try the next one.
+                        LOG.info("Lost the race for subnet {0}, trying the "
+                                 "next candidate".format(subnet["id"]))
+                        continue
                     else:
                         # This means the subnet was marked full
                         # while we were checking out policies.
@@ -941,6 +1701,16 @@ class QuarkIpam(object):
                                             subnet["next_auto_assign_ip"]))
                 return subnet
 
+        if leased:
+            # Only register the block once the update that reserved it
+            # has been committed.
+            first, last = leased
+            V4_LEASES.add(V4AddressLease(subnet["id"], net_id, segment_id,
+                                         first, last))
+            LOG.info("Leased {0} addresses from subnet {1}".format(
+                last - first + 1, subnet["id"]))
+            return subnet
+
 
 class QuarkIpamANY(QuarkIpam):
     @classmethod
@@ -949,12 +1719,12 @@ class QuarkIpamANY(QuarkIpam):
 
     def _choose_available_subnet(self, context, net_id, version=None,
                                  segment_id=None, ip_address=None,
-                                 reallocated_ips=None):
+                                 reallocated_ips=None, port_id=None):
         filters = {}
         if version:
             filters["ip_version"] = version
         subnet = self.select_subnet(context, net_id, ip_address, segment_id,
-                                    **filters)
+                                    port_id=port_id, **filters)
         if subnet:
             return [subnet]
         raise ip_address_failure(net_id)
@@ -992,7 +1762,7 @@ class QuarkIpamBOTH(QuarkIpam):
 
     def _choose_available_subnet(self, context, net_id, version=None,
                                  segment_id=None, ip_address=None,
-                                 reallocated_ips=None):
+                                 reallocated_ips=None, port_id=None):
         both_subnet_versions = []
         need_versions = [4, 6]
         for i in reallocated_ips:
@@ -1002,7 +1772,7 @@ class QuarkIpamBOTH(QuarkIpam):
         for ver in need_versions:
             filters["ip_version"] = ver
             sub = self.select_subnet(context, net_id, ip_address, segment_id,
-                                     **filters)
+                                     port_id=port_id, **filters)
             if sub:
                 both_subnet_versions.append(sub)
         if not reallocated_ips and not both_subnet_versions:
@@ -1029,9 +1799,10 @@ class QuarkIpamBOTHREQ(QuarkIpamBOTH):
 
     def _choose_available_subnet(self, context, net_id, version=None,
                                  segment_id=None, ip_address=None,
-                                 reallocated_ips=None):
+                                 reallocated_ips=None, port_id=None):
         subnets = super(QuarkIpamBOTHREQ, self)._choose_available_subnet(
-            context, net_id, version, segment_id, ip_address, reallocated_ips)
+            context, net_id, version, segment_id, ip_address, reallocated_ips,
+            port_id=port_id)
 
         if len(reallocated_ips) + len(subnets) < 2:
             raise ip_address_failure(net_id)
@@ -1046,8 +1817,17 @@ class IronicIpam(QuarkIpam):
     family selects unused ones, and only allows a single allocation
     per subnet.
     """
+    def _v4_leasing_enabled(self):
+        # One allocation per subnet, so there is nothing to lease.
+        return False
+
+    def _allocate_v4_bulk(self, context, net_id, port_ids, segment_id=None,
+                          **kwargs):
+        # One allocation per subnet, so carving ranges doesn't apply.
+        return []
+
     def _select_subnet(self, context, net_id, ip_address, segment_id,
-                       subnet_ids, **filters):
+                       subnet_ids, port_id=None, **filters):
 
         lock_subnets = True
 
@@ -1096,6 +1876,15 @@ class IpamRegistry(object):
             IronicIpamBOTHREQ.get_name(): IronicIpamBOTHREQ()
         }
 
+        # Each of the standard strategies is also available with an
+        # alternate subnet selection, e.g. BOTH_ROUND_ROBIN.
+        for strategy in (QuarkIpamANY, QuarkIpamBOTH, QuarkIpamBOTHREQ):
+            for selection in subnet_selection.SELECTIONS:
+                if selection == subnet_selection.MostFull.get_name():
+                    continue
+                variant = strategy(selection)
+                self.strategies[variant.name] = variant
+
     def is_valid_strategy(self, strategy_name):
         if strategy_name in self.strategies:
             return True
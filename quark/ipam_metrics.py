@@ -0,0 +1,259 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""IPAM allocation metrics.
+
+QuarkIPAMLog reports allocation latency, per step attempts and how
+addresses were obtained here, and the IPAM strategies report subnets they
+mark full. Metrics go to a statsd compatible UDP sink or are kept in
+process and served in the Prometheus text format, depending on
+ipam_metrics_sink.
+
+Prometheus metrics are per process, so every API worker serves its own
+endpoint on the first free port of ipam_metrics_prometheus_port_count
+consecutive ports and each of them has to be scraped. Deployments that
+can't scrape every worker should use the statsd sink, which aggregates
+across processes.
+"""
+
+import BaseHTTPServer
+import bisect
+import socket
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.StrOpt('ipam_metrics_sink',
+               default='none',
+               choices=['none', 'statsd', 'prometheus'],
+               help=_('Where to publish IPAM allocation metrics.')),
+    cfg.StrOpt('ipam_metrics_prefix',
+               default='quark.ipam',
+               help=_('Prefix of every IPAM metric name.')),
+    cfg.StrOpt('ipam_metrics_statsd_host',
+               default='127.0.0.1',
+               help=_('Host of the statsd daemon IPAM metrics are sent to.')),
+    cfg.IntOpt('ipam_metrics_statsd_port',
+               default=8125,
+               help=_('UDP port of the statsd daemon.')),
+    cfg.StrOpt('ipam_metrics_prometheus_host',
+               default='127.0.0.1',
+               help=_('Address the Prometheus metrics endpoint listens on.')),
+    cfg.IntOpt('ipam_metrics_prometheus_port',
+               default=9109,
+               help=_('First port the Prometheus metrics endpoint listens on.'
+                      ' 0 keeps the metrics in process without serving'
+                      ' them.')),
+    cfg.IntOpt('ipam_metrics_prometheus_port_count',
+               default=1,
+               help=_('Number of consecutive ports, starting at'
+                      ' ipam_metrics_prometheus_port, the Prometheus'
+                      ' endpoint may listen on. Metrics are kept per process'
+                      ' and each worker serves its own on the first free'
+                      ' port, so this must be at least the number of API'
+                      ' workers. Use the statsd sink if every worker can\'t'
+                      ' be scraped.'))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+# Seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_SINK = None
+_SINK_LOCK = threading.Lock()
+
+
+class NullSink(object):
+    def increment(self, name, value, labels):
+        pass
+
+    def observe(self, name, seconds, labels):
+        pass
+
+
+class StatsdSink(object):
+    """Sends counters and timers to statsd over UDP.
+
+    Labels become dotted name components, in label name order, e.g.
+    quark.ipam.allocations.ANY.success.
+    """
+    def __init__(self, host, port, prefix):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _name(self, name, labels):
+        parts = [self.prefix, name]
+        parts.extend(str(labels[k]).replace(".", "_")
+                     for k in sorted(labels))
+        return ".".join(parts)
+
+    def _send(self, line):
+        try:
+            self.sock.sendto(line, self.address)
+        except socket.error:
+            LOG.debug("Failed to send IPAM metric %s" % line)
+
+    def increment(self, name, value, labels):
+        self._send("%s:%d|c" % (self._name(name, labels), value))
+
+    def observe(self, name, seconds, labels):
+        self._send("%s:%.3f|ms" % (self._name(name, labels), seconds * 1000))
+
+
+class PrometheusSink(object):
+    """Keeps counters and histograms in process for a Prometheus scrape."""
+    def __init__(self, prefix):
+        self.prefix = prefix.replace(".", "_")
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets, total, count = self._histograms.get(
+                key, ([0] * len(BUCKETS), 0.0, 0))
+            idx = bisect.bisect_left(BUCKETS, seconds)
+            if idx < len(BUCKETS):
+                buckets[idx] += 1
+            self._histograms[key] = (buckets, total + seconds, count + 1)
+
+    def _labels(self, labels, **extra):
+        labels = list(labels) + sorted(extra.items())
+        if not labels:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (k, v) for k, v in labels)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (list(b), t, c)) for k, (b, t, c)
+                                in self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = "%s_%s_total" % (self.prefix, name)
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE %s counter" % metric)
+            lines.append("%s%s %d" % (metric, self._labels(labels), value))
+        for (name, labels), (buckets, total, count) in histograms:
+            metric = "%s_%s_seconds" % (self.prefix, name)
+            if metric not in typed:
+                typed.add(metric)
+                lines.append("# TYPE %s histogram" % metric)
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                lines.append("%s_bucket%s %d" % (
+                    metric, self._labels(labels, le=bound), cumulative))
+            lines.append("%s_bucket%s %d" % (
+                metric, self._labels(labels, le="+Inf"), count))
+            lines.append("%s_sum%s %f" % (metric, self._labels(labels),
+                                          total))
+            lines.append("%s_count%s %d" % (metric, self._labels(labels),
+                                            count))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host, port, count=1):
+        """Serves the metrics on the first free port of count from port.
+
+        Returns the port, or None if every one of them is taken.
+        """
+        sink = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sink.render()
+                self.send_response(200)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        for candidate in xrange(port, port + max(count, 1)):
+            try:
+                server = BaseHTTPServer.HTTPServer((host, candidate), Handler)
+            except socket.error:
+                # Another worker on this host serves its metrics here
+                continue
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            LOG.info("Serving IPAM metrics on %s:%d" % (host, candidate))
+            return candidate
+
+        LOG.error("Couldn't serve IPAM metrics, ports %d-%d on %s are all "
+                  "in use. This worker's metrics won't be scraped; set "
+                  "ipam_metrics_prometheus_port_count to at least the number "
+                  "of API workers or use the statsd sink." %
+                  (port, port + max(count, 1) - 1, host))
+
+
+def _make_sink():
+    sink = CONF.QUARK.ipam_metrics_sink
+    prefix = CONF.QUARK.ipam_metrics_prefix
+    if sink == "statsd":
+        return StatsdSink(CONF.QUARK.ipam_metrics_statsd_host,
+                          CONF.QUARK.ipam_metrics_statsd_port, prefix)
+    if sink == "prometheus":
+        prometheus = PrometheusSink(prefix)
+        if CONF.QUARK.ipam_metrics_prometheus_port:
+            prometheus.serve(CONF.QUARK.ipam_metrics_prometheus_host,
+                             CONF.QUARK.ipam_metrics_prometheus_port,
+                             CONF.QUARK.ipam_metrics_prometheus_port_count)
+        return prometheus
+    return NullSink()
+
+
+def get_sink():
+    global _SINK
+    if _SINK is None:
+        with _SINK_LOCK:
+            if _SINK is None:
+                _SINK = _make_sink()
+    return _SINK
+
+
+def reset():
+    """Drops the current sink so the next metric rereads the config."""
+    global _SINK
+    with _SINK_LOCK:
+        _SINK = None
+
+
+def increment(name, value=1, **labels):
+    get_sink().increment(name, value, labels)
+
+
+def observe(name, seconds, **labels):
+    get_sink().observe(name, seconds, labels)
@@ -17,6 +17,10 @@
 v2 Neutron Plug-in API Quark Implementation
 """
 
+import collections
+import time
+
+from neutron.db import api as neutron_db_api
 from neutron.extensions import securitygroup as sg_ext
 from neutron import neutron_plugin_base_v2
 from neutron.quota import resource as qres
@@ -38,6 +42,7 @@ from quark.plugin_modules import routes
 from quark.plugin_modules import security_groups
 from quark.plugin_modules import segment_allocation_ranges
 from quark.plugin_modules import subnets
+from quark import sql_stats
 
 LOG = logging.getLogger(__name__)
 
@@ -106,13 +111,94 @@ def append_quark_extensions(conf):
 append_quark_extensions(CONF)
 
 
+quark_replica_opts = [
+    cfg.BoolOpt('read_replica_gets',
+                default=False,
+                help=_('Serve read-only plugin calls (get_ports, get_subnets,'
+                       ' get_networks, get_floatingips, get_ip_addresses and'
+                       ' their single and count variants) from a'
+                       ' slave_connection session instead of the master.')),
+    cfg.IntOpt('read_replica_write_pin_seconds',
+               default=0,
+               help=_('Seconds after a tenant writes through this process'
+                      ' during which its reads through this process still'
+                      ' go to the master. 0 disables pinning. Writes are'
+                      ' only remembered per process, so reads served by'
+                      ' another API worker or server are not pinned. A'
+                      ' tenant is only guaranteed to read its own writes'
+                      ' when its reads reach the same process and'
+                      ' replication lag stays below this window.')),
+]
+
 CONF.register_opts(quark_quota_opts, "QUOTAS")
+CONF.register_opts(quark_replica_opts, "QUARK")
 qres_reg.ResourceRegistry.get_instance().register_resources(quark_resources)
 
+# tenant_id -> time of that tenant's last write through this process, oldest
+# write first. Only writes inside the pin window are kept. Nothing shares
+# this between workers, so the pin holds per process only.
+_TENANT_WRITES = collections.OrderedDict()
+
+
+def _record_write(context):
+    pin = CONF.QUARK.read_replica_write_pin_seconds
+    if pin <= 0 or not context.tenant_id:
+        return
+    now = time.time()
+    _TENANT_WRITES.pop(context.tenant_id, None)
+    _TENANT_WRITES[context.tenant_id] = now
+    while _TENANT_WRITES:
+        tenant_id, written = next(_TENANT_WRITES.iteritems())
+        if now - written < pin:
+            break
+        _TENANT_WRITES.pop(tenant_id, None)
+
+
+def _use_replica(context, use_replica=None):
+    if use_replica is not None:
+        return use_replica
+    if not CONF.QUARK.read_replica_gets:
+        return False
+    pin = CONF.QUARK.read_replica_write_pin_seconds
+    if pin > 0:
+        written = _TENANT_WRITES.get(context.tenant_id)
+        if written is not None:
+            if time.time() - written < pin:
+                return False
+            _TENANT_WRITES.pop(context.tenant_id, None)
+    return True
+
+
+def replica_read(func):
+    """Runs a read-only plugin call against a replica session.
+
+    Routing follows read_replica_gets and the read-your-writes window,
+    unless the caller passes use_replica=True or False. Calls made while
+    the context already has an active session stay on that session.
+    """
+    def _wrapped(self, context, *args, **kwargs):
+        use_replica = kwargs.pop("use_replica", None)
+        current = context._session
+        if (not _use_replica(context, use_replica) or
+                (current is not None and current.is_active)):
+            return func(self, context, *args, **kwargs)
+
+        context._session = neutron_db_api.get_session(use_slave=True)
+        try:
+            return func(self, context, *args, **kwargs)
+        finally:
+            if context._session is not None:
+                context._session.close()
+            context._session = current
+    return _wrapped
+
 
 def sessioned(func):
     def _wrapped(self, context, *args, **kwargs):
-        res = func(self, context, *args, **kwargs)
+        with sql_stats.collect(func.__name__):
+            res = func(self, context, *args, **kwargs)
+        if not func.__name__.startswith("get_"):
+            _record_write(context)
         if not context.session.is_active:
             context.session.close()
             # NOTE(mdietz): Forces neutron to get a fresh session
@@ -122,6 +208,39 @@ def sessioned(func):
     return _wrapped
 
 
+def sessioned_chunks(func):
+    """replica_read and sessioned, for calls that return a generator.
+
+    The chunks are read as the response is sent, after the call has
+    returned, so the session is picked on the first read, kept until the
+    generator is exhausted or closed, and only then closed.
+    """
+    def _wrapped(self, context, *args, **kwargs):
+        use_replica = kwargs.pop("use_replica", None)
+        current = context._session
+        replica = (_use_replica(context, use_replica) and
+                   not (current is not None and current.is_active))
+        if replica:
+            context._session = neutron_db_api.get_session(use_slave=True)
+        chunks = None
+        try:
+            chunks = sql_stats.collect_iter(
+                func.__name__, func(self, context, *args, **kwargs))
+            for chunk in chunks:
+                yield chunk
+        finally:
+            if chunks is not None:
+                chunks.close()
+            if replica:
+                if context._session is not None:
+                    context._session.close()
+                context._session = current
+            elif not context.session.is_active:
+                context.session.close()
+                context._session = None
+    return _wrapped
+
+
 class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
              sg_ext.SecurityGroupPluginBase):
     supported_extension_aliases = ["mac_address_ranges", "routes",
@@ -236,10 +355,16 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def delete_ip_policy(self, context, id):
         return ip_policies.delete_ip_policy(context, id)
 
+    @replica_read
     @sessioned
     def get_ip_addresses(self, context, **filters):
         return ip_addresses.get_ip_addresses(context, **filters)
 
+    @sessioned_chunks
+    def get_ip_addresses_chunks(self, context, **filters):
+        return ip_addresses.get_ip_addresses_chunks(context, **filters)
+
+    @replica_read
     @sessioned
     def get_ip_address(self, context, id):
         return ip_addresses.get_ip_address(context, id)
@@ -262,6 +387,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         self._fix_missing_tenant_id(context, port["port"])
         return ports.create_port(context, port)
 
+    @replica_read
     @sessioned
     def get_port(self, context, id, fields=None):
         return ports.get_port(context, id, fields)
@@ -275,12 +401,17 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return ip_addresses.update_port_for_ip_address(context, ip_id, id,
                                                        port)
 
+    @replica_read
     @sessioned
     def get_ports(self, context, limit=None, page_reverse=False, sorts=None,
                   marker=None, filters=None, fields=None):
         return ports.get_ports(context, limit, sorts, marker, page_reverse,
                                filters, fields)
 
+    @sessioned_chunks
+    def get_ports_chunks(self, context, filters=None, fields=None):
+        return ports.get_ports_chunks(context, filters, fields)
+
     @sessioned
     def get_ports_for_ip_address(self, context, ip, limit=None,
                                  page_reverse=False, sorts=None, marker=None,
@@ -293,6 +424,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def get_port_for_ip_address(self, context, ip_id, id, fields=None):
         return ip_addresses.get_port_for_ip_address(context, ip_id, id, fields)
 
+    @replica_read
     @sessioned
     def get_ports_count(self, context, filters=None):
         return ports.get_ports_count(context, filters)
@@ -335,16 +467,19 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def update_subnet(self, context, id, subnet):
         return subnets.update_subnet(context, id, subnet)
 
+    @replica_read
     @sessioned
     def get_subnet(self, context, id, fields=None):
         return subnets.get_subnet(context, id, fields)
 
+    @replica_read
     @sessioned
     def get_subnets(self, context, limit=None, page_reverse=False, sorts=None,
                     marker=None, filters=None, fields=None):
         return subnets.get_subnets(context, limit, page_reverse, sorts, marker,
                                    filters, fields)
 
+    @replica_read
     @sessioned
     def get_subnets_count(self, context, filters=None):
         return subnets.get_subnets_count(context, filters)
@@ -366,16 +501,19 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def update_network(self, context, id, network):
         return networks.update_network(context, id, network)
 
+    @replica_read
     @sessioned
     def get_network(self, context, id, fields=None):
         return networks.get_network(context, id, fields)
 
+    @replica_read
     @sessioned
     def get_networks(self, context, limit=None, sorts=None, marker=None,
                      page_reverse=False, filters=None, fields=None):
         return networks.get_networks(context, limit, sorts, marker,
                                      page_reverse, filters, fields)
 
+    @replica_read
     @sessioned
     def get_networks_count(self, context, filters=None):
         return networks.get_networks_count(context, filters)
@@ -426,6 +564,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
         return floating_ips.update_floatingip(context, id,
                                               floatingip["floatingip"])
 
+    @replica_read
     @sessioned
     def get_floatingip(self, context, id, fields=None):
         return floating_ips.get_floatingip(context, id, fields)
@@ -434,6 +573,7 @@ class Plugin(neutron_plugin_base_v2.NeutronPluginBaseV2,
     def delete_floatingip(self, context, id):
         return floating_ips.delete_floatingip(context, id)
 
+    @replica_read
     @sessioned
     def get_floatingips(self, context, filters=None, fields=None,
                         sorts=None, limit=None, marker=None,
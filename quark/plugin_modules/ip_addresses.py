@@ -68,17 +68,38 @@ def _can_create_shared_ip_on_network(context, network_id):
     return True
 
 
-def get_ip_addresses(context, **filters):
+def get_ip_addresses(context, limit=None, sorts=None, marker=None,
+                     **filters):
     LOG.info("get_ip_addresses for tenant %s" % context.tenant_id)
     if not filters:
         filters = {}
     if 'type' in filters:
         filters['address_type'] = filters['type']
     filters["_deallocated"] = False
-    addrs = db_api.ip_address_find(context, scope=db_api.ALL, **filters)
+    if limit and not sorts:
+        sorts = [("id", True)]
+    addrs = db_api.ip_address_find(context, limit=limit, sorts=sorts,
+                                   marker=marker, scope=db_api.ALL,
+                                   **filters)
     return [v._make_ip_dict(ip) for ip in addrs]
 
 
+def get_ip_addresses_chunks(context, **filters):
+    """Yields get_ip_addresses' result as lists of address dicts.
+
+    Addresses are read stream_chunk_size at a time and each chunk is
+    serialized before the next is read.
+    """
+    LOG.info("get_ip_addresses_chunks for tenant %s" % context.tenant_id)
+    if 'type' in filters:
+        filters['address_type'] = filters['type']
+    filters["_deallocated"] = False
+    chunks = db_api.ip_address_find_chunks(
+        context, CONF.QUARK.stream_chunk_size, **filters)
+    for addrs in chunks:
+        yield [v._make_ip_dict(ip) for ip in addrs]
+
+
 def get_ip_address(context, id):
     LOG.info("get_ip_address %s for tenant %s" %
              (id, context.tenant_id))
@@ -21,6 +21,7 @@ from oslo_log import log as logging
 from quark import allocation_pool
 from quark.db import api as db_api
 from quark import exceptions as q_exc
+from quark import ip_policy_cache
 from quark import plugin_views as v
 
 CONF = cfg.CONF
@@ -181,6 +182,7 @@ def update_ip_policy(context, id, ip_policy):
         if ip_policy_cidrs:
             _validate_policy_with_routes(context, ip_policy_cidrs, all_subnets)
         ipp_db = db_api.ip_policy_update(context, ipp_db, **ipp)
+    ip_policy_cache.CACHE.invalidate(id)
     return v._make_ip_policy_dict(ipp_db)
 
 
@@ -193,6 +195,7 @@ def delete_ip_policy(context, id):
         if ipp["networks"] or ipp["subnets"]:
             raise q_exc.IPPolicyInUse(id=id)
         db_api.ip_policy_delete(context, ipp)
+    ip_policy_cache.CACHE.invalidate(id)
 
 
 def _validate_cidrs_fit_into_subnets(cidrs, subnets):
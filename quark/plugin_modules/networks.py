@@ -188,10 +188,11 @@ def get_network(context, id, fields=None):
              (id, context.tenant_id, fields))
 
     network = db_api.network_find(context, None, None, None, False,
-                                  id=id, join_subnets=True, scope=db_api.ONE)
+                                  id=id, join_subnets=True, cached=True,
+                                  scope=db_api.ONE)
     if not network:
         raise n_exc.NetworkNotFound(net_id=id)
-    return v._make_network_dict(network, fields=fields)
+    return v._make_network_dict_cached(network, fields=fields)
 
 
 def get_networks(context, limit=None, sorts=None, marker=None,
@@ -217,9 +218,17 @@ def get_networks(context, limit=None, sorts=None, marker=None,
     LOG.info("get_networks for tenant %s with filters %s, fields %s" %
              (context.tenant_id, filters, fields))
     filters = filters or {}
+    columns = v._projected_columns(v.NETWORK_PROJECTIONS, fields)
+    if columns:
+        rows = db_api.network_find(context, limit, sorts, marker,
+                                   page_reverse, columns=columns,
+                                   **filters) or []
+        return v._make_projected_list(rows, columns, v.NETWORK_PROJECTIONS,
+                                      fields)
     nets = db_api.network_find(context, limit, sorts, marker, page_reverse,
-                               join_subnets=True, **filters) or []
-    nets = [v._make_network_dict(net, fields=fields) for net in nets]
+                               join_subnets=True, cached=True,
+                               **filters) or []
+    nets = [v._make_network_dict_cached(net, fields=fields) for net in nets]
     return nets
 
 
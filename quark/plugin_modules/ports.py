@@ -507,7 +507,7 @@ def get_port(context, id, fields=None):
     LOG.info("get_port %s for tenant %s fields %s" %
              (id, context.tenant_id, fields))
     results = db_api.port_find(context, id=id, fields=fields,
-                               scope=db_api.ONE)
+                               join_security_groups=True, scope=db_api.ONE)
 
     if not results:
         raise n_exc.PortNotFound(port_id=id)
@@ -555,12 +555,38 @@ def get_ports(context, limit=None, sorts=None, marker=None, page_reverse=False,
         for ip in query:
             ports.extend(ip.ports)
     else:
+        columns = v._projected_columns(v.PORT_PROJECTIONS, fields)
+        if columns:
+            rows = db_api.port_find(context, limit, sorts, marker,
+                                    columns=columns, **filters)
+            return v._make_projected_list(rows, columns, v.PORT_PROJECTIONS,
+                                          fields)
         ports = db_api.port_find(context, limit, sorts, marker,
                                  fields=fields, join_security_groups=True,
                                  **filters)
     return v._make_ports_list(ports, fields)
 
 
+def get_ports_chunks(context, filters=None, fields=None):
+    """Yields get_ports' result as lists of port dicts.
+
+    Ports are read stream_chunk_size at a time and each chunk is
+    serialized before the next is read, so an unbounded listing never
+    holds more than a chunk of port models.
+    """
+    LOG.info("get_ports_chunks for tenant %s filters %s fields %s" %
+             (context.tenant_id, filters, fields))
+    filters = filters or {}
+    if "ip_address" in filters:
+        yield get_ports(context, filters=filters, fields=fields)
+        return
+
+    chunks = db_api.port_find_chunks(context, CONF.QUARK.stream_chunk_size,
+                                     fields=fields, **filters)
+    for ports in chunks:
+        yield v._make_ports_list(ports, fields)
+
+
 def get_ports_count(context, filters=None):
     """Return the number of ports.
 
@@ -370,7 +370,7 @@ def get_subnet(context, id, fields=None):
     LOG.info("get_subnet %s for tenant %s with fields %s" %
              (id, context.tenant_id, fields))
     subnet = db_api.subnet_find(context, None, None, None, False, id=id,
-                                join_dns=True, join_routes=True,
+                                join_dns=True, join_routes=True, cached=True,
                                 scope=db_api.ONE)
     if not subnet:
         raise n_exc.SubnetNotFound(subnet_id=id)
@@ -379,7 +379,7 @@ def get_subnet(context, id, fields=None):
     if not cache:
         new_cache = subnet.allocation_pools
         db_api.subnet_update_set_alloc_pool_cache(context, subnet, new_cache)
-    return v._make_subnet_dict(subnet)
+    return v._make_subnet_dict_cached(subnet)
 
 
 def get_subnets(context, limit=None, page_reverse=False, sorts=None,
@@ -405,10 +405,19 @@ def get_subnets(context, limit=None, page_reverse=False, sorts=None,
     LOG.info("get_subnets for tenant %s with filters %s fields %s" %
              (context.tenant_id, filters, fields))
     filters = filters or {}
+    columns = v._projected_columns(v.SUBNET_PROJECTIONS, fields)
+    if columns:
+        rows = db_api.subnet_find(context, limit=limit,
+                                  page_reverse=page_reverse, sorts=sorts,
+                                  marker_obj=marker, columns=columns,
+                                  **filters) or []
+        return v._make_projected_list(rows, columns, v.SUBNET_PROJECTIONS,
+                                      fields)
     subnets = db_api.subnet_find(context, limit=limit,
                                  page_reverse=page_reverse, sorts=sorts,
                                  marker_obj=marker, join_dns=True,
-                                 join_routes=True, join_pool=True, **filters)
+                                 join_routes=True, join_pool=True,
+                                 cached=True, **filters)
     for subnet in subnets:
         cache = subnet.get("_allocation_pool_cache")
         if not cache:
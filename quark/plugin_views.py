@@ -18,12 +18,15 @@ View Helpers for Quark Plugin
 """
 
 import netaddr
+from netaddr.strategy import ipv6
 from oslo_config import cfg
 from oslo_log import log as logging
 
 from quark.db import ip_types
+from quark.db import models
 from quark import network_strategy
 from quark import protocols
+from quark import provider_cache
 from quark import tags
 
 
@@ -49,11 +52,115 @@ quark_view_opts = [
                 help=_('Controls whether or not to show the provider subnet '
                        'id specified in the network strategy or use the '
                        'real id.')),
+    cfg.BoolOpt('project_listed_fields',
+                default=False,
+                help=_('Controls whether port, subnet and network listings '
+                       'that ask only for plain column fields select just '
+                       'those columns instead of loading whole models.')),
+    cfg.BoolOpt('fast_port_views',
+                default=False,
+                help=_('Controls whether port listings are serialized with'
+                       ' integer MAC and address formatting and per listing'
+                       ' lookups instead of the per port views.')),
+    cfg.BoolOpt('stream_listings',
+                default=False,
+                help=_('Controls whether admin IP address listings without'
+                       ' a limit are read in chunks and sent as a chunked'
+                       ' JSON response instead of being built whole in'
+                       ' memory.')),
+    cfg.IntOpt('stream_chunk_size',
+               default=500,
+               help=_('Rows read from the database per chunk of a streamed'
+                      ' listing.')),
 ]
 
 CONF.register_opts(quark_view_opts, "QUARK")
 
 
+def _column(name):
+    return (name,), lambda row: row[name]
+
+
+def _constant(value):
+    return (), lambda row: value
+
+
+def _format_mac(mac):
+    if not mac:
+        return mac
+    return str(netaddr.EUI(mac)).replace('-', ':')
+
+
+def _subnet_network_id(row):
+    if STRATEGY.is_provider_subnet(row["id"]):
+        return STRATEGY.get_network_for_subnet(row["id"])
+    return row["network_id"]
+
+
+# Fields that can be built from a resource's own columns, mapped to the
+# columns they need and how to build them from a row of those columns.
+# They must match what the _make_*_dict views return for the same field.
+PORT_PROJECTIONS = {
+    "id": _column("id"),
+    "name": _column("name"),
+    "network_id": _column("network_id"),
+    "tenant_id": _column("tenant_id"),
+    "admin_state_up": _column("admin_state_up"),
+    "device_id": _column("device_id"),
+    "device_owner": _column("device_owner"),
+    "status": _constant("ACTIVE"),
+    "mac_address": (("mac_address",),
+                    lambda row: _format_mac(row["mac_address"]))}
+
+NETWORK_PROJECTIONS = {
+    "id": _column("id"),
+    "name": _column("name"),
+    "tenant_id": _column("tenant_id"),
+    "admin_state_up": _constant(True),
+    "status": _constant("ACTIVE"),
+    "shared": (("id",), lambda row: STRATEGY.is_provider_network(row["id"]))}
+
+SUBNET_PROJECTIONS = {
+    "id": _column("id"),
+    "name": _column("name"),
+    "tenant_id": _column("tenant_id"),
+    "ip_version": _column("ip_version"),
+    "cidr": _column("cidr"),
+    "enable_dhcp": _constant(None),
+    "network_id": (("id", "network_id"), _subnet_network_id),
+    "shared": (("id", "network_id"),
+               lambda row: STRATEGY.is_provider_network(
+                   _subnet_network_id(row)))}
+
+
+def _projected_columns(projections, fields):
+    """Returns the columns needed to build fields.
+
+    Returns None when projection is disabled, no fields were asked for or
+    some field needs more than the resource's columns, in which case the
+    caller lists whole models instead.
+    """
+    if not CONF.QUARK.project_listed_fields or not fields:
+        return None
+    columns = ["id"]
+    for field in fields:
+        if field not in projections:
+            return None
+        for column in projections[field][0]:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def _make_projected_list(rows, columns, projections, fields):
+    results = []
+    for row in rows:
+        values = dict(zip(columns, row))
+        results.append(dict((field, projections[field][1](values))
+                            for field in fields))
+    return results
+
+
 def _is_default_route(route):
     return route.value == 0
 
@@ -133,6 +240,24 @@ def _make_subnet_dict(subnet, fields=None):
     return res
 
 
+def _make_network_dict_cached(network, fields=None):
+    """_make_network_dict, kept in the provider cache for provider nets."""
+    if not STRATEGY.is_provider_network(network["id"]):
+        return _make_network_dict(network, fields=fields)
+    return provider_cache.CACHE.view(
+        models.Network, network["id"], fields,
+        lambda: _make_network_dict(network, fields=fields))
+
+
+def _make_subnet_dict_cached(subnet, fields=None):
+    """_make_subnet_dict, kept in the provider cache for provider subnets."""
+    if not STRATEGY.is_provider_subnet(subnet["id"]):
+        return _make_subnet_dict(subnet, fields=fields)
+    return provider_cache.CACHE.view(
+        models.Subnet, subnet["id"], fields,
+        lambda: _make_subnet_dict(subnet, fields=fields))
+
+
 def _make_security_group_dict(security_group, fields=None):
     res = {"id": security_group.get("id"),
            "description": security_group.get("description"),
@@ -184,17 +309,15 @@ def _port_dict(port, fields=None):
            "device_owner": port.get("device_owner")}
 
     if "mac_address" in res and res["mac_address"]:
-        mac = str(netaddr.EUI(res["mac_address"])).replace('-', ':')
-        res["mac_address"] = mac
+        res["mac_address"] = _format_mac(res["mac_address"])
 
     # NOTE(mdietz): more pythonic key in dict check fails here. Leave as get
     if port.get("bridge"):
         res["bridge"] = port["bridge"]
 
-    # NOTE(ClifHouck): This causes another trip to the DB since tags are
-    # are not eager loaded. According to mdietz this be a small impact on
-    # performance, but if the tag system gets used more on ports, we may
-    # want to eager load the tags.
+    # Tags are eager loaded for the whole page when port_find is called
+    # with join_security_groups, as get_port and get_ports do. Ports
+    # loaded without it fetch their tags here instead.
     try:
         t = PORT_TAG_REGISTRY.get_all(port)
         res.update(t)
@@ -255,7 +378,115 @@ def _make_ip_ports_list(ip, query, fields=None):
     return ports
 
 
+def _format_mac_int(mac):
+    """Same as _format_mac for integer MACs, without building an EUI."""
+    if not isinstance(mac, (int, long)):
+        return _format_mac(mac)
+    if not mac:
+        return mac
+    digits = "%012X" % mac
+    return ":".join([digits[i:i + 2] for i in (0, 2, 4, 6, 8, 10)])
+
+
+def _format_ip_int(ip):
+    """Same as IPAddress.formatted, from the integer address column."""
+    value = ip.address
+    if ip.version == 4:
+        return "%d.%d.%d.%d" % ((value >> 24) & 0xff, (value >> 16) & 0xff,
+                                (value >> 8) & 0xff, value & 0xff)
+    return ipv6.int_to_str(value)
+
+
+def _provider_subnet_map():
+    """Returns {network_id: {ip_version: subnet_id}} of provider networks."""
+    providers = {}
+    for net_id in STRATEGY.get_provider_networks():
+        subnets = STRATEGY.get_network(net_id).get("subnets", {})
+        providers[net_id] = dict((int(version), subnet_id)
+                                 for version, subnet_id in subnets.items())
+    return providers
+
+
+def _tag_values(tag_prefixes, port_tags):
+    """Same as PORT_TAG_REGISTRY.get_all, reading the port's tags once."""
+    values = {}
+    for name, tag, prefix in tag_prefixes:
+        matched = False
+        value = None
+        for port_tag in port_tags:
+            if not port_tag.startswith(prefix):
+                continue
+            matched = True
+            try:
+                tag.validate(port_tag[len(prefix):])
+            except tags.TagValidationError:
+                continue
+            value = port_tag[len(prefix):]
+            break
+        if matched:
+            values[name] = value
+    return values
+
+
+def _make_ports_list_fast(query, fields=None):
+    """Builds the same list as _make_ports_list, with less work per port.
+
+    The provider subnet map is built once per listing, and each port's IP
+    enabled flags come from one pass over its associations.
+    """
+    providers = {}
+    if CONF.QUARK.show_provider_subnet_ids:
+        providers = _provider_subnet_map()
+    port_subnets = fields and "port_subnets" in fields
+    tag_prefixes = [(name, tag, tag.get_prefix())
+                    for name, tag in PORT_TAG_REGISTRY.tags.items()]
+
+    ports = []
+    for port in query:
+        res = {"id": port.id,
+               "name": port.name,
+               "network_id": port.network_id,
+               "tenant_id": port.tenant_id,
+               "mac_address": _format_mac_int(port.mac_address),
+               "admin_state_up": port.admin_state_up,
+               "status": "ACTIVE",
+               "security_groups": [group.id
+                                   for group in port.security_groups],
+               "device_id": port.device_id,
+               "device_owner": port.device_owner}
+        if port.bridge:
+            res["bridge"] = port.bridge
+        try:
+            res.update(_tag_values(tag_prefixes, list(port.tags)))
+        except Exception as e:
+            msg = ("Unknown error loading tags for port %s: %s"
+                   % (port.id, e))
+            LOG.exception(msg)
+
+        enabled = {}
+        for assoc in port.associations:
+            enabled.setdefault(assoc.ip_address_id, assoc.enabled)
+        fixed_ips = []
+        for ip in port.ip_addresses:
+            if not _ip_is_fixed(port, ip):
+                continue
+            subnet_id = ip.subnet_id
+            if ip.network_id in providers:
+                subnet_id = providers[ip.network_id].get(ip.version)
+            ip_addr = {"subnet_id": subnet_id,
+                       "ip_address": _format_ip_int(ip),
+                       "enabled": enabled.get(ip.id)}
+            if port_subnets:
+                ip_addr["subnet"] = _make_subnet_dict(ip.subnet)
+            fixed_ips.append(ip_addr)
+        res["fixed_ips"] = fixed_ips
+        ports.append(res)
+    return ports
+
+
 def _make_ports_list(query, fields=None):
+    if CONF.QUARK.fast_port_views:
+        return _make_ports_list_fast(query, fields)
     ports = []
     for port in query:
         port_dict = _port_dict(port, fields)
@@ -269,7 +500,7 @@ def _make_ports_list(query, fields=None):
 def _make_subnets_list(query, fields=None):
     subnets = []
     for subnet in query:
-        subnets.append(_make_subnet_dict(subnet, fields=fields))
+        subnets.append(_make_subnet_dict_cached(subnet, fields=fields))
     return subnets
 
 
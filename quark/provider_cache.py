@@ -0,0 +1,127 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Process local cache of the provider networks and subnets.
+
+The networks and subnets named in network_strategy.STRATEGY are read by
+most network, subnet and port calls but only change when an operator
+edits them. Entries are keyed on (model, id) and hold a detached copy of
+the model plus the API views built from it. The db_api functions that
+change networks, subnets, routes or IP policies invalidate what they
+touch; changes made by other processes are picked up once the entry's
+TTL runs out.
+"""
+
+import copy
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.IntOpt('provider_cache_ttl',
+               default=0,
+               help=_('Seconds a provider network or subnet, and its API '
+                      'views, are kept in memory per process. 0 disables '
+                      'the cache.'))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+
+class _Entry(object):
+    __slots__ = ["expires", "model", "views"]
+
+    def __init__(self, expires):
+        self.expires = expires
+        self.model = None
+        self.views = {}
+
+
+class ProviderCache(object):
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return CONF.QUARK.provider_cache_ttl
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def _entry(self, key, create=False):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= now:
+            del self._entries[key]
+            entry = None
+        if entry is None and create:
+            entry = self._entries[key] = _Entry(now + self.ttl)
+        return entry
+
+    def get(self, model, model_id):
+        """Returns the cached detached model, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entry((model, model_id))
+            return entry.model if entry is not None else None
+
+    def put(self, model, model_id, instance):
+        """Caches instance, which must be detached and fully loaded."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entry((model, model_id), create=True).model = instance
+
+    def view(self, model, model_id, fields, build):
+        """Returns a copy of the view build() makes for fields."""
+        if not self.enabled:
+            return build()
+        key = tuple(sorted(fields or []))
+        with self._lock:
+            entry = self._entry((model, model_id))
+            view = entry.views.get(key) if entry is not None else None
+        if view is None:
+            view = build()
+            with self._lock:
+                self._entry((model, model_id), create=True).views[key] = view
+        # Callers are free to change what they get back
+        return copy.deepcopy(view)
+
+    def invalidate(self, model, model_id):
+        with self._lock:
+            self._entries.pop((model, model_id), None)
+        LOG.debug("Invalidated cached {0} {1}".format(
+            model.__name__, model_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+CACHE = ProviderCache()
@@ -0,0 +1,192 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Per plugin call SQL statement counts and timings.
+
+With sql_stats on, the sessioned decorator in quark.plugin runs each
+plugin call under collect(), and every statement any engine executes in
+that (green)thread meanwhile is attributed to the call. One summary line
+is logged per call, and calls over the slow thresholds also log each of
+their statements. Calls that return a generator are collected with
+collect_iter, which only counts what runs while an item is being read.
+"""
+
+import contextlib
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.BoolOpt('sql_stats',
+                default=False,
+                help=_('Count the SQL statements of each plugin call and time'
+                       ' them, and log a summary line per call.')),
+    cfg.IntOpt('sql_stats_slow_ms',
+               default=500,
+               help=_('Plugin calls whose statements take longer than this'
+                      ' many milliseconds in total also log every'
+                      ' statement. 0 disables.')),
+    cfg.IntOpt('sql_stats_slow_count',
+               default=50,
+               help=_('Plugin calls that execute more than this many'
+                      ' statements also log every statement. 0 disables.'))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+_LOCAL = threading.local()
+_LISTENING = False
+_LISTEN_LOCK = threading.Lock()
+_START_KEY = "quark_sql_stats_start"
+
+
+class CallStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.statements = []
+        self.started = time.time()
+        self.elapsed = None
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def db_time(self):
+        return sum(seconds for _statement, seconds in self.statements)
+
+    @property
+    def slowest(self):
+        if not self.statements:
+            return None
+        return max(self.statements, key=lambda s: s[1])
+
+    def is_slow(self):
+        slow_ms = CONF.QUARK.sql_stats_slow_ms
+        slow_count = CONF.QUARK.sql_stats_slow_count
+        return ((slow_ms and self.db_time * 1000 > slow_ms) or
+                (slow_count and self.count > slow_count))
+
+    def summary(self):
+        line = ("%s: %d statements, %.1fms in the database, %.1fms total" %
+                (self.name, self.count, self.db_time * 1000,
+                 self.elapsed * 1000))
+        if self.statements:
+            statement, seconds = self.slowest
+            line += ", slowest %.1fms: %s" % (seconds * 1000,
+                                              " ".join(statement.split()))
+        return line
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if getattr(_LOCAL, "stats", None) is not None:
+        conn.info[_START_KEY] = time.time()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = getattr(_LOCAL, "stats", None)
+    started = conn.info.pop(_START_KEY, None)
+    if stats is not None and started is not None:
+        stats.statements.append((statement, time.time() - started))
+
+
+def _listen():
+    global _LISTENING
+    if _LISTENING:
+        return
+    with _LISTEN_LOCK:
+        if not _LISTENING:
+            event.listen(Engine, "before_cursor_execute",
+                         _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute",
+                         _after_cursor_execute)
+            _LISTENING = True
+
+
+def _report(stats):
+    LOG.info(stats.summary())
+    if stats.is_slow():
+        LOG.warning("%s executed:\n%s" % (stats.name, "\n".join(
+            "%.1fms: %s" % (seconds * 1000, statement)
+            for statement, seconds in stats.statements)))
+
+
+@contextlib.contextmanager
+def collect(name):
+    """Attributes the statements executed within to the call name.
+
+    Yields the CallStats being collected, or None when sql_stats is off or
+    an enclosing call is already collecting, in which case the statements
+    count towards that call instead.
+    """
+    if (not CONF.QUARK.sql_stats or
+            getattr(_LOCAL, "stats", None) is not None):
+        yield None
+        return
+
+    _listen()
+    stats = CallStats(name)
+    _LOCAL.stats = stats
+    try:
+        yield stats
+    finally:
+        _LOCAL.stats = None
+        stats.elapsed = time.time() - stats.started
+        _report(stats)
+
+
+def collect_iter(name, iterable):
+    """Yields iterable's items, attributing their statements to name.
+
+    Only the statements executed while the next item is being read count,
+    not whatever the consumer runs in between. The summary is logged once
+    the iterable is exhausted, or the generator closed.
+    """
+    if not CONF.QUARK.sql_stats:
+        for item in iterable:
+            yield item
+        return
+
+    _listen()
+    stats = CallStats(name)
+    iterator = iter(iterable)
+    try:
+        while True:
+            outer = getattr(_LOCAL, "stats", None)
+            if outer is None:
+                _LOCAL.stats = stats
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                if outer is None:
+                    _LOCAL.stats = None
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+        stats.elapsed = time.time() - stats.started
+        _report(stats)
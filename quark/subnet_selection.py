@@ -0,0 +1,175 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Orderings of the candidate subnets an IPAM strategy allocates from.
+
+Always trying the most full subnet first packs addresses tightly, but every
+worker then contends on the same subnet row. The other selections spread
+concurrent allocations across a segment's subnets. Candidates are grouped
+by IP version, v4 first, and each selection only reorders within a group.
+"""
+
+import itertools
+import random
+import zlib
+
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from quark.db import api as db_api
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+quark_opts = [
+    cfg.IntOpt('ipam_subnet_selection_top_k',
+               default=4,
+               help=_('Number of the most full candidate subnets the'
+                      ' WEIGHTED_RANDOM subnet selection picks from.'))
+]
+
+CONF.register_opts(quark_opts, "QUARK")
+
+_ROTATIONS_MAX = 4096
+
+
+def _free(subnet, ips_in_subnet):
+    return max(subnet["last_ip"] - subnet["first_ip"] + 1 - ips_in_subnet, 0)
+
+
+def _by_version(subnets):
+    subnets = [s for s in subnets if s[0] is not None]
+    return [list(group) for _version, group in
+            itertools.groupby(subnets, key=lambda s: s[0]["ip_version"])]
+
+
+def _rotate(candidates, offset):
+    offset %= len(candidates)
+    return candidates[offset:] + candidates[:offset]
+
+
+class MostFull(object):
+    """Fills the most used subnet first. The historical behavior."""
+    @classmethod
+    def get_name(cls):
+        return "MOST_FULL"
+
+    def find(self, context, net_id, **kwargs):
+        return db_api.subnet_find_ordered_by_most_full(context, net_id,
+                                                       **kwargs)
+
+    def order(self, subnets, net_id=None, segment_id=None, port_id=None):
+        return subnets
+
+
+class LeastFull(MostFull):
+    """Allocates from the subnet with the most free addresses first."""
+    @classmethod
+    def get_name(cls):
+        return "LEAST_FULL"
+
+    def find(self, context, net_id, **kwargs):
+        return db_api.subnet_find_ordered_by_least_full(context, net_id,
+                                                        **kwargs)
+
+
+class RoundRobin(MostFull):
+    """Starts each allocation on the next subnet of the segment."""
+    def __init__(self):
+        self._counters = {}
+
+    @classmethod
+    def get_name(cls):
+        return "ROUND_ROBIN"
+
+    def _next(self, key):
+        counter = self._counters.get(key)
+        if counter is None:
+            if len(self._counters) >= _ROTATIONS_MAX:
+                self._counters.clear()
+            counter = self._counters.setdefault(key, itertools.count())
+        return next(counter)
+
+    def order(self, subnets, net_id=None, segment_id=None, port_id=None):
+        ordered = []
+        for group in _by_version(subnets):
+            key = (net_id, segment_id, group[0][0]["ip_version"])
+            ordered.extend(_rotate(group, self._next(key)))
+        return ordered
+
+
+class PortHash(MostFull):
+    """Starts on a subnet chosen by a hash of the port ID.
+
+    Concurrent creates for different ports land on different subnets, and
+    retries for the same port keep trying the same one first.
+    """
+    @classmethod
+    def get_name(cls):
+        return "PORT_HASH"
+
+    def order(self, subnets, net_id=None, segment_id=None, port_id=None):
+        if not port_id:
+            return subnets
+        offset = zlib.crc32(str(port_id)) & 0xffffffff
+        ordered = []
+        for group in _by_version(subnets):
+            ordered.extend(_rotate(group, offset))
+        return ordered
+
+
+class WeightedRandom(MostFull):
+    """Picks one of the top K most full subnets, weighted by free space.
+
+    Keeps addresses mostly packed into the fullest subnets while spreading
+    concurrent allocations across several of them.
+    """
+    @classmethod
+    def get_name(cls):
+        return "WEIGHTED_RANDOM"
+
+    def _pick(self, candidates):
+        weights = [_free(subnet, used) for subnet, used in candidates]
+        total = sum(weights)
+        if not total:
+            return 0
+        point = random.random() * total
+        for idx, weight in enumerate(weights):
+            point -= weight
+            if point < 0:
+                return idx
+        return len(weights) - 1
+
+    def order(self, subnets, net_id=None, segment_id=None, port_id=None):
+        top_k = max(CONF.QUARK.ipam_subnet_selection_top_k, 1)
+        ordered = []
+        for group in _by_version(subnets):
+            idx = self._pick(group[:top_k])
+            ordered.append(group[idx])
+            ordered.extend(group[:idx] + group[idx + 1:])
+        return ordered
+
+
+SELECTIONS = dict((cls.get_name(), cls) for cls in
+                  (MostFull, LeastFull, RoundRobin, PortHash, WeightedRandom))
+
+
+def get_selection(name=None):
+    name = name or MostFull.get_name()
+    if name not in SELECTIONS:
+        LOG.warn("Subnet selection %s not found, using %s" %
+                 (name, MostFull.get_name()))
+        name = MostFull.get_name()
+    return SELECTIONS[name]()
@@ -0,0 +1,130 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+import json
+
+import mock
+from neutron import context
+from oslo_config import cfg
+import webob
+
+from quark.api import streaming
+from quark.tests import test_base
+
+
+class TestStreaming(test_base.TestBase):
+    def setUp(self):
+        super(TestStreaming, self).setUp()
+        self.admin = context.get_admin_context()
+        self.tenant = context.Context("fake", "fake", is_admin=False)
+        cfg.CONF.set_override("stream_listings", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "stream_listings", "QUARK")
+
+    def test_should_stream(self):
+        self.assertTrue(streaming.should_stream(self.admin, {}))
+        self.assertFalse(streaming.should_stream(self.admin, {"limit": 10}))
+        self.assertFalse(streaming.should_stream(self.admin,
+                                                 {"marker": "k1.WyIxIl0="}))
+        self.assertFalse(streaming.should_stream(self.tenant, {}))
+        cfg.CONF.set_override("stream_listings", False, "QUARK")
+        self.assertFalse(streaming.should_stream(self.admin, {}))
+
+    def test_json_response(self):
+        chunks = [[{"id": 1}, {"id": 2}], [], [{"id": 3}]]
+        response = streaming.json_response("ports", iter(chunks))
+        self.assertEqual("application/json", response.content_type)
+        self.assertIsNone(response.content_length)
+        body = "".join(response.app_iter)
+        self.assertEqual({"ports": [{"id": 1}, {"id": 2}, {"id": 3}]},
+                         json.loads(body))
+
+    def test_json_response_empty(self):
+        response = streaming.json_response("ports", iter([]))
+        self.assertEqual({"ports": []},
+                         json.loads("".join(response.app_iter)))
+
+    def test_json_response_reads_first_chunk(self):
+        def chunks():
+            raise ValueError()
+            yield []
+        self.assertRaises(ValueError, streaming.json_response, "ports",
+                          chunks())
+
+    def test_later_errors_are_logged(self):
+        def chunks():
+            yield [{"id": 1}]
+            raise ValueError()
+        response = streaming.json_response("ports", chunks())
+        with mock.patch("quark.api.streaming.LOG") as log:
+            self.assertRaises(ValueError, list, response.app_iter)
+        self.assertTrue(log.exception.called)
+
+
+class TestPortsStreamingMiddleware(test_base.TestBase):
+    def setUp(self):
+        super(TestPortsStreamingMiddleware, self).setUp()
+        cfg.CONF.set_override("stream_listings", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "stream_listings", "QUARK")
+        self.app = webob.Response(body="core")
+        self.middleware = streaming.PortsStreamingMiddleware(self.app)
+
+    def _get(self, path, ctx=None, chunks=None, allowed=None):
+        request = webob.Request.blank(path)
+        request.environ["neutron.context"] = (ctx or
+                                              context.get_admin_context())
+        with contextlib.nested(
+            mock.patch("quark.api.streaming.manager.NeutronManager."
+                       "get_plugin"),
+            mock.patch("quark.api.streaming.policy.check")
+        ) as (get_plugin, check):
+            plugin = get_plugin.return_value
+            plugin.get_ports_chunks.return_value = iter(
+                chunks or [[{"id": 1}], [{"id": 2}]])
+            check.side_effect = lambda ctx, action, target, **kwargs: (
+                allowed is None or action in allowed)
+            response = request.get_response(self.middleware)
+            return response, plugin
+
+    def test_streams_admin_listing(self):
+        response, plugin = self._get("/v2.0/ports.json?device_id=1")
+        self.assertEqual({"ports": [{"id": 1}, {"id": 2}]},
+                         json.loads(response.body))
+        self.assertEqual({"device_id": ["1"]},
+                         plugin.get_ports_chunks.call_args[1]["filters"])
+
+    def test_strips_attributes_like_core_controller(self):
+        chunks = [[{"id": 1, "name": "a", "vlan_id": 5}],
+                  [{"id": 2, "name": "b", "vlan_id": 6}]]
+        response, plugin = self._get("/v2.0/ports.json", chunks=chunks,
+                                     allowed=["get_port", "get_port:id"])
+        # name is hidden by policy, vlan_id isn't a port attribute
+        self.assertEqual({"ports": [{"id": 1}, {"id": 2}]},
+                         json.loads(response.body))
+
+    def test_drops_ports_policy_hides(self):
+        response, plugin = self._get("/v2.0/ports.json", allowed=[])
+        self.assertEqual({"ports": []}, json.loads(response.body))
+
+    def test_passes_other_requests_on(self):
+        tenant = context.Context("fake", "fake", is_admin=False)
+        for path, ctx in (("/v2.0/ports.json?limit=10", None),
+                          ("/v2.0/ports.json?sort_key=name", None),
+                          ("/v2.0/ports.json?fields=id", None),
+                          ("/v2.0/networks.json", None),
+                          ("/v2.0/ports.json", tenant)):
+            response, plugin = self._get(path, ctx)
+            self.assertEqual("core", response.body)
+            self.assertFalse(plugin.get_ports_chunks.called)
@@ -0,0 +1,93 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compares quark.address_math against the netaddr code it replaced.
+
+Each case is the per-allocation work done in the IPAM and DB API hot
+paths. Run with: python -m quark.tests.benchmarks.bench_address_math
+"""
+
+import sys
+import timeit
+
+import netaddr
+
+from quark import address_math
+
+MAGIC_INT = 144115188075855872
+V4_CIDR = "10.0.0.0/22"
+V6_CIDR = "feed::/64"
+MAC = 0x00163e000001
+MAPPED = netaddr.IPAddress("10.0.1.17").ipv6().value
+
+
+def netaddr_rfc2462():
+    int_val = netaddr.IPNetwork(V6_CIDR).value
+    int_val += netaddr.EUI(MAC).eui64().value
+    return int_val ^ MAGIC_INT
+
+
+def int_rfc2462():
+    int_val = address_math.cidr_value(V6_CIDR)
+    int_val += address_math.eui64(address_math.mac_to_int(MAC))
+    return int_val ^ MAGIC_INT
+
+
+def netaddr_v4_allocation():
+    # _allocate_from_subnet, _ip_in_subnet/_should_mark_subnet_full and
+    # ip_address_create
+    ipnet = netaddr.IPNetwork(V4_CIDR)
+    next_ip = netaddr.IPAddress(MAPPED).ipv4()
+    return int(next_ip.ipv6()), str(next_ip), ipnet.size, next_ip in ipnet
+
+
+def int_v4_allocation():
+    first, last, version = address_math.cidr_range(V4_CIDR)
+    value = address_math.to_native(MAPPED, version)
+    return (address_math.to_v6(value, version),
+            address_math.format_ip(value, version),
+            last - first + 1,
+            address_math.in_range(value, first, last))
+
+
+def netaddr_v6_candidate():
+    ip = netaddr.IPAddress(netaddr_rfc2462()).ipv6()
+    return int(ip), str(ip)
+
+
+def int_v6_candidate():
+    value = int_rfc2462()
+    return value, address_math.format_ip(value, 6)
+
+
+CASES = [
+    ("rfc2462_ip", netaddr_rfc2462, int_rfc2462),
+    ("v4 allocation", netaddr_v4_allocation, int_v4_allocation),
+    ("v6 candidate", netaddr_v6_candidate, int_v6_candidate),
+]
+
+
+def main(number=20000, repeat=3):
+    for name, slow, fast in CASES:
+        assert slow() == fast(), name
+        slow_time = min(timeit.repeat(slow, number=number, repeat=repeat))
+        fast_time = min(timeit.repeat(fast, number=number, repeat=repeat))
+        print("%-14s netaddr %8.2fus  int %8.2fus  %5.1fx" % (
+            name, slow_time / number * 1e6, fast_time / number * 1e6,
+            slow_time / fast_time))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compares the per port and the fast port listing serializers.
+
+Builds in memory port models, each with a security group, a VLAN tag and
+v4 and v6 addresses, some on a provider network. Serializes them with
+both _make_ports_list paths, checks that the JSON is byte for byte the
+same and reports the best time each took. Run with:
+python -m quark.tests.benchmarks.bench_port_views
+"""
+
+import json
+import random
+import sys
+import time
+import uuid
+
+import netaddr
+
+from quark.db import models
+from quark import network_strategy
+from quark import plugin_views
+
+PORTS = 10000
+RUNS = 3
+PROVIDER_NET = "00000000-0000-0000-0000-000000000000"
+PROVIDER_STRATEGY = json.dumps({PROVIDER_NET: {
+    "bridge": "publicnet",
+    "subnets": {"4": "public_v4", "6": "public_v6"}}})
+TENANT_NET = str(uuid.uuid4())
+CIDRS = {4: netaddr.IPNetwork("10.0.0.0/8"),
+         6: netaddr.IPNetwork("feed::/64")}
+
+
+def _address(rand, version, network_id):
+    cidr = CIDRS[version]
+    value = rand.randint(cidr.first, cidr.last)
+    ip = netaddr.IPAddress(value, version)
+    return models.IPAddress(id=str(uuid.uuid4()),
+                            address=ip.ipv6().value,
+                            address_readable=str(ip),
+                            version=version,
+                            network_id=network_id,
+                            subnet_id=str(uuid.uuid4()),
+                            address_type="fixed")
+
+
+def _ports():
+    rand = random.Random(42)
+    group = models.SecurityGroup(id=str(uuid.uuid4()))
+    ports = []
+    for i in xrange(PORTS):
+        network_id = PROVIDER_NET if i % 3 == 0 else TENANT_NET
+        port = models.Port(id=str(uuid.uuid4()), name="port%d" % i,
+                           network_id=network_id, tenant_id="tenant",
+                           mac_address=rand.randint(1, 2 ** 48 - 1),
+                           admin_state_up=True, device_id=str(i),
+                           device_owner="compute:nova",
+                           security_groups=[group], tags=[])
+        plugin_views.PORT_TAG_REGISTRY.set_all(port, vlan_id=i % 4000 + 1)
+        ips = [_address(rand, 4, network_id), _address(rand, 6, network_id)]
+        port.ip_addresses = ips
+        for n, ip in enumerate(ips):
+            assoc = models.PortIpAssociation()
+            assoc.port_id = port.id
+            assoc.ip_address_id = ip.id
+            assoc.enabled = n == 0
+            port.associations.append(assoc)
+            ip.associations.append(assoc)
+        ports.append(port)
+    return ports
+
+
+def run(name, serializer, ports):
+    # Best of a few runs, the first one also pays for warming up
+    elapsed = None
+    for _i in xrange(RUNS):
+        start = time.time()
+        result = serializer(ports)
+        taken = time.time() - start
+        elapsed = taken if elapsed is None else min(elapsed, taken)
+    print("%-9s %8.1f ms  %9.0f ports/s" % (name, elapsed * 1000,
+                                            len(ports) / elapsed))
+    return json.dumps(result, sort_keys=True)
+
+
+def main():
+    network_strategy.STRATEGY.load(PROVIDER_STRATEGY)
+    ports = _ports()
+    slow = run("per port", plugin_views._make_ports_list, ports)
+    fast = run("fast", plugin_views._make_ports_list_fast, ports)
+    if slow != fast:
+        print("Serialized ports differ")
+        return 1
+    print("Serialized ports are identical (%d bytes)" % len(fast))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compares subnet row contention between the subnet selections.
+
+Concurrent create_port workers each order a segment's subnets with a
+selection and claim the first one, holding its row lock for the length of
+an allocation transaction. The row locks are modelled with threading locks,
+so this measures how evenly a selection spreads workers and how long they
+wait on each other, not database throughput. Run with:
+python -m quark.tests.benchmarks.bench_subnet_selection
+"""
+
+import collections
+import sys
+import threading
+import time
+import uuid
+
+from quark import subnet_selection
+
+SUBNETS = 8
+SUBNET_SIZE = 256
+WORKERS = 16
+PORTS_PER_WORKER = 25
+HOLD_SECONDS = 0.002
+
+
+class Segment(object):
+    def __init__(self):
+        self.subnets = [dict(id=i, ip_version=4, first_ip=0,
+                             last_ip=SUBNET_SIZE - 1)
+                        for i in xrange(SUBNETS)]
+        self.used = dict((s["id"], i) for i, s in enumerate(self.subnets))
+        self.locks = dict((s["id"], threading.Lock()) for s in self.subnets)
+        self.claims = collections.Counter()
+        self.waited = 0.0
+        self._stats = threading.Lock()
+
+    def candidates(self, most_full=True):
+        # What subnet_find_ordered_by_{most,least}_full would return
+        rows = [(s, self.used[s["id"]]) for s in self.subnets]
+        return sorted(rows, key=lambda r: r[1], reverse=most_full)
+
+    def claim(self, subnet):
+        lock = self.locks[subnet["id"]]
+        start = time.time()
+        with lock:
+            waited = time.time() - start
+            time.sleep(HOLD_SECONDS)
+            self.used[subnet["id"]] += 1
+        with self._stats:
+            self.waited += waited
+            self.claims[subnet["id"]] += 1
+
+
+def run(name):
+    segment = Segment()
+    selection = subnet_selection.get_selection(name)
+    most_full = name != subnet_selection.LeastFull.get_name()
+
+    def worker():
+        for _i in xrange(PORTS_PER_WORKER):
+            ordered = selection.order(segment.candidates(most_full),
+                                      net_id="net", segment_id="seg",
+                                      port_id=str(uuid.uuid4()))
+            segment.claim(ordered[0][0])
+
+    threads = [threading.Thread(target=worker) for _i in xrange(WORKERS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    allocations = WORKERS * PORTS_PER_WORKER
+    print("%-16s %7.1f ports/s  lock wait %7.2fms/port  subnets used %d" % (
+        name, allocations / elapsed, segment.waited / allocations * 1e3,
+        len(segment.claims)))
+
+
+def main():
+    for name in sorted(subnet_selection.SELECTIONS):
+        run(name)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,11 +14,13 @@
 # limitations under the License.
 
 import contextlib
+import datetime
 
 import mock
 import netaddr
 from neutron.common import rpc
 
+from quark import billing
 from quark.db import api as db_api
 import quark.ipam
 from quark.tests.functional.base import BaseFunctionalTest
@@ -247,6 +249,163 @@ class QuarkFindSubnetAllocationCount(QuarkIpamBaseFunctionalTest):
                 self.assertEqual(
                     netaddr.IPAddress(subnet["next_auto_assign_ip"]).ipv4(),
                     net4[1])
+                self.assertEqual(subnet["used_count"], 1)
+
+    def test_subnet_update_next_auto_assign_ip_conditional(self):
+        cidr4 = "0.0.0.0/30"  # 2 bits
+        net4 = netaddr.IPNetwork(cidr4)
+        with self._fixtures([
+            self._create_models(cidr4, 4, net4[0])
+        ]) as net:
+            subnet = db_api.subnet_find(self.context, network_id=net['id'],
+                                        scope=db_api.ALL)[0]
+            stale = dict(id=subnet["id"],
+                         next_auto_assign_ip=subnet["next_auto_assign_ip"])
+            with self.context.session.begin():
+                self.assertTrue(db_api.subnet_update_next_auto_assign_ip(
+                    self.context, stale, conditional=True))
+                # The pointer has moved since stale was read
+                self.assertFalse(db_api.subnet_update_next_auto_assign_ip(
+                    self.context, stale, conditional=True))
+                self.context.session.refresh(subnet)
+                self.assertEqual(
+                    netaddr.IPAddress(subnet["next_auto_assign_ip"]).ipv4(),
+                    net4[1])
+
+    def test_subnet_used_count_maintained(self):
+        cidr4 = "0.0.0.0/29"
+        net4 = netaddr.IPNetwork(cidr4)
+        with self._fixtures([
+            self._create_models(cidr4, 4, net4[0])
+        ]) as net:
+            self._create_ip_address("0.0.0.1", 4, cidr4, net["id"])
+            self._create_ip_address("0.0.0.2", 4, cidr4, net["id"])
+            subnet = db_api.subnet_find(self.context, network_id=net['id'],
+                                        scope=db_api.ONE)
+            self.assertEqual(subnet["used_count"], 2)
+
+            with self.context.session.begin():
+                # Leased addresses are counted by the lease, not when
+                # they're returned to the deallocated pool
+                leased = db_api.subnet_lease_next_auto_assign_ips(
+                    self.context, subnet, 3)
+                self.assertEqual(2, leased[1] - leased[0])
+                db_api.ip_address_create_deallocated_bulk(
+                    self.context, subnet, [net4.ipv6()[3].value])
+            self.context.session.refresh(subnet)
+            self.assertEqual(subnet["used_count"], 5)
+
+            with self.context.session.begin():
+                address = db_api.ip_address_find(
+                    self.context, subnet_id=subnet["id"],
+                    ip_address=netaddr.IPAddress("0.0.0.1"),
+                    scope=db_api.ONE)
+                db_api.ip_address_delete(self.context, address)
+            self.context.session.refresh(subnet)
+            self.assertEqual(subnet["used_count"], 4)
+
+            subnets = db_api.subnet_find_ordered_by_most_full(
+                self.context, net['id'], segment_id=None,
+                scope=db_api.ALL).all()
+            self.assertEqual(subnets[0][1], 4)
+
+    def test_ip_address_create_bulk(self):
+        cidr4 = "0.0.0.0/29"
+        net4 = netaddr.IPNetwork(cidr4)
+        with self._fixtures([
+            self._create_models(cidr4, 4, net4[0])
+        ]) as net:
+            self._create_ip_address("0.0.0.1", 4, cidr4, net["id"])
+            subnet = db_api.subnet_find(self.context, network_id=net['id'],
+                                        scope=db_api.ONE)
+            wanted = [net4.ipv6()[i].value for i in (1, 2, 3)]
+            with self.context.session.begin():
+                existing = db_api.ip_address_find_existing(
+                    self.context, subnet["id"], wanted)
+                self.assertEqual(existing, set([wanted[0]]))
+                created = db_api.ip_address_create_bulk(
+                    self.context, subnet, wanted[1:])
+            self.assertEqual(sorted(ip["address_readable"] for ip in created),
+                             ["0.0.0.2", "0.0.0.3"])
+            for ip in created:
+                self.assertFalse(ip["_deallocated"])
+                self.assertEqual(ip["used_by_tenant_id"],
+                                 self.context.tenant_id)
+            # The lease that reserved them counts bulk created addresses
+            self.context.session.refresh(subnet)
+            self.assertEqual(subnet["used_count"], 1)
+
+    def test_ip_address_deallocate_and_delete_all(self):
+        cidr4 = "0.0.0.0/29"
+        net4 = netaddr.IPNetwork(cidr4)
+        with self._fixtures([
+            self._create_models(cidr4, 4, net4[0])
+        ]) as net:
+            for i in xrange(1, 6):
+                self._create_ip_address("0.0.0.%d" % i, 4, cidr4, net["id"])
+            subnet = db_api.subnet_find(self.context, network_id=net['id'],
+                                        scope=db_api.ONE)
+            addresses = db_api.ip_address_find(self.context,
+                                               subnet_id=subnet["id"],
+                                               scope=db_api.ALL)
+            addresses.sort(key=lambda a: a["address_readable"])
+            with self.context.session.begin():
+                self.assertEqual(2, db_api.ip_address_deallocate_all(
+                    self.context, addresses[:2]))
+                self.assertEqual(2, db_api.ip_address_delete_all(
+                    self.context, addresses[2:4]))
+            for address in addresses[:2]:
+                self.assertTrue(address["_deallocated"])
+                self.assertIsNotNone(address["deallocated_at"])
+                self.assertIsNone(address["address_type"])
+
+            self.context.session.expunge_all()
+            remaining = db_api.ip_address_find(self.context,
+                                               subnet_id=subnet["id"],
+                                               scope=db_api.ALL)
+            self.assertEqual(
+                [("0.0.0.1", True), ("0.0.0.2", True), ("0.0.0.5", False)],
+                sorted((a["address_readable"], bool(a["_deallocated"]))
+                       for a in remaining))
+            subnet = db_api.subnet_find(self.context, network_id=net['id'],
+                                        scope=db_api.ONE)
+            self.assertEqual(subnet["used_count"], 3)
+
+    def test_deallocate_ip_addresses_bills_from_allocated_at(self):
+        cidr4 = "0.0.0.0/29"
+        net4 = netaddr.IPNetwork(cidr4)
+        with self._fixtures([
+            self._create_models(cidr4, 4, net4[0])
+        ]) as net:
+            self._create_ip_address("0.0.0.1", 4, cidr4, net["id"])
+            address = db_api.ip_address_find(self.context,
+                                             network_id=[net["id"]],
+                                             scope=db_api.ONE)
+            allocated_at = address["allocated_at"]
+            self.assertIsNotNone(allocated_at)
+            with contextlib.nested(
+                mock.patch("quark.billing._midnight_today"),
+                mock.patch("quark.billing.do_notify")
+            ) as (midnight, do_notify):
+                midnight.return_value = (allocated_at -
+                                         datetime.timedelta(hours=1))
+                with self.context.session.begin():
+                    self.ipam.deallocate_ip_addresses(self.context,
+                                                      [address])
+            self.assertEqual(allocated_at, address["allocated_at"])
+            usage = [c[0][2] for c in do_notify.call_args_list
+                     if c[0][1] == "ip.exists"]
+            self.assertEqual(1, len(usage))
+            self.assertEqual(
+                unicode(billing.convert_timestamp(allocated_at)),
+                usage[0]["startTime"])
+
+            self.context.session.expunge_all()
+            address = db_api.ip_address_find(self.context,
+                                             network_id=[net["id"]],
+                                             scope=db_api.ONE)
+            self.assertTrue(address["_deallocated"])
+            self.assertEqual(allocated_at, address["allocated_at"])
 
 
 class QuarkFindMacAddressRangeAllocationCount(QuarkIpamBaseFunctionalTest):
@@ -296,3 +455,64 @@ class QuarkFindMacAddressRangeAllocationCount(QuarkIpamBaseFunctionalTest):
                 ranges = db_api.mac_address_range_find_allocation_counts(
                     self.context, use_forbidden_mac_range=True)
                 self.assertTrue(ranges[0]["cidr"], mr1["cidr"])
+
+    def test_mac_address_range_allocated_count_maintained(self):
+        mr1_mac = netaddr.EUI("AA:AA:AA:00:00:00")
+        mr1 = {"cidr": "AA:AA:AA/24", "do_not_use": False,
+               "first_address": mr1_mac.value,
+               "last_address": netaddr.EUI("AA:AA:AA:FF:FF:FF").value,
+               "next_auto_assign_mac": mr1_mac.value}
+        with self._fixtures([mr1]):
+            rng = db_api.mac_address_range_find(self.context,
+                                                scope=db_api.ONE)
+            with self.context.session.begin():
+                mac = db_api.mac_address_create(
+                    self.context, address=mr1_mac.value + 10,
+                    mac_address_range_id=rng["id"])
+                # Auto assigned MACs are counted by the update that moves
+                # next_auto_assign_mac, not when their rows are created
+                db_api.mac_range_update_next_auto_assign_mac(
+                    self.context, rng, count=2)
+                db_api.mac_address_create_bulk(
+                    self.context, rng["id"],
+                    [mr1_mac.value, mr1_mac.value + 1])
+                db_api.mac_address_create_deallocated_bulk(
+                    self.context, rng["id"],
+                    [mr1_mac.value + 1, mr1_mac.value + 2])
+            with self.context.session.begin():
+                db_api.mac_address_delete(self.context, mac)
+
+            with self.context.session.begin():
+                found, count = \
+                    db_api.mac_address_range_find_allocation_counts(
+                        self.context)
+                self.assertEqual(found["id"], rng["id"])
+                self.assertEqual(2, count)
+
+    def test_mac_range_lease_next_auto_assign_macs(self):
+        mr1_mac = netaddr.EUI("AA:AA:AA:00:00:00")
+        mr1 = {"cidr": "AA:AA:AA/30", "do_not_use": False,
+               "first_address": mr1_mac.value,
+               "last_address": mr1_mac.value + 3,
+               "next_auto_assign_mac": mr1_mac.value}
+        with self._fixtures([mr1]):
+            rng = db_api.mac_address_range_find(self.context,
+                                                scope=db_api.ONE)
+            with self.context.session.begin():
+                leased = db_api.mac_range_lease_next_auto_assign_macs(
+                    self.context, rng, 3)
+            self.assertEqual((mr1_mac.value, mr1_mac.value + 2), leased)
+
+            # The range object is stale, so the conditional update misses
+            with self.context.session.begin():
+                self.assertIsNone(
+                    db_api.mac_range_lease_next_auto_assign_macs(
+                        self.context, rng, 3))
+
+            self.context.session.refresh(rng)
+            with self.context.session.begin():
+                leased = db_api.mac_range_lease_next_auto_assign_macs(
+                    self.context, rng, 3)
+            self.assertEqual((mr1_mac.value + 3, mr1_mac.value + 3), leased)
+            self.context.session.refresh(rng)
+            self.assertEqual(4, rng["allocated_count"])
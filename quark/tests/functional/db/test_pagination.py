@@ -14,11 +14,15 @@
 # limitations under the License.
 
 import contextlib
+import datetime
+import urlparse
 
 import mock
 import netaddr
+from neutron_lib import exceptions as n_exc
 
 from quark.db import api as db_api
+from quark.db import pagination
 import quark.ipam
 import quark.plugin
 import quark.plugin_modules.mac_address_ranges as macrng_api
@@ -43,6 +47,102 @@ class QuarkNetworksPaginationFunctionalTest(BaseFunctionalTest):
         self.assertNotEqual(len(res), networks_per_page)
 
 
+class QuarkKeysetPaginationFunctionalTest(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkKeysetPaginationFunctionalTest, self).setUp()
+        for name in ("d", "b", "a", "c", "b", "e"):
+            db_api.network_create(self.context, name=name, tenant_id="fake",
+                                  network_plugin="BASE")
+        self.context.session.flush()
+
+    def _page_through(self, sorts, limit, marker_fn):
+        seen = []
+        marker = None
+        while True:
+            page = network_api.get_networks(self.context, limit, sorts,
+                                            marker, False, None)
+            seen.extend(page)
+            if len(page) < limit:
+                return seen
+            marker = marker_fn(page[-1])
+
+    def test_cursor_pages_match_single_listing(self):
+        sorts = [("name", True), ("id", True)]
+        everything = network_api.get_networks(self.context, None, sorts,
+                                              None, False, None)
+        paged = self._page_through(
+            sorts, 2, lambda net: pagination.cursor_for(net, sorts))
+        self.assertEqual([n["id"] for n in everything],
+                         [n["id"] for n in paged])
+        self.assertEqual(6, len(paged))
+
+    def test_cursor_pages_descending(self):
+        sorts = [("name", False), ("id", False)]
+        paged = self._page_through(
+            sorts, 4, lambda net: pagination.cursor_for(net, sorts))
+        names = [n["name"] for n in paged]
+        self.assertEqual(["e", "d", "c", "b", "b", "a"], names)
+        self.assertEqual(6, len(set(n["id"] for n in paged)))
+
+    def test_id_marker(self):
+        sorts = [("id", True)]
+        paged = self._page_through(sorts, 4, lambda net: net["id"])
+        ids = [n["id"] for n in paged]
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(6, len(ids))
+
+    def test_marker_object_still_supported(self):
+        sorts = [("id", True)]
+        first = db_api.network_find(self.context, 3, sorts, None,
+                                    scope=db_api.ALL)
+        rest = db_api.network_find(self.context, 3, sorts, first[-1],
+                                   scope=db_api.ALL)
+        ids = [n["id"] for n in first + rest]
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(6, len(set(ids)))
+
+    def test_bad_cursor(self):
+        with self.assertRaises(n_exc.BadRequest):
+            network_api.get_networks(self.context, 2, [("id", True)],
+                                     pagination.CURSOR_PREFIX + "!!", False,
+                                     None)
+        with self.assertRaises(n_exc.BadRequest):
+            network_api.get_networks(self.context, 2, [("id", True)],
+                                     "not-a-network", False, None)
+
+    def test_cursor_pages_null_sort_keys(self):
+        for _i in xrange(3):
+            db_api.network_create(self.context, name=None, tenant_id="fake",
+                                  network_plugin="BASE")
+        self.context.session.flush()
+        for ascending in (True, False):
+            sorts = [("name", ascending), ("id", ascending)]
+            everything = network_api.get_networks(self.context, None, sorts,
+                                                  None, False, None)
+            paged = self._page_through(
+                sorts, 2, lambda net: pagination.cursor_for(net, sorts))
+            self.assertEqual([n["id"] for n in everything],
+                             [n["id"] for n in paged])
+            self.assertEqual(9, len(paged))
+
+    def test_next_link(self):
+        nets = network_api.get_networks(self.context, 2, [("id", True)],
+                                        None, False, None)
+        link = pagination.next_link("http://quark/v2.0/networks",
+                                    {"limit": 2}, nets, 2)
+        self.assertEqual("next", link["rel"])
+        query = urlparse.parse_qs(urlparse.urlparse(link["href"]).query)
+        self.assertEqual([pagination.cursor_for(nets[-1])], query["marker"])
+        self.assertEqual(["2"], query["limit"])
+        self.assertIsNone(pagination.next_link(
+            "http://quark/v2.0/networks", {"limit": 3}, nets, 3))
+
+    def test_cursor_round_trips_datetimes(self):
+        when = datetime.datetime(2016, 5, 4, 3, 2, 1, 12345)
+        cursor = pagination.encode_cursor([when, "id", 5])
+        self.assertEqual([when, "id", 5], pagination.decode_cursor(cursor))
+
+
 class QuarkSubnetsPaginationFunctionalTest(BaseFunctionalTest):
     @contextlib.contextmanager
     def _stubs(self, network, subnets):
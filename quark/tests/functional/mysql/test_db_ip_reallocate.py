@@ -1,9 +1,11 @@
 import datetime
 
 import netaddr
+from oslo_config import cfg
 from oslo_utils import timeutils
 
 from quark.db import api as db_api
+from quark.db import models
 from quark.plugin_modules import ip_policies
 from quark.tests.functional.mysql.base import MySqlBaseFunctionalTest
 
@@ -309,3 +311,83 @@ class QuarkIPReallocateFindTest(MySqlBaseFunctionalTest, IPReallocateMixin):
         self.assertIsNone(db_api.ip_address_find(self.context,
                                                  id=ip_address_db.id,
                                                  scope=db_api.ONE))
+
+
+class QuarkIPReallocateClaimTest(MySqlBaseFunctionalTest, IPReallocateMixin):
+    def _claim(self):
+        ip_kwargs = {
+            "network_id": self.network_db["id"],
+            "reuse_after": self.REUSE_AFTER,
+            "deallocated": True,
+            "version": 4,
+        }
+        # NOTE: SKIP LOCKED is only added on MySQL 8.0.1 and later, the
+        #       filtering is the same either way.
+        return db_api.ip_address_reallocate_claim(
+            self.context, {"_deallocated": False, "deallocated_at": None},
+            **ip_kwargs)
+
+    def test_normal_v4(self):
+        self.default_case()
+        claimed = self._claim()
+        self.assertEqual(claimed["address"], int(self.ip_address_v4.ipv6()))
+        self.assertFalse(claimed["_deallocated"])
+
+    def test_subnet_null(self):
+        self.network_db = self.insert_network()
+        self.insert_ip_address(netaddr.IPAddress("192.168.0.1"),
+                               self.network_db, None)
+        self.assertIsNone(self._claim())
+
+    def test_subnet_do_not_use(self):
+        self.network_db = self.insert_network()
+        self.subnet_v4_db = self.insert_subnet(
+            self.network_db, "192.168.0.0/24", do_not_use=True)
+        self.insert_ip_address(netaddr.IPAddress("192.168.0.1"),
+                               self.network_db, self.subnet_v4_db)
+        self.assertIsNone(self._claim())
+
+    def test_policy_violation_skipped(self):
+        self.network_db = self.insert_network()
+        self.subnet_v4_db = self.insert_subnet(
+            self.network_db, "192.168.0.0/24")
+        self.insert_ip_address(netaddr.IPAddress("192.168.0.0"),
+                               self.network_db, self.subnet_v4_db)
+        self.insert_default_ip_policy(self.subnet_v4_db)
+        self.assertIsNone(self._claim())
+
+        self.ip_address_v4 = netaddr.IPAddress("192.168.0.5")
+        self.insert_ip_address(self.ip_address_v4, self.network_db,
+                               self.subnet_v4_db)
+        claimed = self._claim()
+        self.assertEqual(claimed["address"], int(self.ip_address_v4.ipv6()))
+
+    def test_address_not_in_cidr(self):
+        self.network_db = self.insert_network()
+        self.subnet_v4_db = self.insert_subnet(
+            self.network_db, "192.168.0.0/24")
+        self.insert_ip_address(netaddr.IPAddress("192.168.1.1"),
+                               self.network_db, self.subnet_v4_db)
+        self.assertIsNone(self._claim())
+
+
+class QuarkIPReallocateClaimBinaryReadsTest(QuarkIPReallocateClaimTest):
+    READS = "binary"
+
+    def setUp(self):
+        super(QuarkIPReallocateClaimBinaryReadsTest, self).setUp()
+        cfg.CONF.set_override("inet_range_reads", self.READS, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "inet_range_reads",
+                        "QUARK")
+
+
+class QuarkIPReallocateClaimDualReadsTest(
+        QuarkIPReallocateClaimBinaryReadsTest):
+    READS = "dual"
+
+    def test_rows_without_binary_copies(self):
+        self.default_case()
+        self.context.session.query(models.IPAddress).update(
+            {"address_bin": None}, synchronize_session=False)
+        claimed = self._claim()
+        self.assertEqual(claimed["address"], int(self.ip_address_v4.ipv6()))
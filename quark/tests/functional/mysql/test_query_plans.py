@@ -0,0 +1,106 @@
+import datetime
+
+import netaddr
+from neutron.db import api as neutron_db_api
+from oslo_utils import timeutils
+from sqlalchemy import event
+
+from quark.db import api as db_api
+from quark import ip_availability
+from quark.tests.functional.mysql.base import MySqlBaseFunctionalTest
+from quark.tests.functional.mysql.test_db_ip_reallocate import (
+    IPReallocateMixin)
+
+
+class QuarkIPAddressQueryPlans(MySqlBaseFunctionalTest, IPReallocateMixin):
+    """Guards the indexes the hot IP address queries rely on.
+
+    Each test captures the statement a query really issues and asserts
+    that EXPLAIN reads quark_ip_addresses through the expected index.
+    """
+    NETWORKS = 4
+    ADDRESSES = 50
+
+    def setUp(self):
+        super(QuarkIPAddressQueryPlans, self).setUp()
+        self.engine = neutron_db_api.get_engine()
+        deallocated_at = timeutils.utcnow() - datetime.timedelta(
+            seconds=self.REUSE_AFTER)
+        self.networks = []
+        with self.context.session.begin():
+            for i in xrange(self.NETWORKS):
+                network = self.insert_network()
+                subnet = self.insert_subnet(network, "10.%d.0.0/24" % i)
+                for j in xrange(self.ADDRESSES):
+                    address = db_api.ip_address_create(
+                        self.context, subnet_id=subnet["id"],
+                        network_id=network["id"], version=4,
+                        address=netaddr.IPAddress("10.%d.0.%d" % (i, j + 1)))
+                    if j % 2:
+                        address["_deallocated"] = True
+                        address["deallocated_at"] = deallocated_at
+                self.networks.append((network, subnet))
+        self.engine.execute("ANALYZE TABLE quark_ip_addresses")
+
+    def _capture(self, func, *args, **kwargs):
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context,
+                    executemany):
+            if "quark_ip_addresses" in statement:
+                statements.append((statement, parameters))
+
+        event.listen(self.engine, "before_cursor_execute", capture)
+        try:
+            func(*args, **kwargs)
+        finally:
+            event.remove(self.engine, "before_cursor_execute", capture)
+        return statements[0]
+
+    def _index_used(self, statement, parameters):
+        plan = self.engine.execute("EXPLAIN " + statement, parameters)
+        for row in plan:
+            if row["table"] == "quark_ip_addresses":
+                return row["key"]
+
+    def _reallocate_kwargs(self, **kwargs):
+        network = self.networks[0][0]
+        ip_kwargs = {"network_id": network["id"],
+                     "deallocated": True,
+                     "version": 4,
+                     "lock_id": None,
+                     "reuse_after": self.REUSE_AFTER}
+        ip_kwargs.update(kwargs)
+        return ip_kwargs
+
+    def test_reallocate_uses_reallocation_index(self):
+        statement = self._capture(
+            db_api.ip_address_reallocate, self.context,
+            {"used_by_tenant_id": "reallocated"},
+            **self._reallocate_kwargs())
+        self.assertEqual("ix_quark_ip_addresses_reallocation",
+                         self._index_used(*statement))
+
+    def test_reallocate_in_subnets_uses_reallocation_index(self):
+        subnet = self.networks[0][1]
+        statement = self._capture(
+            db_api.ip_address_reallocate, self.context,
+            {"used_by_tenant_id": "reallocated"},
+            **self._reallocate_kwargs(subnet_id=[subnet["id"]]))
+        self.assertEqual("ix_quark_ip_addresses_reallocation",
+                         self._index_used(*statement))
+
+    def test_reallocate_claim_uses_reallocation_index(self):
+        with self.context.session.begin():
+            statement = self._capture(
+                db_api.ip_address_reallocate_claim, self.context,
+                {"used_by_tenant_id": "reallocated"}, skip_locked=False,
+                **self._reallocate_kwargs())
+        self.assertEqual("ix_quark_ip_addresses_reallocation",
+                         self._index_used(*statement))
+
+    def test_get_used_ips_uses_availability_index(self):
+        statement = self._capture(ip_availability.get_used_ips,
+                                  self.context.session)
+        self.assertEqual("ix_quark_ip_addresses_availability",
+                         self._index_used(*statement))
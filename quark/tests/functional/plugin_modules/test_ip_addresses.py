@@ -16,8 +16,11 @@
 import contextlib
 
 import netaddr
+from oslo_config import cfg
 
 from quark.db import api as db_api
+from quark.db import pagination
+from quark.plugin_modules import ip_addresses
 from quark.tests.functional.base import BaseFunctionalTest
 
 
@@ -71,3 +74,48 @@ class QuarkGetIPAddresses(BaseFunctionalTest):
                 ip_address=[netaddr.IPAddress("192.168.10.2")],
                 scope=db_api.ALL)
             self.assertEqual(len(ip_addresses), 0)
+
+
+class QuarkGetIPAddressesChunks(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkGetIPAddressesChunks, self).setUp()
+        self.context = self.context.elevated()
+        with self.context.session.begin():
+            subnet = db_api.subnet_create(self.context,
+                                          cidr="192.168.0.0/24")
+            for i in xrange(1, 8):
+                address = db_api.ip_address_create(
+                    self.context, subnet_id=subnet["id"], version=4,
+                    address=netaddr.IPAddress("192.168.0.%d" % i))
+                if i % 3 == 0:
+                    address["_deallocated"] = True
+        cfg.CONF.set_override("stream_chunk_size", 2, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "stream_chunk_size",
+                        "QUARK")
+
+    def test_chunks_match_listing(self):
+        listed = ip_addresses.get_ip_addresses(self.context)
+        chunks = list(ip_addresses.get_ip_addresses_chunks(self.context))
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in chunks])
+        streamed = [ip for chunk in chunks for ip in chunk]
+        self.assertEqual(sorted(listed, key=lambda ip: ip["id"]), streamed)
+
+    def test_paged_listing(self):
+        listed = ip_addresses.get_ip_addresses(self.context)
+        paged = []
+        marker = None
+        while True:
+            page = ip_addresses.get_ip_addresses(self.context, limit=2,
+                                                 marker=marker)
+            paged.extend(page)
+            if len(page) < 2:
+                break
+            marker = pagination.cursor_for(page[-1])
+        self.assertEqual(sorted(listed, key=lambda ip: ip["id"]), paged)
+
+    def test_chunks_filtered(self):
+        chunks = list(ip_addresses.get_ip_addresses_chunks(
+            self.context, address="192.168.0.1"))
+        self.assertEqual([["192.168.0.1"]],
+                         [[ip["address"] for ip in chunk]
+                          for chunk in chunks])
@@ -20,10 +20,14 @@ import netaddr
 from neutron.common import rpc
 from neutron_lib import exceptions as n_exc
 from oslo_config import cfg
+from sqlalchemy import event
 
 from quark.db import api as db_api
 import quark.ipam
+from quark import network_strategy
 import quark.plugin
+import quark.plugin_modules.networks as network_api
+from quark import provider_cache
 from quark.tests.functional.base import BaseFunctionalTest
 
 
@@ -105,3 +109,88 @@ class QuarkDeleteNetworKDeallocatedIPs(QuarkNetworkFunctionalTest):
                 self.plugin.delete_network(self.context, net_mod["id"])
             except Exception:
                 self.fail("delete network raised")
+
+
+class QuarkGetNetworksProjected(QuarkNetworkFunctionalTest):
+    def setUp(self):
+        super(QuarkGetNetworksProjected, self).setUp()
+        for name in ("a", "b", "c"):
+            db_api.network_create(self.context, name=name, tenant_id="fake",
+                                  network_plugin="BASE")
+        self.context.session.flush()
+        self.context.session.expunge_all()
+        cfg.CONF.set_override("project_listed_fields", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "project_listed_fields",
+                        "QUARK")
+
+    def test_projected_fields_match_full_listing(self):
+        fields = ["id", "name", "shared", "status"]
+        projected = network_api.get_networks(self.context, None,
+                                             [("name", True)], None, False,
+                                             None, fields)
+        self.assertEqual(0, len(self.context.session.identity_map))
+        cfg.CONF.set_override("project_listed_fields", False, "QUARK")
+        full = network_api.get_networks(self.context, None, [("name", True)],
+                                        None, False, None, fields)
+        self.assertEqual([dict((f, n[f]) for f in fields) for n in full],
+                         projected)
+        self.assertEqual(["a", "b", "c"], [n["name"] for n in projected])
+
+    def test_relationship_fields_load_models(self):
+        nets = network_api.get_networks(self.context, fields=["id",
+                                                              "subnets"])
+        self.assertEqual(3, len(self.context.session.identity_map))
+        self.assertEqual([[], [], []], [n["subnets"] for n in nets])
+
+
+class QuarkGetProviderNetworkCached(QuarkNetworkFunctionalTest):
+    def setUp(self):
+        super(QuarkGetProviderNetworkCached, self).setUp()
+        network_strategy.STRATEGY.load(
+            '{"public_network": {"bridge": "publicnet", '
+            '"subnets": {"4": "public_v4"}}}')
+        self.addCleanup(network_strategy.STRATEGY.load)
+        cfg.CONF.set_override("provider_cache_ttl", 60, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "provider_cache_ttl",
+                        "QUARK")
+        self.addCleanup(provider_cache.CACHE.clear)
+        db_api.network_create(self.context, id="public_network",
+                              name="public", tenant_id="provider",
+                              network_plugin="BASE")
+        self.context.session.flush()
+        self.context.session.expunge_all()
+
+    def _statements(self, func, *args, **kwargs):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context,
+                  executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", count)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            event.remove(self.engine, "before_cursor_execute", count)
+        return result, statements
+
+    def test_second_get_skips_the_database(self):
+        first, statements = self._statements(
+            network_api.get_network, self.context, "public_network")
+        self.assertNotEqual([], statements)
+        self.context.session.expunge_all()
+        second, statements = self._statements(
+            network_api.get_network, self.context, "public_network")
+        self.assertEqual([], statements)
+        self.assertEqual(first, second)
+        self.assertEqual(["public_v4"], second["subnets"])
+
+    def test_update_invalidates(self):
+        network_api.get_network(self.context, "public_network")
+        with self.context.session.begin():
+            net = db_api.network_find(self.context, id="public_network",
+                                      scope=db_api.ONE)
+            db_api.network_update(self.context, net, name="renamed")
+        self.context.session.expunge_all()
+        net = network_api.get_network(self.context, "public_network")
+        self.assertEqual("renamed", net["name"])
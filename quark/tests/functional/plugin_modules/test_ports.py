@@ -19,6 +19,8 @@ import netaddr
 import contextlib
 
 from neutron.common import exceptions as q_exc
+from oslo_config import cfg
+from sqlalchemy import event
 
 from quark.db import api as db_api
 import quark.plugin_modules.mac_address_ranges as macrng_api
@@ -564,3 +566,114 @@ class QuarkAdvancedServiceCreatePort(BaseFunctionalTest):
             # it will not be found
             self.assertRaises(q_exc.NetworkNotFound,
                               port_api.create_port, self.context, port_info)
+
+
+class QuarkListPortsQueryCount(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkListPortsQueryCount, self).setUp()
+        cidr = netaddr.IPNetwork("192.168.1.0/24")
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE")
+            subnet = db_api.subnet_create(self.context, network=net,
+                                          cidr=str(cidr), ip_version=4,
+                                          first_ip=cidr.first,
+                                          last_ip=cidr.last,
+                                          next_auto_assign_ip=cidr.first,
+                                          tenant_id="fake")
+            self.context.session.flush()
+            for i in xrange(5):
+                group = db_api.security_group_create(self.context,
+                                                     name="group%d" % i)
+                port = db_api.port_create(self.context, network_id=net.id,
+                                          backend_key=str(i),
+                                          device_id=str(i),
+                                          mac_address=0xAABBCC000000 + i,
+                                          security_groups=[group],
+                                          vlan_id=i + 1)
+                self.context.session.flush()
+                for j in xrange(2):
+                    ip = db_api.ip_address_create(
+                        self.context, subnet_id=subnet.id,
+                        network_id=net.id, version=4,
+                        address=netaddr.IPAddress(cidr.first + 10 * i + j))
+                    db_api.port_associate_ip(self.context, [port], ip,
+                                             enable_port=[port.id])
+        self.context.session.expunge_all()
+
+    def _count_queries(self, fn, *args):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute",
+                     before_cursor_execute)
+        try:
+            result = fn(*args)
+        finally:
+            event.remove(self.engine, "before_cursor_execute",
+                         before_cursor_execute)
+        self.context.session.expunge_all()
+        return result, len(statements)
+
+    def test_get_ports_query_count_independent_of_page_size(self):
+        counts = []
+        for limit in (1, 3, 5):
+            ports, count = self._count_queries(
+                port_api.get_ports, self.context, limit, [("id", "asc")])
+            self.assertEqual(limit, len(ports))
+            for port in ports:
+                self.assertEqual(1, len(port["security_groups"]))
+                self.assertEqual(2, len(port["fixed_ips"]))
+                self.assertIn("vlan_id", port)
+            counts.append(count)
+        self.assertEqual(1, len(set(counts)))
+
+    def test_get_port_loads_views_eagerly(self):
+        port_id = db_api.port_find(self.context, scope=db_api.ALL)[0].id
+        self.context.session.expunge_all()
+        single, single_count = self._count_queries(
+            port_api.get_port, self.context, port_id)
+        self.assertEqual(1, len(single["security_groups"]))
+        self.assertEqual(2, len(single["fixed_ips"]))
+        self.assertIn("vlan_id", single)
+        ports, list_count = self._count_queries(
+            port_api.get_ports, self.context, 5, [("id", "asc")])
+        self.assertEqual(list_count, single_count)
+
+    def test_projected_listing_selects_only_columns(self):
+        cfg.CONF.set_override("project_listed_fields", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "project_listed_fields",
+                        "QUARK")
+        fields = ["id", "device_id", "mac_address", "status"]
+        ports, count = self._count_queries(
+            port_api.get_ports, self.context, None, [("device_id", "asc")],
+            None, None, fields)
+        self.assertEqual(1, count)
+        self.assertEqual(["0", "1", "2", "3", "4"],
+                         [p["device_id"] for p in ports])
+        self.assertEqual(set(fields), set(ports[0]))
+        self.assertEqual("ACTIVE", ports[0]["status"])
+
+    def test_fast_port_views_match(self):
+        ports, count = self._count_queries(
+            port_api.get_ports, self.context, None, [("id", "asc")])
+        cfg.CONF.set_override("fast_port_views", True, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "fast_port_views", "QUARK")
+        fast, fast_count = self._count_queries(
+            port_api.get_ports, self.context, None, [("id", "asc")])
+        self.assertEqual(ports, fast)
+        self.assertEqual(count, fast_count)
+        self.assertIn("AA:BB:CC:00:00:04",
+                      [port["mac_address"] for port in fast])
+
+    def test_chunks_match_listing(self):
+        ports = port_api.get_ports(self.context, None, [("id", "asc")])
+        cfg.CONF.set_override("stream_chunk_size", 3, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "stream_chunk_size",
+                        "QUARK")
+        chunks = list(port_api.get_ports_chunks(self.context))
+        self.assertEqual([3, 2], [len(chunk) for chunk in chunks])
+        self.assertEqual(ports, [port for chunk in chunks for port in chunk])
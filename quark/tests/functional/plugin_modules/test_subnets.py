@@ -88,6 +88,37 @@ class QuarkGetSubnetsFromPlugin(BaseFunctionalTest):
         cfg.CONF.set_override('show_subnet_ip_policy_id', original, "QUARK")
 
 
+class QuarkGetSubnetsProjected(BaseFunctionalTest):
+    def test_projected_fields_match_full_listing(self):
+        network = dict(name="public", tenant_id="fake", network_plugin="BASE")
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, **network)
+            for i in xrange(3):
+                cidr = netaddr.IPNetwork("192.168.%d.0/24" % i)
+                db_api.subnet_create(self.context, network=net,
+                                     name="sub%d" % i, ip_version=4,
+                                     cidr=str(cidr), first_ip=cidr.first,
+                                     last_ip=cidr.last, ip_policy=None,
+                                     next_auto_assign_ip=cidr.first,
+                                     tenant_id="fake")
+        self.context.session.expunge_all()
+        fields = ["id", "name", "network_id", "cidr", "shared"]
+        sorts = [("name", True)]
+        full = subnet_api.get_subnets(self.context, sorts=sorts,
+                                      fields=fields)
+        self.context.session.expunge_all()
+        CONF.set_override("project_listed_fields", True, "QUARK")
+        self.addCleanup(CONF.clear_override, "project_listed_fields",
+                        "QUARK")
+        projected = subnet_api.get_subnets(self.context, sorts=sorts,
+                                           fields=fields)
+        self.assertEqual(0, len(self.context.session.identity_map))
+        self.assertEqual([dict((f, s[f]) for f in fields) for s in full],
+                         projected)
+        self.assertEqual(["sub0", "sub1", "sub2"],
+                         [s["name"] for s in projected])
+
+
 class QuarkCreateSubnets(BaseFunctionalTest):
     @contextlib.contextmanager
     def _stubs(self, network, subnet):
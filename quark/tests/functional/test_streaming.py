@@ -0,0 +1,130 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import tempfile
+
+import mock
+import netaddr
+from neutron.api.v2 import attributes
+from neutron.api.v2 import base
+from neutron import context
+from neutron import policy
+from oslo_config import cfg
+from oslo_policy import opts as policy_opts
+import webob
+
+from quark.api import streaming
+from quark.db import api as db_api
+import quark.plugin
+from quark.tests.functional.base import BaseFunctionalTest
+
+
+POLICY = {"context_is_admin": "role:admin",
+          "admin_or_owner": "rule:context_is_admin or "
+                            "tenant_id:%(tenant_id)s",
+          "default": "rule:admin_or_owner",
+          "get_port:device_owner": "!"}
+
+
+class QuarkStreamedPortsMatchCoreController(BaseFunctionalTest):
+    def setUp(self):
+        super(QuarkStreamedPortsMatchCoreController, self).setUp()
+        fd, policy_file = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(POLICY, f)
+        self.addCleanup(os.remove, policy_file)
+        policy_opts.set_defaults(cfg.CONF)
+        cfg.CONF.set_override("policy_file", policy_file, "oslo_policy")
+        self.addCleanup(cfg.CONF.clear_override, "policy_file",
+                        "oslo_policy")
+        policy.reset()
+        self.addCleanup(policy.reset)
+        cfg.CONF.set_override("stream_chunk_size", 2, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "stream_chunk_size",
+                        "QUARK")
+        patcher = mock.patch("neutron.common.rpc.get_notifier")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.plugin = quark.plugin.Plugin()
+        patcher = mock.patch("quark.api.streaming.manager.NeutronManager."
+                             "get_plugin", return_value=self.plugin)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        core = base.create_resource(
+            "ports", "port", self.plugin,
+            attributes.RESOURCE_ATTRIBUTE_MAP["ports"])
+        self.app = streaming.PortsStreamingMiddleware(core)
+
+        cidr = netaddr.IPNetwork("192.168.1.0/24")
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake",
+                                        network_plugin="BASE")
+            subnet = db_api.subnet_create(self.context, network=net,
+                                          cidr=str(cidr), ip_version=4,
+                                          first_ip=cidr.first,
+                                          last_ip=cidr.last,
+                                          next_auto_assign_ip=cidr.first,
+                                          tenant_id="fake")
+            self.context.session.flush()
+            for i in xrange(5):
+                port = db_api.port_create(self.context, network_id=net.id,
+                                          backend_key=str(i),
+                                          device_id=str(i),
+                                          mac_address=0xAABBCC000000 + i,
+                                          vlan_id=i + 1)
+                self.context.session.flush()
+                ip = db_api.ip_address_create(
+                    self.context, subnet_id=subnet.id, network_id=net.id,
+                    version=4, address=netaddr.IPAddress(cidr.first + i))
+                db_api.port_associate_ip(self.context, [port], ip,
+                                         enable_port=[port.id])
+        self.context.session.expunge_all()
+
+    def _list(self, path, stream):
+        cfg.CONF.set_override("stream_listings", stream, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "stream_listings", "QUARK")
+        request = webob.Request.blank(path)
+        request.environ["neutron.context"] = context.get_admin_context()
+        request.environ["wsgiorg.routing_args"] = (
+            None, {"action": "index", "format": "json"})
+        response = request.get_response(self.app)
+        self.assertEqual(200, response.status_int)
+        return (response,
+                sorted(json.loads(response.body)["ports"],
+                       key=lambda port: port["id"]))
+
+    def _assert_same_listing(self, path):
+        core, core_ports = self._list(path, False)
+        streamed, streamed_ports = self._list(path, True)
+        self.assertIsNotNone(core.content_length)
+        self.assertIsNone(streamed.content_length)
+        self.assertEqual(core_ports, streamed_ports)
+        return streamed_ports
+
+    def test_streamed_body_matches_core_controller(self):
+        ports = self._assert_same_listing("/v2.0/ports.json")
+        self.assertEqual(5, len(ports))
+        self.assertEqual(1, len(ports[0]["fixed_ips"]))
+        # Hidden by policy, and not a port attribute, respectively
+        self.assertNotIn("device_owner", ports[0])
+        self.assertNotIn("vlan_id", ports[0])
+
+    def test_streamed_filtered_body_matches_core_controller(self):
+        ports = self._assert_same_listing("/v2.0/ports.json?device_id=3")
+        self.assertEqual(["3"], [port["device_id"] for port in ports])
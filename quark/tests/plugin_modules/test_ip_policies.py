@@ -435,6 +435,19 @@ class TestQuarkUpdateIpPolicies(test_quark_plugin.TestQuarkPlugin):
                 subnet_ids=[100],
                 exclude=["::1/128", "::/128", "::ffff:ffff:ffff:ffff/128"])
 
+    def test_update_ip_policy_invalidates_cache(self):
+        subnets = [dict(id=100, cidr="0.0.0.0/16")]
+        ipp = dict(id=1, subnets=subnets,
+                   exclude=["0.0.0.0/24"],
+                   name="foo", tenant_id=1)
+        with self._stubs(ipp, subnets=subnets), mock.patch(
+                "quark.ip_policy_cache.CACHE.invalidate") as invalidate:
+            self.plugin.update_ip_policy(
+                self.context,
+                1,
+                dict(ip_policy=dict(exclude=["0.0.0.1/32"])))
+            invalidate.assert_called_once_with(1)
+
 
 class TestQuarkDeleteIpPolicies(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
@@ -467,6 +480,13 @@ class TestQuarkDeleteIpPolicies(test_quark_plugin.TestQuarkPlugin):
             self.assertEqual(ip_policy_find.call_count, 1)
             self.assertEqual(ip_policy_delete.call_count, 1)
 
+    def test_delete_ip_policy_invalidates_cache(self):
+        ip_policy = dict(id=1, networks=[], subnets=[])
+        with self._stubs(ip_policy), mock.patch(
+                "quark.ip_policy_cache.CACHE.invalidate") as invalidate:
+            self.plugin.delete_ip_policy(self.context, 1)
+            invalidate.assert_called_once_with(1)
+
 
 class TestQuarkUpdatePolicySubnetWithRoutes(test_quark_plugin.TestQuarkPlugin):
     @contextlib.contextmanager
@@ -0,0 +1,73 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+
+from quark import address_math
+from quark.tests import test_base
+
+
+class TestAddressMath(test_base.TestBase):
+    ADDRESSES = ["0.0.0.0", "10.0.0.1", "255.255.255.255", "::", "::1",
+                 "fe80::", "feed::a:0:0:1", "2001:db8::1:0:0:1",
+                 "::ffff:10.0.0.1", "ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff"]
+    CIDRS = ["0.0.0.0/0", "10.0.0.0/8", "192.168.1.17/24", "10.1.1.1/32",
+             "::/0", "fe80::/64", "feed::/104", "2001:db8::1/127",
+             "::ffff:10.0.0.0/120"]
+
+    def test_parse_ip(self):
+        for address in self.ADDRESSES:
+            ip = netaddr.IPAddress(address)
+            self.assertEqual((ip.value, ip.version),
+                             address_math.parse_ip(address))
+            self.assertEqual((ip.value, ip.version),
+                             address_math.parse_ip(ip))
+
+    def test_to_v6_and_back(self):
+        ip = netaddr.IPAddress("10.0.0.1")
+        mapped = address_math.to_v6(ip.value, 4)
+        self.assertEqual(ip.ipv6().value, mapped)
+        self.assertEqual(ip.value, address_math.to_native(mapped, 4))
+        self.assertEqual(mapped, address_math.to_native(mapped, 6))
+        self.assertTrue(address_math.is_v4_mapped(mapped))
+        self.assertFalse(address_math.is_v4_mapped(ip.value))
+
+    def test_format_ip(self):
+        for address in self.ADDRESSES:
+            ip = netaddr.IPAddress(address)
+            self.assertEqual(str(ip),
+                             address_math.format_ip(ip.value, ip.version))
+
+    def test_cidr_range(self):
+        for cidr in self.CIDRS:
+            net = netaddr.IPNetwork(cidr)
+            self.assertEqual((net.first, net.last, net.version),
+                             address_math.cidr_range(cidr))
+            self.assertEqual(net.value, address_math.cidr_value(cidr))
+            self.assertEqual(net.size, address_math.cidr_size(cidr))
+
+    def test_mac(self):
+        for mac in ["AA:BB:CC:DD:EE:FF", "aa-bb-cc-dd-ee-ff",
+                    "aabb.ccdd.eeff", netaddr.EUI("00:16:3e:00:00:01"),
+                    0x0123456789ab]:
+            eui = netaddr.EUI(mac)
+            value = address_math.mac_to_int(mac)
+            self.assertEqual(eui.value, value)
+            self.assertEqual(str(eui), address_math.format_mac(value))
+            self.assertEqual(eui.eui64().value, address_math.eui64(value))
+
+    def test_mac_invalid(self):
+        with self.assertRaises(netaddr.AddrFormatError):
+            address_math.mac_to_int("zz:bb:cc:dd:ee:ff")
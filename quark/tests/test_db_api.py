@@ -36,6 +36,41 @@ class TestDBAPI(BaseFunctionalTest):
         filter_fn = query_obj.options.return_value.filter
         self.assertEqual(filter_fn.call_count, 1)
 
+    def test_port_find_by_id_uses_baked_query(self):
+        net = db_api.network_create(self.context)
+        port = db_api.port_create(self.context, network_id=net["id"],
+                                  backend_key="", device_id="")
+        self.context.session.flush()
+
+        with mock.patch("quark.db.api._port_find_by_id",
+                        wraps=db_api._port_find_by_id) as baked_find:
+            found = db_api.port_find(self.context, id=port["id"],
+                                     scope=db_api.ONE)
+            self.assertEqual(port["id"], found["id"])
+            found = db_api.port_find(self.context, id=port["id"],
+                                     scope=db_api.ALL)
+            self.assertEqual([port["id"]], [p["id"] for p in found])
+            self.assertEqual(2, baked_find.call_count)
+
+            # Other filters still go through the regular query
+            db_api.port_find(self.context, id=port["id"],
+                             device_id=[""], scope=db_api.ONE)
+            self.assertEqual(2, baked_find.call_count)
+
+        self.context.tenant_id = "other"
+        self.assertIsNone(db_api.port_find(self.context, id=port["id"],
+                                           scope=db_api.ONE))
+
+    def test_model_filter_keys_memoized(self):
+        attrs = db_api._model_attrs(models.Subnet)
+        self.assertIs(attrs, db_api._model_attrs(models.Subnet))
+        self.assertIn("cidr", attrs)
+        allowed, eq_filters, in_filters = db_api._model_filter_keys(
+            models.SecurityGroupRule)
+        self.assertIn("direction", eq_filters)
+        self.assertNotIn("direction",
+                         db_api._model_filter_keys(models.Port)[1])
+
     def test_ip_address_find_device_id(self):
         query_mock = mock.Mock()
         filter_mock = mock.Mock()
@@ -304,3 +339,18 @@ class TestDBAPI(BaseFunctionalTest):
         port_req = {"id": 1, "network_id": "2", "vlan_id": 1}
         new_port = db_api.port_create(self.context, **port_req)
         self.assertEqual(new_port.tags, [tags.VlanTag().serialize(1)])
+
+    def test_supports_skip_locked(self):
+        dialect = mock.Mock()
+        self.context.session.get_bind = mock.Mock()
+        self.context.session.get_bind.return_value.dialect = dialect
+        for name, version, expected in (
+                ("sqlite", (3, 8, 0), False),
+                ("mysql", (5, 7, 21), False),
+                ("mysql", (8, 0, 0), False),
+                ("mysql", (8, 0, 1), True),
+                ("mysql", (10, 1, 26, "MariaDB"), False)):
+            dialect.name = name
+            dialect.server_version_info = version
+            self.assertEqual(expected,
+                             db_api._supports_skip_locked(self.context))
@@ -59,6 +59,38 @@ class TestDBCustomTypesINET(test_base.TestBase):
         self.assertEqual(bind, 1.0)
 
 
+class TestDBCustomTypesBinaryINET(test_base.TestBase):
+    def setUp(self):
+        super(TestDBCustomTypesBinaryINET, self).setUp()
+        self.inet = custom_types.BinaryINET()
+
+    def test_load_dialect_impl(self):
+        impl = self.inet.load_dialect_impl(mysql.dialect())
+        self.assertIsInstance(impl, mysql.BINARY)
+        self.assertEqual(16, impl.length)
+
+    def test_process_bind_param_none(self):
+        self.assertIsNone(self.inet.process_bind_param(None, None))
+        self.assertIsNone(self.inet.process_result_value(None, None))
+
+    def test_round_trip(self):
+        for value in (0, 1, 2 ** 64 - 1, 2 ** 64, 281473913978881,
+                      2 ** 128 - 1):
+            raw = self.inet.process_bind_param(value, mysql.dialect())
+            self.assertEqual(16, len(raw))
+            self.assertEqual(value,
+                             self.inet.process_result_value(raw, None))
+
+    def test_packing_keeps_order(self):
+        values = [0, 255, 2 ** 32, 2 ** 64 - 1, 2 ** 64, 2 ** 127, 5]
+        packed = sorted(custom_types.pack_inet(v) for v in values)
+        self.assertEqual(sorted(values),
+                         [custom_types.unpack_inet(p) for p in packed])
+
+    def test_compared_values_are_packed(self):
+        self.assertIs(self.inet, self.inet.coerce_compared_value("=", 5))
+
+
 class TestDBCustomTypesMACAddress(test_base.TestBase):
     """Adding for coverage of the mac address custom types."""
 
@@ -0,0 +1,117 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import netaddr
+
+from quark.db import models
+from quark import ip_policy_cache
+from quark.tests import test_base
+
+
+class TestCompiledIPPolicy(test_base.TestBase):
+    def _compile(self, cidrs):
+        policy = models.IPPolicy(exclude=[models.IPPolicyCIDR(cidr=c)
+                                          for c in cidrs])
+        return ip_policy_cache.CompiledIPPolicy(
+            policy.get_exclude_intervals())
+
+    def test_matches_ip_set(self):
+        cidrs = ["192.168.0.0/30", "192.168.0.4/32", "192.168.0.255/32",
+                 "192.168.0.128/26"]
+        compiled = self._compile(cidrs)
+        ip_set = netaddr.IPSet(cidrs)
+        for ip in netaddr.IPNetwork("192.168.0.0/24"):
+            self.assertEqual(ip in ip_set, ip in compiled)
+        self.assertEqual(ip_set.size, compiled.size)
+        # 0.0/30 and 0.4/32 are adjacent and get merged
+        self.assertEqual(3, len(compiled))
+
+    def test_membership_forms(self):
+        compiled = self._compile(["10.0.0.0/31"])
+        self.assertIn(netaddr.IPAddress("10.0.0.1"), compiled)
+        self.assertIn(netaddr.IPAddress("10.0.0.1").ipv6(), compiled)
+        self.assertIn("10.0.0.0", compiled)
+        self.assertIn(netaddr.IPAddress("10.0.0.0").ipv6().value, compiled)
+        self.assertNotIn(netaddr.IPAddress("10.0.0.2"), compiled)
+
+    def test_v6(self):
+        compiled = self._compile(["fe80::/127", "fe80::ffff/128"])
+        self.assertIn(netaddr.IPAddress("fe80::1"), compiled)
+        self.assertNotIn(netaddr.IPAddress("fe80::2"), compiled)
+        self.assertIn(netaddr.IPAddress("fe80::ffff"), compiled)
+
+    def test_next_allowed(self):
+        compiled = self._compile(["10.0.0.0/30", "10.0.0.4/32"])
+        first = netaddr.IPAddress("10.0.0.0").ipv6().value
+        self.assertEqual(first + 5, compiled.next_allowed(first))
+        self.assertEqual(first + 5, compiled.next_allowed(first + 4))
+        self.assertEqual(first + 6, compiled.next_allowed(first + 6))
+
+    def test_empty(self):
+        self.assertFalse(ip_policy_cache.EMPTY_POLICY)
+        self.assertNotIn(netaddr.IPAddress("10.0.0.1"),
+                         ip_policy_cache.EMPTY_POLICY)
+
+
+class TestIPPolicyCache(test_base.TestBase):
+    def setUp(self):
+        super(TestIPPolicyCache, self).setUp()
+        self.cache = ip_policy_cache.IPPolicyCache(max_size=2)
+
+    def test_get_compiles_once_per_revision(self):
+        compile_fn = mock.Mock(side_effect=lambda: object())
+        first = self.cache.get("1", 0, compile_fn)
+        self.assertIs(first, self.cache.get("1", 0, compile_fn))
+        self.assertEqual(1, compile_fn.call_count)
+        self.assertIsNot(first, self.cache.get("1", 1, compile_fn))
+        self.assertEqual(2, compile_fn.call_count)
+
+    def test_lru_eviction(self):
+        compile_fn = mock.Mock(side_effect=lambda: object())
+        self.cache.get("1", 0, compile_fn)
+        self.cache.get("2", 0, compile_fn)
+        # Touch 1 so 2 is the least recently used
+        self.cache.get("1", 0, compile_fn)
+        self.cache.get("3", 0, compile_fn)
+        self.assertEqual(2, len(self.cache))
+        self.cache.get("1", 0, compile_fn)
+        self.assertEqual(3, compile_fn.call_count)
+        self.cache.get("2", 0, compile_fn)
+        self.assertEqual(4, compile_fn.call_count)
+
+    def test_invalidate(self):
+        compile_fn = mock.Mock(side_effect=lambda: object())
+        self.cache.get("1", 0, compile_fn)
+        self.cache.get("2", 0, compile_fn)
+        self.cache.invalidate("1")
+        self.assertEqual(1, len(self.cache))
+        self.cache.get("1", 0, compile_fn)
+        self.assertEqual(3, compile_fn.call_count)
+
+    def test_unsaved_policy_not_cached(self):
+        compile_fn = mock.Mock(side_effect=lambda: object())
+        self.cache.get(None, None, compile_fn)
+        self.cache.get(None, None, compile_fn)
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(2, compile_fn.call_count)
+
+    def test_disabled(self):
+        cache = ip_policy_cache.IPPolicyCache(max_size=0)
+        compile_fn = mock.Mock(side_effect=lambda: object())
+        cache.get("1", 0, compile_fn)
+        cache.get("1", 0, compile_fn)
+        self.assertEqual(0, len(cache))
+        self.assertEqual(2, compile_fn.call_count)
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import contextlib
+import itertools
 import json
 import time
 
@@ -139,7 +140,7 @@ class QuarkMacAddressAllocateDeallocated(QuarkIpamBaseTest):
                 if mar["next_auto_assign_mac"] >= 0:
                     mar["next_auto_assign_mac"] += 1
 
-            def set_full_mock(context, mar):
+            def set_full_mock(context, mar, allocated=0):
                 mar["next_auto_assign_mac"] = -1
                 return 1
 
@@ -177,8 +178,10 @@ class QuarkNewMacAddressAllocation(QuarkIpamBaseTest):
                        "mac_address_range_find_allocation_counts"),
             mock.patch("quark.db.api.mac_range_update_next_auto_assign_mac"),
             mock.patch("quark.db.api.mac_range_update_set_full"),
+            mock.patch("quark.db.api.mac_range_update_allocated_count"),
             mock.patch("sqlalchemy.orm.session.Session.refresh")
-        ) as (mac_find, mac_range_count, mac_auto, mac_set_full, refresh):
+        ) as (mac_find, mac_range_count, mac_auto, mac_set_full, alloc_count,
+              refresh):
             address_mod = [mac_helper(a) for a in addresses]
             range_mod = (range_helper(ranges[0]), ranges[1])
             mac_find.side_effect = address_mod
@@ -188,7 +191,7 @@ class QuarkNewMacAddressAllocation(QuarkIpamBaseTest):
                 if mar["next_auto_assign_mac"] >= 0:
                     mar["next_auto_assign_mac"] += 1
 
-            def set_full_mock(context, mar):
+            def set_full_mock(context, mar, allocated=0):
                 mar["next_auto_assign_mac"] = -1
                 return 1
 
@@ -256,6 +259,90 @@ class QuarkNewMacAddressAllocation(QuarkIpamBaseTest):
             self.assertEqual(mr[0]["next_auto_assign_mac"], -1)
 
 
+class QuarkNewMacAddressLeasing(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkNewMacAddressLeasing, self).setUp()
+        self.leases = quark.ipam.LeaseRegistry()
+        patcher = mock.patch("quark.ipam.MAC_LEASES", self.leases)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cfg.CONF.set_override("mac_address_lease_block_size", 4, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override,
+                        "mac_address_lease_block_size", "QUARK")
+
+    @contextlib.contextmanager
+    def _stubs(self, mac_range, leased):
+        with contextlib.nested(
+            mock.patch("quark.db.api.mac_address_reallocate"),
+            mock.patch("quark.db.api."
+                       "mac_address_range_find_allocation_counts"),
+            mock.patch("quark.db.api.mac_range_lease_next_auto_assign_macs"),
+            mock.patch("quark.db.api.mac_range_update_next_auto_assign_mac"),
+            mock.patch("quark.db.api.mac_range_update_set_full"),
+            mock.patch("quark.db.api.mac_address_create"),
+            mock.patch("sqlalchemy.orm.session.Session.refresh")
+        ) as (realloc, range_find, range_lease, range_incr, set_full,
+              mac_create, refresh):
+            realloc.return_value = False
+            range_find.return_value = (range_helper(mac_range), 0)
+            range_lease.return_value = leased
+            mac_create.side_effect = lambda ctx, **kw: models.MacAddress(
+                address=kw["address"],
+                mac_address_range_id=kw["mac_address_range_id"])
+            yield range_find, range_lease, range_incr, set_full, mac_create
+
+    def _mac_range(self, **kwargs):
+        mar = dict(id=1, cidr="AA:BB:CC/24", first_address=0,
+                   last_address=255, next_auto_assign_mac=10,
+                   do_not_use=False)
+        mar.update(kwargs)
+        return mar
+
+    def test_allocate_leases_block_and_serves_from_it(self):
+        with self._stubs(self._mac_range(), (10, 13)) as (
+                range_find, range_lease, range_incr, set_full, mac_create):
+            macs = [self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+                    for _i in xrange(4)]
+            self.assertEqual([10, 11, 12, 13], [m["address"] for m in macs])
+            # The lease counted the whole block
+            for call in mac_create.call_args_list:
+                self.assertFalse(call[1]["count_allocated"])
+            self.assertEqual(1, range_find.call_count)
+            self.assertEqual(4, range_lease.call_args[0][2])
+            self.assertFalse(range_incr.called)
+            self.assertFalse(set_full.called)
+            self.assertIsNone(self.leases.find(False))
+
+    def test_lease_reaching_end_of_range_sets_full(self):
+        with self._stubs(self._mac_range(next_auto_assign_mac=254),
+                         (254, 255)) as (range_find, range_lease, range_incr,
+                                         set_full, mac_create):
+            mac = self.ipam.allocate_mac_address(self.context, 0, 0, 0)
+            self.assertEqual(254, mac["address"])
+            self.assertTrue(set_full.called)
+            self.assertEqual(1, self.leases.find(False))
+
+    def test_explicit_mac_does_not_lease(self):
+        with self._stubs(self._mac_range(), (10, 13)) as (
+                range_find, range_lease, range_incr, set_full, mac_create):
+            mac = self.ipam.allocate_mac_address(self.context, 0, 0, 0,
+                                                 mac_address=200)
+            self.assertEqual(200, mac["address"])
+            self.assertFalse(range_lease.called)
+            self.assertTrue(mac_create.call_args[1]["count_allocated"])
+            self.assertEqual(0, len(self.leases))
+
+    def test_release_mac_leases_returns_unused(self):
+        lease = quark.ipam.MacAddressLease(1, False, 10, 13)
+        self.leases.add(lease)
+        self.leases.take(1)
+        with mock.patch("quark.db.api."
+                        "mac_address_create_deallocated_bulk") as create:
+            quark.ipam.release_mac_leases(self.context, expired_only=False)
+            create.assert_called_once_with(self.context, 1, [11, 12, 13])
+        self.assertEqual(0, len(self.leases))
+
+
 class QuarkNewMacAddressAllocationCreateConflict(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, addresses=None, ranges=None):
@@ -357,6 +444,15 @@ class QuarkMacAddressDeallocation(QuarkIpamBaseTest):
 
 
 class QuarkIPAddressDeallocation(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIPAddressDeallocation, self).setUp()
+        patcher = mock.patch("quark.db.api.ip_address_deallocate_all")
+        self.dealloc_all = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("quark.db.api.ip_address_delete_all")
+        self.delete_all = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_deallocate_ips_by_port(self):
         port_dict = dict(ip_addresses=[], device_id="foo")
         addr_dict = dict(subnet_id=1, address_readable=None,
@@ -374,8 +470,8 @@ class QuarkIPAddressDeallocation(QuarkIpamBaseTest):
         # ORM takes care of other model if one model is modified
         self.assertTrue(len(addr["ports"]) == 0 or
                         len(port["ip_addresses"]) == 0)
-        self.assertTrue(addr["deallocated"])
-        self.assertEqual(addr["address_type"], None)
+        self.dealloc_all.assert_called_once_with(self.context, [addr])
+        self.assertFalse(self.delete_all.called)
 
     def test_deallocate_ip_address_specific_ip(self):
         port_dict = dict(ip_addresses=[], device_id="foo")
@@ -396,8 +492,7 @@ class QuarkIPAddressDeallocation(QuarkIpamBaseTest):
         # ORM takes care of other model if one model is modified
         self.assertTrue(len(addr["ports"]) == 0 or
                         len(port["ip_addresses"]) == 0)
-        self.assertTrue(addr["deallocated"])
-        self.assertEqual(addr["address_type"], None)
+        self.dealloc_all.assert_called_once_with(self.context, [addr])
 
     def test_deallocate_ip_address_specific_ip_not_on_port_noop(self):
         port_dict = dict(ip_addresses=[], device_id="foo")
@@ -420,6 +515,7 @@ class QuarkIPAddressDeallocation(QuarkIpamBaseTest):
                         len(port["ip_addresses"]) == 1)
         self.assertFalse(addr["deallocated"])
         self.assertEqual(addr["address_type"], None)
+        self.assertFalse(self.dealloc_all.called)
 
     def test_deallocate_ip_address_multiple_ports_no_deallocation(self):
         port_dict = dict(ip_addresses=[])
@@ -441,8 +537,7 @@ class QuarkIPAddressDeallocation(QuarkIpamBaseTest):
         self.assertFalse(addr["deallocated"])
         self.assertEqual(addr["address_type"], None)
 
-    @mock.patch("quark.db.api.ip_address_delete")
-    def test_deallocate_v6_ips_by_port(self, ip_delete):
+    def test_deallocate_v6_ips_by_port(self):
         ip = netaddr.IPAddress("fe80::1")
         port_dict = dict(ip_addresses=[], device_id="foo")
         addr_dict = dict(subnet_id=1, address_readable=ip.value,
@@ -459,9 +554,33 @@ class QuarkIPAddressDeallocation(QuarkIpamBaseTest):
         self.ipam.deallocate_ips_by_port(self.context, port)
         self.assertTrue(len(addr["ports"]) == 0 or
                         len(port["ip_addresses"]) == 0)
-        ip_delete.assert_called_once_with(self.context, addr)
+        self.delete_all.assert_called_once_with(self.context, [addr])
+        self.assertFalse(self.dealloc_all.called)
         self.assertEqual(addr["address_type"], None)
 
+    def test_deallocate_many_ips_in_bulk(self):
+        port = models.Port()
+        port.update(dict(ip_addresses=[], device_id="foo"))
+        addrs = []
+        for i, version in enumerate((4, 6, 4, 6)):
+            addr = models.IPAddress()
+            addr.update(dict(subnet_id=1, address_readable=str(i),
+                             used_by_tenant_id=1, version=version,
+                             address=i))
+            addrs.append(addr)
+            port["ip_addresses"].append(addr)
+        with mock.patch("quark.ipam.notify") as notify:
+            self.ipam.deallocate_ips_by_port(self.context, port)
+        self.assertEqual([], port["ip_addresses"])
+        v4 = self.dealloc_all.call_args[0][1]
+        v6 = self.delete_all.call_args[0][1]
+        self.assertEqual(set([addrs[0], addrs[2]]), set(v4))
+        self.assertEqual(set([addrs[1], addrs[3]]), set(v6))
+        self.assertEqual(4, notify.call_count)
+        for addr in addrs:
+            notify.assert_any_call(self.context, 'ip.delete', addr,
+                                   send_usage=True)
+
 
 class QuarkIpamTestBothIpAllocation(QuarkIpamBaseTest):
     def setUp(self):
@@ -1127,7 +1246,7 @@ class QuarkIpamAllocateFromV6Subnet(QuarkIpamBaseTest):
             ip_mod["version"] = ip_address.version
 
         with contextlib.nested(
-            mock.patch("quark.db.models.IPPolicy.get_cidrs_ip_set"),
+            mock.patch("quark.db.models.IPPolicy.get_compiled_set"),
             mock.patch("quark.db.api.ip_address_find"),
             mock.patch("quark.db.api.ip_address_create"),
             mock.patch("quark.db.api.ip_address_update")
@@ -1185,6 +1304,88 @@ class QuarkIpamAllocateFromV6Subnet(QuarkIpamBaseTest):
             self.assertEqual(a['address'], ip_address.value)
 
 
+class QuarkIpamAllocateProbedV6(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamAllocateProbedV6, self).setUp()
+        cfg.CONF.set_override('v6_allocation_probe_batch', 4, 'QUARK')
+        cfg.CONF.set_override('v6_allocation_attempts', 8, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'v6_allocation_probe_batch', 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'v6_allocation_attempts', 'QUARK')
+        self.port_id = "945af340-ed34-4fec-8c87-853a2df492b4"
+        self.subnet6 = models.Subnet(id=1, first_ip=0, last_ip=0,
+                                     cidr="feed::/104", ip_version=6,
+                                     next_auto_assign_ip=0, ip_policy=None)
+        self.mac = models.MacAddress()
+        self.mac["address"] = netaddr.EUI("AA:BB:CC:DD:EE:FF").value
+
+    @contextlib.contextmanager
+    def _stubs(self, existing=None, create_effects=None):
+        self.context.session.add = mock.Mock()
+        with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_find_existing"),
+            mock.patch("quark.db.api.ip_address_create"),
+            mock.patch("quark.ipam.notify")
+        ) as (find_existing, ip_create, notify):
+            existing = existing or set()
+            find_existing.side_effect = (
+                lambda context, subnet_id, addresses:
+                    set(a for a in addresses if a in existing))
+            if create_effects:
+                ip_create.side_effect = create_effects
+            else:
+                ip_create.side_effect = (
+                    lambda context, **kwargs: dict(
+                        address=kwargs["address"].value))
+            yield find_existing, ip_create, notify
+
+    def _candidates(self, count):
+        return list(itertools.islice(
+            quark.ipam.generate_v6(self.mac["address"], self.port_id,
+                                   self.subnet6["cidr"]), count))
+
+    def test_skips_existing_candidates_with_one_probe(self):
+        candidates = self._candidates(4)
+        with self._stubs(existing=set(candidates[:2])) as (
+                find_existing, ip_create, notify):
+            a = self.ipam._allocate_from_v6_subnet(
+                self.context, 0, self.subnet6, self.port_id,
+                self.reuse_after, mac_address=self.mac)
+            self.assertEqual(candidates[2], a["address"])
+            self.assertEqual(1, find_existing.call_count)
+            self.assertEqual(1, ip_create.call_count)
+            self.assertEqual(1, notify.call_count)
+
+    def test_duplicate_entry_moves_to_next_candidate(self):
+        candidates = self._candidates(2)
+
+        def create(context, **kwargs):
+            if kwargs["address"].value == candidates[0]:
+                raise db_exc.DBDuplicateEntry()
+            return dict(address=kwargs["address"].value)
+
+        with self._stubs(create_effects=create) as (
+                find_existing, ip_create, notify):
+            a = self.ipam._allocate_from_v6_subnet(
+                self.context, 0, self.subnet6, self.port_id,
+                self.reuse_after, mac_address=self.mac)
+            self.assertEqual(candidates[1], a["address"])
+            self.assertEqual(1, find_existing.call_count)
+            self.assertEqual(2, ip_create.call_count)
+
+    def test_all_candidates_taken_fails(self):
+        candidates = self._candidates(8)
+        with self._stubs(existing=set(candidates)) as (
+                find_existing, ip_create, notify):
+            with self.assertRaises(n_exc.IpAddressGenerationFailure):
+                self.ipam._allocate_from_v6_subnet(
+                    self.context, 0, self.subnet6, self.port_id,
+                    self.reuse_after, mac_address=self.mac)
+            self.assertEqual(2, find_existing.call_count)
+            self.assertEqual(0, ip_create.call_count)
+
+
 class QuarkNewIPAddressAllocation(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, addresses=None, subnets=None):
@@ -1628,6 +1829,63 @@ class QuarkIPAddressAllocationTestRetries(QuarkIpamBaseTest):
             self.assertEqual(addr[0]["address"], 1)
 
 
+class QuarkIpamAllocateFromSubnetUsedCount(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, create_raises=None):
+        with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_create"),
+            mock.patch("quark.db.api.subnet_update_used_count")
+        ) as (ip_create, used_count):
+            ip_create.side_effect = create_raises
+            yield ip_create, used_count
+
+    def _subnet(self, **kwargs):
+        subnet = dict(id=1, first_ip=0, last_ip=255, cidr="0.0.0.0/24",
+                      ip_version=4, next_auto_assign_ip=3, ip_policy=None,
+                      network_id=1, do_not_use=False)
+        subnet.update(kwargs)
+        return subnet_helper(subnet)
+
+    def _allocate(self, subnet, ip_address=None):
+        return self.ipam._allocate_from_subnet(self.context, 1, subnet, None,
+                                               0, ip_address=ip_address)
+
+    def test_allocated_keeps_count(self):
+        with self._stubs() as (ip_create, used_count):
+            self._allocate(self._subnet())
+            self.assertFalse(ip_create.call_args[1]["count_used"])
+            self.assertFalse(used_count.called)
+
+    def test_duplicate_gives_back_count(self):
+        with self._stubs(db_exc.DBDuplicateEntry) as (ip_create, used_count):
+            with self.assertRaises(n_exc.IpAddressInUse):
+                self._allocate(self._subnet())
+            used_count.assert_called_once_with(self.context, 1, -1)
+
+    def test_db_error_gives_back_count(self):
+        with self._stubs(db_exc.DBError) as (ip_create, used_count):
+            with self.assertRaises(q_exc.IPAddressRetryableFailure):
+                self._allocate(self._subnet())
+            used_count.assert_called_once_with(self.context, 1, -1)
+
+    def test_policy_retry_gives_back_count(self):
+        subnet = self._subnet(ip_policy=dict(exclude=[
+            models.IPPolicyCIDR(cidr="0.0.0.2/32")]))
+        with self._stubs() as (ip_create, used_count):
+            with self.assertRaises(q_exc.IPAddressPolicyRetryableFailure):
+                self._allocate(subnet)
+            self.assertFalse(ip_create.called)
+            used_count.assert_called_once_with(self.context, 1, -1)
+
+    def test_explicit_ip_duplicate_was_never_counted(self):
+        with self._stubs(db_exc.DBDuplicateEntry) as (ip_create, used_count):
+            with self.assertRaises(n_exc.IpAddressInUse):
+                self._allocate(self._subnet(),
+                               ip_address=netaddr.IPAddress("0.0.0.9"))
+            self.assertTrue(ip_create.call_args[1]["count_used"])
+            self.assertFalse(used_count.called)
+
+
 class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, ip_find, subnet, address, addresses_found,
@@ -1694,6 +1952,202 @@ class QuarkIPAddressAllocateDeallocated(QuarkIpamBaseTest):
             self.assertTrue(choose_subnet.called)
 
 
+class QuarkIpamAllocateBulk(QuarkIpamBaseTest):
+    @contextlib.contextmanager
+    def _stubs(self, subnet, mac_range, existing_ips=None):
+        with contextlib.nested(
+            mock.patch("quark.db.api."
+                       "mac_address_range_find_allocation_counts"),
+            mock.patch("quark.db.api.mac_address_find_existing"),
+            mock.patch("quark.db.api.mac_range_update_next_auto_assign_mac"),
+            mock.patch("quark.db.api.mac_address_create_bulk"),
+            mock.patch("quark.db.api.subnet_find_ordered_by_most_full"),
+            mock.patch("quark.db.api.ip_address_find_existing"),
+            mock.patch("quark.db.api.subnet_lease_next_auto_assign_ips"),
+            mock.patch("quark.db.api.ip_address_create_bulk"),
+            mock.patch("quark.ipam.notify"),
+        ) as (range_find, mac_existing, mac_incr, mac_create, subnet_find,
+              ip_existing, subnet_lease, ip_create, notify):
+            range_mod = range_helper(mac_range)
+            range_find.return_value = (range_mod, 0)
+            mac_existing.return_value = set()
+            mac_create.side_effect = lambda ctx, rng_id, addrs: [
+                models.MacAddress(address=a) for a in addrs]
+            sub_mod = subnet_helper(subnet)
+            subnet_find.return_value = [(sub_mod, 0)]
+            ip_existing.return_value = set(existing_ips or [])
+            subnet_lease.return_value = (0, 0)
+            ip_create.side_effect = lambda ctx, sub, addrs, **kw: [
+                models.IPAddress(address=a, version=4) for a in addrs]
+            yield mac_incr, mac_create, subnet_lease, ip_create, notify
+
+    def _subnet(self):
+        net = netaddr.IPNetwork("0.0.0.0/24").ipv6()
+        return dict(id=1, first_ip=net.first, last_ip=net.last,
+                    cidr="0.0.0.0/24", ip_version=4,
+                    next_auto_assign_ip=net.first + 1, ip_policy=None,
+                    network_id=1)
+
+    def _mac_range(self):
+        return dict(id=1, cidr="AA:BB:CC/24", first_address=0,
+                    last_address=0xFFFFFF, next_auto_assign_mac=10)
+
+    def test_allocate_bulk_single_lock(self):
+        subnet = self._subnet()
+        first = subnet["next_auto_assign_ip"]
+        with self._stubs(subnet, self._mac_range(),
+                         existing_ips=[first + 1]) as (
+                mac_incr, mac_create, subnet_lease, ip_create, notify):
+            results = self.ipam.allocate_bulk(
+                self.context, [("p1", 1, None), ("p2", 1, None)],
+                self.reuse_after)
+
+            self.assertEqual(1, mac_create.call_count)
+            self.assertEqual([10, 11], mac_create.call_args[0][2])
+            self.assertEqual(2, mac_incr.call_args[1]["count"])
+            self.assertEqual(2, mac_incr.call_args[1]["allocated"])
+
+            self.assertEqual(1, ip_create.call_count)
+            self.assertEqual([first, first + 2], ip_create.call_args[0][2])
+            self.assertEqual(3, subnet_lease.call_args[0][2])
+
+            self.assertEqual(["p1", "p2"], [r["port_id"] for r in results])
+            for result in results:
+                self.assertIsNone(result["error"])
+                self.assertIsNotNone(result["mac_address"])
+                self.assertEqual(1, len(result["ip_addresses"]))
+            self.assertEqual(2, notify.call_count)
+
+    def test_allocate_bulk_uses_subnet_selection(self):
+        with contextlib.nested(
+            self._stubs(self._subnet(), self._mac_range()),
+            mock.patch.object(self.ipam.subnet_selection, "find"),
+        ) as ((mac_incr, mac_create, subnet_lease, ip_create, notify),
+              find):
+            find.return_value = [(subnet_helper(self._subnet()), 0)]
+            cfg.CONF.set_override("ipam_optimistic_subnet_selection", True,
+                                  "QUARK")
+            self.addCleanup(cfg.CONF.clear_override,
+                            "ipam_optimistic_subnet_selection", "QUARK")
+            self.ipam.allocate_bulk(self.context, [("p1", 1, None)],
+                                    self.reuse_after)
+            self.assertEqual(1, find.call_count)
+            self.assertFalse(find.call_args[1]["lock_subnets"])
+            self.assertEqual(4, find.call_args[1]["ip_version"])
+            self.assertEqual(1, ip_create.call_count)
+
+    def test_allocate_bulk_full_mac_range(self):
+        with contextlib.nested(
+            self._stubs(self._subnet(), self._mac_range()),
+            mock.patch("quark.db.api.mac_range_update_set_full"),
+            mock.patch("quark.db.api."
+                       "mac_address_range_find_allocation_counts"),
+            mock.patch.object(self.ipam, "allocate_mac_address"),
+        ) as ((mac_incr, mac_create, subnet_lease, ip_create, notify),
+              set_full, range_find, alloc_mac):
+            rng = self._mac_range()
+            range_find.return_value = (range_helper(rng),
+                                       rng["last_address"] + 1)
+            results = self.ipam.allocate_bulk(
+                self.context, [("p1", 1, None)], self.reuse_after)
+            self.assertTrue(set_full.called)
+            self.assertFalse(mac_create.called)
+            self.assertEqual(1, alloc_mac.call_count)
+            self.assertIsNone(results[0]["error"])
+
+    def test_allocate_bulk_fixed_ips_and_failures_per_port(self):
+        with contextlib.nested(
+            self._stubs(self._subnet(), self._mac_range()),
+            mock.patch.object(self.ipam, "allocate_mac_address"),
+            mock.patch.object(self.ipam, "allocate_ip_address"),
+        ) as (stubs, alloc_mac, alloc_ip):
+            alloc_ip.side_effect = [None, q_exc.IPAddressNotInSubnet(
+                ip_addr="1.1.1.1", subnet_id=1)]
+            fixed = {"ip_addresses": ["0.0.0.5"], "subnets": [1]}
+            bad = {"ip_addresses": ["1.1.1.1"], "subnets": [1]}
+            results = self.ipam.allocate_bulk(
+                self.context,
+                [("p1", 1, fixed), ("p2", 1, None), ("p3", 1, bad)],
+                self.reuse_after)
+
+            self.assertIsNone(results[0]["error"])
+            self.assertIsNone(results[1]["error"])
+            self.assertEqual(1, len(results[1]["ip_addresses"]))
+            self.assertIsInstance(results[2]["error"],
+                                  q_exc.IPAddressNotInSubnet)
+            self.assertEqual(2, alloc_mac.call_count)
+            self.assertEqual(["0.0.0.5"],
+                             alloc_ip.call_args_list[0][1]["ip_addresses"])
+
+    def test_allocate_bulk_falls_back_when_bulk_fails(self):
+        with contextlib.nested(
+            self._stubs(self._subnet(), self._mac_range()),
+            mock.patch.object(self.ipam, "allocate_mac_address"),
+            mock.patch.object(self.ipam, "allocate_ip_address"),
+        ) as ((mac_incr, mac_create, subnet_lease, ip_create, notify),
+              alloc_mac, alloc_ip):
+            mac_create.side_effect = Exception("duplicate")
+            subnet_lease.return_value = None
+            results = self.ipam.allocate_bulk(
+                self.context, [("p1", 1, None)], self.reuse_after)
+            self.assertIsNone(results[0]["error"])
+            self.assertTrue(alloc_mac.called)
+            self.assertTrue(alloc_ip.called)
+            self.assertFalse(ip_create.called)
+
+
+class QuarkIPAddressReallocateSingleClaim(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIPAddressReallocateSingleClaim, self).setUp()
+        cfg.CONF.set_override('ipam_reallocate_single_claim', True, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'ipam_reallocate_single_claim', 'QUARK')
+
+    @contextlib.contextmanager
+    def _stubs(self, claimed=None, claim_raises=False):
+        with contextlib.nested(
+            mock.patch("quark.db.api.ip_address_reallocate_claim"),
+            mock.patch("quark.db.api.transaction_create"),
+            mock.patch("quark.db.api.ip_address_reallocate"),
+        ) as (claim, txn_create, addr_realloc):
+            if claim_raises:
+                claim.side_effect = Exception("SKIP LOCKED not supported")
+            else:
+                claim.return_value = claimed
+            addr_realloc.return_value = False
+            yield claim, txn_create
+
+    def test_reallocate_claims_in_single_statement(self):
+        address = models.IPAddress(id=1, address=1, address_readable="0.0.0.1")
+        with self._stubs(claimed=address) as (claim, txn_create):
+            res = self.ipam.attempt_to_reallocate_ip(
+                self.context, 1, 2, self.reuse_after, version=4)
+            self.assertEqual([address], res)
+            self.assertFalse(txn_create.called)
+            update_kwargs = claim.call_args[0][1]
+            self.assertFalse(update_kwargs["_deallocated"])
+            self.assertIsNone(update_kwargs["deallocated_at"])
+            self.assertEqual(claim.call_args[1]["network_id"], 1)
+            self.assertEqual(claim.call_args[1]["reuse_after"],
+                             self.reuse_after)
+
+    def test_reallocate_claim_finds_nothing_falls_back(self):
+        with self._stubs(claimed=None) as (claim, txn_create):
+            res = self.ipam.attempt_to_reallocate_ip(
+                self.context, 1, 2, self.reuse_after, version=4)
+            self.assertEqual([], res)
+            self.assertTrue(claim.called)
+            self.assertTrue(txn_create.called)
+
+    def test_reallocate_claim_error_falls_back(self):
+        with self._stubs(claim_raises=True) as (claim, txn_create):
+            res = self.ipam.attempt_to_reallocate_ip(
+                self.context, 1, 2, self.reuse_after, version=4)
+            self.assertEqual([], res)
+            self.assertTrue(claim.called)
+            self.assertTrue(txn_create.called)
+
+
 class TestQuarkIpPoliciesIpAllocation(QuarkIpamBaseTest):
     @contextlib.contextmanager
     def _stubs(self, addresses=None, subnets=None):
@@ -1885,8 +2339,12 @@ class QuarkIPAddressAllocationNotifications(QuarkIpamBaseTest):
         port.update(port_dict)
         address["ports"] = [port]
 
-        with self._stubs(dict(), deleted_at="456") as notify:
+        with contextlib.nested(
+                self._stubs(dict(), deleted_at="456"),
+                mock.patch("quark.db.api.ip_address_deallocate_all")
+        ) as (notify, dealloc_all):
             self.ipam.deallocate_ips_by_port(self.context, port)
+            dealloc_all.assert_called_once_with(self.context, [address])
             notify.assert_called_with('network')
             self.assertEqual(notify.call_count, 2,
                              'Should have called notify twice')
@@ -1948,9 +2406,9 @@ class QuarkIpamTestSelectSubnet(QuarkIpamBaseTest):
             sub_mods = []
             sub_mods.append((subnet_helper(subnet), count))
 
-            def subnet_increment(context, sub):
+            def subnet_increment(context, sub, step=1):
                 if increments:
-                    sub["next_auto_assign_ip"] += 1
+                    sub["next_auto_assign_ip"] += step
                     return True
                 return False
 
@@ -2032,6 +2490,38 @@ class QuarkIpamTestSelectSubnet(QuarkIpamBaseTest):
             self.assertTrue(refresh.called)
             self.assertEqual(subnets[0][0]["next_auto_assign_ip"], -1)
 
+    def test_select_subnet_skips_excluded_range_in_one_step(self):
+        net = netaddr.IPNetwork("0.0.0.0/24").ipv6()
+        subnet = dict(id=1, first_ip=net.first, last_ip=net.last,
+                      cidr="0.0.0.0/24", ip_version=4, network_id=1,
+                      next_auto_assign_ip=net.first,
+                      ip_policy=dict(size=5, exclude=[
+                          models.IPPolicyCIDR(cidr="0.0.0.0/30"),
+                          models.IPPolicyCIDR(cidr="0.0.0.4/32")]))
+
+        with self._stubs(subnet, 0) as (subnets, refresh):
+            s = self.ipam.select_subnet(self.context, subnet["network_id"],
+                                        None, None)
+            self.assertEqual(subnets[0][0], s)
+            # The allocation is made from next_auto_assign_ip - 1
+            self.assertEqual(subnets[0][0]["next_auto_assign_ip"],
+                             net.first + 6)
+
+    def test_select_subnet_marks_full_when_tail_excluded(self):
+        net = netaddr.IPNetwork("0.0.0.0/24").ipv6()
+        subnet = dict(id=1, first_ip=net.first, last_ip=net.last,
+                      cidr="0.0.0.0/24", ip_version=4, network_id=1,
+                      next_auto_assign_ip=net.first + 250,
+                      ip_policy=dict(size=8, exclude=[
+                          models.IPPolicyCIDR(cidr="0.0.0.248/29")]))
+
+        with self._stubs(subnet, 10) as (subnets, refresh):
+            s = self.ipam.select_subnet(self.context, subnet["network_id"],
+                                        None, None)
+            self.assertIsNone(s)
+            self.assertTrue(refresh.called)
+            self.assertEqual(subnets[0][0]["next_auto_assign_ip"], -1)
+
 
 class QuarkIpamTestSelectSubnetLocking(QuarkIpamBaseTest):
     @contextlib.contextmanager
@@ -2045,9 +2535,9 @@ class QuarkIpamTestSelectSubnetLocking(QuarkIpamBaseTest):
             sub_mods = []
             sub_mods.append((subnet_helper(subnet), count))
 
-            def subnet_increment(context, sub):
+            def subnet_increment(context, sub, step=1):
                 if increments:
-                    sub["next_auto_assign_ip"] += 1
+                    sub["next_auto_assign_ip"] += step
                     return True
                 return False
 
@@ -2091,6 +2581,319 @@ class QuarkIpamTestSelectSubnetLocking(QuarkIpamBaseTest):
                                            segment_id=None, ip_version=4)
 
 
+class QuarkIpamTestSubnetSelectionStrategies(QuarkIpamBaseTest):
+    def test_registry_has_selection_variants(self):
+        registry = quark.ipam.IpamRegistry()
+        for name in ("ANY_LEAST_FULL", "BOTH_ROUND_ROBIN",
+                     "BOTH_REQUIRED_PORT_HASH", "ANY_WEIGHTED_RANDOM"):
+            self.assertTrue(registry.is_valid_strategy(name))
+        self.assertFalse(registry.is_valid_strategy("ANY_MOST_FULL"))
+        strategy = registry.get_strategy("BOTH_ROUND_ROBIN")
+        self.assertIsInstance(strategy, quark.ipam.QuarkIpamBOTH)
+        self.assertEqual("ROUND_ROBIN", strategy.subnet_selection.get_name())
+        self.assertEqual("BOTH_ROUND_ROBIN", strategy.name)
+        self.assertEqual("MOST_FULL", registry.get_strategy(
+            "BOTH").subnet_selection.get_name())
+        self.assertEqual("BOTH", registry.get_strategy("BOTH").name)
+
+    def test_ipam_log_uses_registered_name(self):
+        strategy = quark.ipam.IpamRegistry().get_strategy("ANY_LEAST_FULL")
+        with contextlib.nested(
+            mock.patch("quark.ipam.QuarkIPAMLog"),
+            mock.patch.object(strategy, "attempt_to_reallocate_ip"),
+        ) as (ipam_log, realloc):
+            realloc.return_value = [models.IPAddress(version=4)]
+            strategy.allocate_ip_address(self.context, [], 1, 2,
+                                         self.reuse_after)
+            ipam_log.assert_called_once_with(strategy="ANY_LEAST_FULL")
+
+    def test_select_subnet_least_full(self):
+        subnet = dict(id=1, first_ip=0, last_ip=255,
+                      cidr="0.0.0.0/24", ip_version=4,
+                      next_auto_assign_ip=1,
+                      ip_policy=None, network_id=1)
+        ipam = quark.ipam.QuarkIpamANY("LEAST_FULL")
+        with contextlib.nested(
+            mock.patch("quark.db.api.subnet_find_ordered_by_most_full"),
+            mock.patch("quark.db.api.subnet_find_ordered_by_least_full"),
+            mock.patch("quark.db.api.subnet_update_next_auto_assign_ip"),
+            mock.patch("sqlalchemy.orm.session.Session.refresh"),
+        ) as (most_full, least_full, subnet_incr, refresh):
+            least_full.return_value = [(subnet_helper(subnet), 1)]
+            subnet_incr.return_value = 1
+            s = ipam.select_subnet(self.context, 1, None, None,
+                                   ip_version=4, port_id="port")
+            self.assertEqual(1, s["id"])
+            self.assertFalse(most_full.called)
+            least_full.assert_called_with(self.context, 1, lock_subnets=True,
+                                          subnet_id=None, scope="all",
+                                          segment_id=None, ip_version=4)
+
+    def test_choose_available_subnet_passes_port_id(self):
+        ipam = quark.ipam.QuarkIpamBOTH("PORT_HASH")
+        with mock.patch.object(ipam, "select_subnet") as select:
+            select.return_value = {"id": 1}
+            ipam._choose_available_subnet(self.context, 1,
+                                          reallocated_ips=[], port_id="port")
+            for call in select.call_args_list:
+                self.assertEqual("port", call[1]["port_id"])
+
+
+class QuarkIpamTestSelectSubnetOptimistic(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamTestSelectSubnetOptimistic, self).setUp()
+        cfg.CONF.set_override('ipam_optimistic_subnet_selection', True,
+                              'QUARK')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'ipam_optimistic_subnet_selection', 'QUARK')
+
+    @contextlib.contextmanager
+    def _stubs(self, subnets, lost=()):
+        with contextlib.nested(
+            mock.patch("quark.db.api.subnet_find_ordered_by_most_full"),
+            mock.patch("quark.db.api.subnet_update_next_auto_assign_ip"),
+            mock.patch("quark.db.api.subnet_update_set_full"),
+            mock.patch("sqlalchemy.orm.session.Session.refresh"),
+        ) as (subnet_find, subnet_incr, subnet_set_full, refresh):
+            sub_mods = [(subnet_helper(subnet), 1) for subnet in subnets]
+
+            def subnet_increment(context, sub, step=1, conditional=False):
+                if sub["id"] in lost:
+                    return 0
+                sub["next_auto_assign_ip"] += step
+                return 1
+
+            subnet_find.return_value = sub_mods
+            subnet_incr.side_effect = subnet_increment
+            yield subnet_find, subnet_incr
+
+    def _subnet(self, id, cidr):
+        net = netaddr.IPNetwork(cidr)
+        return dict(id=id, first_ip=net.first, last_ip=net.last, cidr=cidr,
+                    ip_version=4, next_auto_assign_ip=net.first + 1,
+                    ip_policy=None, network_id=1)
+
+    def test_select_subnet_does_not_lock(self):
+        subnet = self._subnet(1, "0.0.0.0/24")
+        with self._stubs([subnet]) as (subnet_find, subnet_incr):
+            s = self.ipam.select_subnet(self.context, 1, None, None,
+                                        ip_version=4)
+            self.assertEqual(1, s["id"])
+            subnet_find.assert_called_with(self.context, 1, lock_subnets=False,
+                                           subnet_id=None, scope="all",
+                                           segment_id=None, ip_version=4)
+            self.assertTrue(subnet_incr.call_args[1]["conditional"])
+
+    def test_select_subnet_lost_race_tries_next(self):
+        subnets = [self._subnet(1, "0.0.0.0/24"),
+                   self._subnet(2, "0.0.1.0/24")]
+        with self._stubs(subnets, lost=(1,)) as (subnet_find, subnet_incr):
+            s = self.ipam.select_subnet(self.context, 1, None, None,
+                                        ip_version=4)
+            self.assertEqual(2, s["id"])
+            self.assertEqual(2, subnet_incr.call_count)
+
+    def test_select_subnet_lost_every_race(self):
+        subnets = [self._subnet(1, "0.0.0.0/24"),
+                   self._subnet(2, "0.0.1.0/24")]
+        with self._stubs(subnets, lost=(1, 2)) as (subnet_find, subnet_incr):
+            s = self.ipam.select_subnet(self.context, 1, None, None,
+                                        ip_version=4)
+            self.assertIsNone(s)
+
+
+class QuarkIpamTestV4Leasing(QuarkIpamBaseTest):
+    def setUp(self):
+        super(QuarkIpamTestV4Leasing, self).setUp()
+        cfg.CONF.set_override('ipam_v4_lease_block_size', 4, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override, 'ipam_v4_lease_block_size',
+                        'QUARK')
+        patcher = mock.patch("quark.ipam.V4_LEASES",
+                             quark.ipam.LeaseRegistry())
+        self.leases = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @contextlib.contextmanager
+    def _stubs(self, subnet, leased=None):
+        with contextlib.nested(
+            mock.patch("quark.db.api.subnet_find_ordered_by_most_full"),
+            mock.patch("quark.db.api.subnet_lease_next_auto_assign_ips"),
+            mock.patch("quark.db.api.subnet_update_next_auto_assign_ip"),
+            mock.patch("quark.db.api.subnet_find"),
+            mock.patch("sqlalchemy.orm.session.Session.refresh"),
+        ) as (subnet_find_ordered, subnet_lease, subnet_incr, subnet_find,
+              refresh):
+            sub_mod = subnet_helper(subnet)
+            subnet_find_ordered.return_value = [(sub_mod, 0)]
+            subnet_lease.return_value = leased
+            subnet_find.return_value = sub_mod
+            yield sub_mod, subnet_find_ordered, subnet_lease, subnet_incr
+
+    def _subnet(self, **kwargs):
+        subnet = dict(id=1, first_ip=0, last_ip=255, cidr="0.0.0.0/24",
+                      ip_version=4, next_auto_assign_ip=1, ip_policy=None,
+                      network_id=1, do_not_use=False)
+        subnet.update(kwargs)
+        return subnet
+
+    def test_select_subnet_leases_block(self):
+        with self._stubs(self._subnet(), leased=(1, 4)) as (
+                sub_mod, find_ordered, subnet_lease, subnet_incr):
+            s = self.ipam.select_subnet(self.context, 1, None, None)
+            self.assertEqual(sub_mod, s)
+            subnet_lease.assert_called_once_with(self.context, sub_mod, 4,
+                                                 used=4)
+            self.assertFalse(subnet_incr.called)
+            self.assertEqual(1, len(self.leases))
+
+    def test_select_subnet_lease_counts_only_allowed_addresses(self):
+        subnet = self._subnet(ip_policy=dict(exclude=[
+            models.IPPolicyCIDR(cidr="0.0.0.2/31")]))
+        with self._stubs(subnet, leased=(1, 4)) as (
+                sub_mod, find_ordered, subnet_lease, subnet_incr):
+            self.ipam.select_subnet(self.context, 1, None, None)
+            subnet_lease.assert_called_once_with(self.context, sub_mod, 4,
+                                                 used=2)
+
+    def test_select_subnet_lease_fails(self):
+        with self._stubs(self._subnet(), leased=None) as (
+                sub_mod, find_ordered, subnet_lease, subnet_incr):
+            s = self.ipam.select_subnet(self.context, 1, None, None)
+            self.assertIsNone(s)
+            self.assertEqual(0, len(self.leases))
+
+    def test_select_subnet_uses_live_lease_without_locking(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 1, 4))
+        with self._stubs(self._subnet()) as (
+                sub_mod, find_ordered, subnet_lease, subnet_incr):
+            s = self.ipam.select_subnet(self.context, 1, None, None)
+            self.assertEqual(sub_mod, s)
+            self.assertFalse(find_ordered.called)
+            self.assertFalse(subnet_lease.called)
+
+    def test_select_subnet_ignores_lease_for_explicit_ip(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 1, 4))
+        with self._stubs(self._subnet()) as (
+                sub_mod, find_ordered, subnet_lease, subnet_incr):
+            self.ipam.select_subnet(self.context, 1, "0.0.0.10", None)
+            self.assertTrue(find_ordered.called)
+            self.assertFalse(subnet_lease.called)
+
+    def test_select_subnet_skips_do_not_use_lease(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 1, 4))
+        with self._stubs(self._subnet(do_not_use=True)) as (
+                sub_mod, find_ordered, subnet_lease, subnet_incr):
+            find_ordered.return_value = []
+            s = self.ipam.select_subnet(self.context, 1, None, None)
+            self.assertIsNone(s)
+            self.assertIsNone(self.leases.find(1, None))
+
+    def test_allocate_from_subnet_takes_leased_ip_skipping_policy(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 1, 4))
+        subnet = self._subnet(ip_policy=dict(exclude=[
+            models.IPPolicyCIDR(cidr="0.0.0.1/32")]))
+        with contextlib.nested(
+            self._stubs(subnet),
+            mock.patch("quark.db.api.ip_address_create")
+        ) as ((sub_mod, find_ordered, subnet_lease, subnet_incr), ip_create):
+            self.ipam._allocate_from_subnet(self.context, 1, sub_mod, None,
+                                            self.reuse_after)
+            self.assertEqual(netaddr.IPAddress("0.0.0.2"),
+                             ip_create.call_args[1]["address"])
+            # Counted when the block was leased
+            self.assertFalse(ip_create.call_args[1]["count_used"])
+
+    def test_allocate_from_subnet_leased_ip_in_use_gives_back_count(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 1, 4))
+        with contextlib.nested(
+            self._stubs(self._subnet()),
+            mock.patch("quark.db.api.ip_address_create"),
+            mock.patch("quark.db.api.subnet_update_used_count")
+        ) as ((sub_mod, find_ordered, subnet_lease, subnet_incr), ip_create,
+              used_count):
+            ip_create.side_effect = db_exc.DBDuplicateEntry
+            with self.assertRaises(n_exc.IpAddressInUse):
+                self.ipam._allocate_from_subnet(self.context, 1, sub_mod,
+                                                None, self.reuse_after)
+            used_count.assert_called_once_with(self.context, 1, -1)
+
+    def test_allocate_from_subnet_lease_drained_raises(self):
+        subnet = self._subnet()
+        with self._stubs(subnet) as (sub_mod, find_ordered, subnet_lease,
+                                     subnet_incr):
+            with self.assertRaises(q_exc.IPAddressRetryableFailure):
+                self.ipam._allocate_from_subnet(self.context, 1, sub_mod,
+                                                None, self.reuse_after)
+
+    def test_release_v4_leases_returns_unused(self):
+        lease = quark.ipam.V4AddressLease(1, 1, None, 1, 4)
+        self.leases.add(lease)
+        self.assertEqual(1, self.leases.take(1))
+        lease.expires_at = 0
+        with contextlib.nested(
+            self._stubs(self._subnet()),
+            mock.patch("quark.db.api.ip_address_create_deallocated_bulk")
+        ) as ((sub_mod, find_ordered, subnet_lease, subnet_incr),
+              create_bulk):
+            quark.ipam.release_v4_leases(self.context)
+            create_bulk.assert_called_once_with(self.context, sub_mod,
+                                                [2, 3, 4])
+            self.assertEqual(0, len(self.leases))
+
+
+class QuarkIpamTestV4LeaseRegistry(test_base.TestBase):
+    def setUp(self):
+        super(QuarkIpamTestV4LeaseRegistry, self).setUp()
+        self.leases = quark.ipam.LeaseRegistry()
+
+    def test_take_exhausts_lease(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 10, 11))
+        self.assertEqual(10, self.leases.take(1))
+        self.assertEqual(11, self.leases.take(1))
+        self.assertIsNone(self.leases.take(1))
+        self.assertEqual([], self.leases.pop_releasable(expired_only=False))
+
+    def test_find_matches_segment_or_subnet_ids(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, "seg", 10, 11))
+        self.assertEqual(1, self.leases.find(1, "seg"))
+        self.assertIsNone(self.leases.find(1, "other"))
+        self.assertEqual(1, self.leases.find(1, None, subnet_ids=[1]))
+        self.assertIsNone(self.leases.find(2, "seg"))
+
+    def test_expired_lease_is_releasable(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 10, 12, ttl=0))
+        self.assertIsNone(self.leases.find(1, None))
+        self.assertIsNone(self.leases.take(1))
+        released = self.leases.pop_releasable()
+        self.assertEqual(1, len(released))
+        self.assertEqual([10, 11, 12], released[0].unused())
+
+    def test_replacing_lease_retires_previous(self):
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 10, 12))
+        self.leases.add(quark.ipam.V4AddressLease(1, 1, None, 20, 22))
+        released = self.leases.pop_releasable()
+        self.assertEqual(1, len(released))
+        self.assertEqual(20, self.leases.take(1))
+
+
+class QuarkIpamTestMacLeaseRegistry(test_base.TestBase):
+    def setUp(self):
+        super(QuarkIpamTestMacLeaseRegistry, self).setUp()
+        self.leases = quark.ipam.LeaseRegistry()
+
+    def test_do_not_use_lease_only_for_forbidden_ranges(self):
+        self.leases.add(quark.ipam.MacAddressLease(1, True, 10, 11))
+        self.assertIsNone(self.leases.find(False))
+        self.assertEqual(1, self.leases.find(True))
+
+    def test_lease_per_range(self):
+        self.leases.add(quark.ipam.MacAddressLease(1, False, 10, 11))
+        self.leases.add(quark.ipam.MacAddressLease(2, False, 20, 21))
+        self.assertEqual(10, self.leases.take(1))
+        self.assertEqual(20, self.leases.take(2))
+        self.assertEqual([], self.leases.pop_releasable())
+
+
 class QuarkIpamTestLog(test_base.TestBase):
     def test_ipam_log_entry_success_flagging(self):
         log = quark.ipam.QuarkIPAMLog()
@@ -2153,6 +2956,35 @@ class QuarkIpamTestLog(test_base.TestBase):
         log.end()
         self.assertTrue(output.called)
 
+    def test_ipam_main_log_publishes_metrics(self):
+        with contextlib.nested(
+            mock.patch("quark.ipam.QuarkIPAMLog._output"),
+            mock.patch("quark.ipam_metrics.increment"),
+            mock.patch("quark.ipam_metrics.observe")
+        ) as (output, increment, observe):
+            log = quark.ipam.QuarkIPAMLog(strategy="BOTH")
+            entry1 = log.make_entry("test1")
+            entry1.failed()
+            entry1.end()
+            log.make_entry("test1").end()
+            log.reallocated = 1
+            log.created = 1
+            log.end()
+            self.assertEqual("allocation", observe.call_args[0][0])
+            self.assertEqual("BOTH", observe.call_args[1]["strategy"])
+            increment.assert_any_call("allocations", strategy="BOTH",
+                                      result="success")
+            increment.assert_any_call("addresses", 1, strategy="BOTH",
+                                      source="reallocated")
+            increment.assert_any_call("addresses", 1, strategy="BOTH",
+                                      source="created")
+            increment.assert_any_call("step_attempts", 2, strategy="BOTH",
+                                      step="test1")
+            increment.assert_any_call("step_retries", 1, strategy="BOTH",
+                                      step="test1")
+            increment.assert_any_call("step_failures", 1, strategy="BOTH",
+                                      step="test1")
+
     def test_ipam_logged_decorator(self):
         patcher = mock.patch("quark.ipam.QuarkIPAMLog._output")
         output = patcher.start()
@@ -2221,9 +3053,9 @@ class IronicIpamTestSelectSubnet(QuarkIpamBaseTest):
             sub_mods = []
             sub_mods.append((subnet_helper(subnet), count))
 
-            def subnet_increment(context, sub):
+            def subnet_increment(context, sub, step=1):
                 if increments:
-                    sub["next_auto_assign_ip"] += 1
+                    sub["next_auto_assign_ip"] += step
                     return True
                 return False
 
@@ -0,0 +1,124 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import contextlib
+
+import mock
+from oslo_config import cfg
+
+from quark import ipam_metrics
+from quark.tests import test_base
+
+
+class TestStatsdSink(test_base.TestBase):
+    def setUp(self):
+        super(TestStatsdSink, self).setUp()
+        self.sink = ipam_metrics.StatsdSink("127.0.0.1", 8125, "quark.ipam")
+        self.sink.sock = mock.Mock()
+
+    def test_increment(self):
+        self.sink.increment("allocations", 2,
+                            dict(strategy="ANY", result="success"))
+        self.sink.sock.sendto.assert_called_once_with(
+            "quark.ipam.allocations.success.ANY:2|c", ("127.0.0.1", 8125))
+
+    def test_observe(self):
+        self.sink.observe("allocation", 0.25, dict(strategy="BOTH"))
+        self.sink.sock.sendto.assert_called_once_with(
+            "quark.ipam.allocation.BOTH:250.000|ms", ("127.0.0.1", 8125))
+
+    def test_send_errors_are_ignored(self):
+        self.sink.sock.sendto.side_effect = ipam_metrics.socket.error
+        self.sink.increment("allocations", 1, {})
+
+
+class TestPrometheusSink(test_base.TestBase):
+    def test_render_counters(self):
+        sink = ipam_metrics.PrometheusSink("quark.ipam")
+        sink.increment("subnet_full", 1, dict(strategy="ANY"))
+        sink.increment("subnet_full", 2, dict(strategy="ANY"))
+        text = sink.render()
+        self.assertIn("# TYPE quark_ipam_subnet_full_total counter", text)
+        self.assertIn('quark_ipam_subnet_full_total{strategy="ANY"} 3', text)
+
+    def test_render_histogram(self):
+        sink = ipam_metrics.PrometheusSink("quark.ipam")
+        sink.observe("allocation", 0.003, dict(strategy="ANY"))
+        sink.observe("allocation", 0.2, dict(strategy="ANY"))
+        sink.observe("allocation", 60, dict(strategy="ANY"))
+        lines = sink.render().splitlines()
+        self.assertIn("# TYPE quark_ipam_allocation_seconds histogram", lines)
+        self.assertIn('quark_ipam_allocation_seconds_bucket'
+                      '{strategy="ANY",le="0.005"} 1', lines)
+        self.assertIn('quark_ipam_allocation_seconds_bucket'
+                      '{strategy="ANY",le="0.25"} 2', lines)
+        self.assertIn('quark_ipam_allocation_seconds_bucket'
+                      '{strategy="ANY",le="10.0"} 2', lines)
+        self.assertIn('quark_ipam_allocation_seconds_bucket'
+                      '{strategy="ANY",le="+Inf"} 3', lines)
+        self.assertIn('quark_ipam_allocation_seconds_count'
+                      '{strategy="ANY"} 3', lines)
+
+    def test_serve_takes_first_free_port(self):
+        sink = ipam_metrics.PrometheusSink("quark.ipam")
+        with contextlib.nested(
+            mock.patch("quark.ipam_metrics.BaseHTTPServer.HTTPServer"),
+            mock.patch("quark.ipam_metrics.threading.Thread"),
+        ) as (server, thread):
+            server.side_effect = [ipam_metrics.socket.error, mock.Mock()]
+            self.assertEqual(9110, sink.serve("127.0.0.1", 9109, 4))
+            self.assertEqual(("127.0.0.1", 9110), server.call_args[0][0])
+
+    def test_serve_all_ports_taken(self):
+        sink = ipam_metrics.PrometheusSink("quark.ipam")
+        with contextlib.nested(
+            mock.patch("quark.ipam_metrics.BaseHTTPServer.HTTPServer"),
+            mock.patch("quark.ipam_metrics.LOG"),
+        ) as (server, log):
+            server.side_effect = ipam_metrics.socket.error
+            self.assertIsNone(sink.serve("127.0.0.1", 9109, 2))
+            self.assertEqual(2, server.call_count)
+            self.assertTrue(log.error.called)
+
+
+class TestIpamMetrics(test_base.TestBase):
+    def setUp(self):
+        super(TestIpamMetrics, self).setUp()
+        ipam_metrics.reset()
+        self.addCleanup(ipam_metrics.reset)
+
+    def test_default_sink_is_null(self):
+        self.assertIsInstance(ipam_metrics.get_sink(), ipam_metrics.NullSink)
+        ipam_metrics.increment("allocations", strategy="ANY")
+
+    def test_prometheus_sink_from_config(self):
+        cfg.CONF.set_override("ipam_metrics_sink", "prometheus", "QUARK")
+        cfg.CONF.set_override("ipam_metrics_prometheus_port", 0, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "ipam_metrics_sink",
+                        "QUARK")
+        self.addCleanup(cfg.CONF.clear_override,
+                        "ipam_metrics_prometheus_port", "QUARK")
+        ipam_metrics.increment("subnet_full", strategy="ANY")
+        sink = ipam_metrics.get_sink()
+        self.assertIsInstance(sink, ipam_metrics.PrometheusSink)
+        self.assertIn('quark_ipam_subnet_full_total{strategy="ANY"} 1',
+                      sink.render())
+
+    def test_statsd_sink_from_config(self):
+        cfg.CONF.set_override("ipam_metrics_sink", "statsd", "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, "ipam_metrics_sink",
+                        "QUARK")
+        self.assertIsInstance(ipam_metrics.get_sink(),
+                              ipam_metrics.StatsdSink)
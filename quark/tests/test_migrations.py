@@ -842,3 +842,44 @@ class Test4fc07b41d45c(BaseMigrationTest):
                 self.ip_addresses_table.c.id)).fetchall()
         expected_results = []
         self.assertEqual(results, expected_results)
+
+
+class Test3c2fa8a10b34(BaseMigrationTest):
+    def setUp(self):
+        super(Test3c2fa8a10b34, self).setUp()
+        self.previous_revision = "2a116b962c95"
+        self.current_revision = "3c2fa8a10b34"
+        self.metadata = sa.MetaData(bind=self.engine)
+        self.subnets_table = sa.Table(
+            'quark_subnets', self.metadata,
+            sa.Column('id', sa.String(length=36), primary_key=True))
+        self.ip_addresses_table = sa.Table(
+            'quark_ip_addresses', self.metadata,
+            sa.Column('id', sa.String(length=36), primary_key=True),
+            sa.Column('subnet_id', sa.String(length=36)))
+        self.metadata.create_all()
+        alembic_command.stamp(self.config, self.previous_revision)
+        self.subnets = table('quark_subnets',
+                             column('id', sa.String(length=36)),
+                             column('used_count', sa.BigInteger()))
+
+    def test_upgrade_empty(self):
+        alembic_command.upgrade(self.config, self.current_revision)
+        results = self.connection.execute(
+            select([self.subnets])).fetchall()
+        self.assertEqual(results, [])
+
+    def test_upgrade(self):
+        self.connection.execute(
+            self.subnets_table.insert(),
+            dict(id="1"), dict(id="2"), dict(id="3"))
+        self.connection.execute(
+            self.ip_addresses_table.insert(),
+            dict(id="1", subnet_id="1"),
+            dict(id="2", subnet_id="1"),
+            dict(id="3", subnet_id="2"),
+            dict(id="4", subnet_id=None))
+        alembic_command.upgrade(self.config, self.current_revision)
+        results = self.connection.execute(
+            select([self.subnets]).order_by(self.subnets.c.id)).fetchall()
+        self.assertEqual(results, [(u'1', 2), (u'2', 1), (u'3', 0)])
@@ -0,0 +1,90 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from quark.db import models
+from quark import provider_cache
+from quark.tests import test_base
+
+
+class TestProviderCache(test_base.TestBase):
+    def setUp(self):
+        super(TestProviderCache, self).setUp()
+        self.cache = provider_cache.ProviderCache(ttl=60)
+        self.network = models.Network(id="public_network")
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get(models.Network, "public_network"))
+        self.cache.put(models.Network, "public_network", self.network)
+        self.assertIs(self.network,
+                      self.cache.get(models.Network, "public_network"))
+        self.assertIsNone(self.cache.get(models.Subnet, "public_network"))
+        self.assertEqual(1, len(self.cache))
+
+    def test_entries_expire(self):
+        with mock.patch("quark.provider_cache.time.time") as now:
+            now.return_value = 1000
+            self.cache.put(models.Network, "public_network", self.network)
+            now.return_value = 1059
+            self.assertIs(self.network,
+                          self.cache.get(models.Network, "public_network"))
+            now.return_value = 1060
+            self.assertIsNone(self.cache.get(models.Network,
+                                             "public_network"))
+        self.assertEqual(0, len(self.cache))
+
+    def test_view_is_built_once_per_fields(self):
+        build = mock.Mock(return_value={"id": "public_network",
+                                        "subnets": ["public_v4"]})
+        for _i in xrange(3):
+            self.cache.view(models.Network, "public_network", None, build)
+        self.cache.view(models.Network, "public_network", ["name", "id"],
+                        build)
+        self.cache.view(models.Network, "public_network", ["id", "name"],
+                        build)
+        self.assertEqual(2, build.call_count)
+
+    def test_view_returns_copies(self):
+        build = mock.Mock(return_value={"subnets": ["public_v4"]})
+        view = self.cache.view(models.Network, "public_network", None, build)
+        view["subnets"].append("public_v6")
+        view = self.cache.view(models.Network, "public_network", None, build)
+        self.assertEqual(["public_v4"], view["subnets"])
+
+    def test_invalidate(self):
+        build = mock.Mock(return_value={})
+        self.cache.put(models.Network, "public_network", self.network)
+        self.cache.view(models.Network, "public_network", None, build)
+        self.cache.invalidate(models.Network, "public_network")
+        self.assertIsNone(self.cache.get(models.Network, "public_network"))
+        self.cache.view(models.Network, "public_network", None, build)
+        self.assertEqual(2, build.call_count)
+
+    def test_clear(self):
+        self.cache.put(models.Network, "public_network", self.network)
+        self.cache.put(models.Subnet, "public_v4", models.Subnet())
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
+
+    def test_disabled(self):
+        cache = provider_cache.ProviderCache(ttl=0)
+        self.assertFalse(cache.enabled)
+        cache.put(models.Network, "public_network", self.network)
+        self.assertIsNone(cache.get(models.Network, "public_network"))
+        build = mock.Mock(return_value={})
+        cache.view(models.Network, "public_network", None, build)
+        cache.view(models.Network, "public_network", None, build)
+        self.assertEqual(2, build.call_count)
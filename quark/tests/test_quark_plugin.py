@@ -13,6 +13,7 @@
 # License for the specific language governing permissions and limitations
 #  under the License.
 
+import contextlib
 
 import mock
 from oslo_config import cfg
@@ -47,3 +48,141 @@ class TestQuarkAPIExtensions(TestQuarkPlugin):
             conf.set_override.assert_called_once_with(
                 "api_extensions_path",
                 "apple:banana:carrot")
+
+
+class TestQuarkReplicaReads(TestQuarkPlugin):
+    def setUp(self):
+        super(TestQuarkReplicaReads, self).setUp()
+        cfg.CONF.set_override('read_replica_gets', True, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override, 'read_replica_gets',
+                        'QUARK')
+        self.addCleanup(quark.plugin._TENANT_WRITES.clear)
+        self.context._session = None
+
+    def _get_ports(self, **kwargs):
+        with contextlib.nested(
+            mock.patch("quark.plugin.neutron_db_api.get_session"),
+            mock.patch("quark.plugin.ports")
+        ) as (get_session, ports):
+            replica = get_session.return_value
+            replica.is_active = False
+            seen = []
+            ports.get_ports.side_effect = (
+                lambda context, *args: seen.append(context._session))
+            self.plugin.get_ports(self.context, **kwargs)
+            return get_session, replica, seen[0]
+
+    def test_gets_use_replica(self):
+        get_session, replica, used = self._get_ports()
+        get_session.assert_called_once_with(use_slave=True)
+        self.assertIs(replica, used)
+        self.assertTrue(replica.close.called)
+        self.assertIsNone(self.context._session)
+
+    def test_per_call_override(self):
+        get_session, replica, used = self._get_ports(use_replica=False)
+        self.assertFalse(get_session.called)
+        cfg.CONF.set_override('read_replica_gets', False, 'QUARK')
+        get_session, replica, used = self._get_ports(use_replica=True)
+        self.assertIs(replica, used)
+
+    def test_disabled_uses_master(self):
+        cfg.CONF.set_override('read_replica_gets', False, 'QUARK')
+        get_session, replica, used = self._get_ports()
+        self.assertFalse(get_session.called)
+
+    def test_recent_write_pins_tenant_to_master(self):
+        cfg.CONF.set_override('read_replica_write_pin_seconds', 5, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'read_replica_write_pin_seconds', 'QUARK')
+        with mock.patch("quark.plugin.ports"):
+            self.plugin.delete_port(self.context, 1)
+        get_session, replica, used = self._get_ports()
+        self.assertFalse(get_session.called)
+
+        quark.plugin._TENANT_WRITES[self.context.tenant_id] -= 10
+        get_session, replica, used = self._get_ports()
+        self.assertTrue(get_session.called)
+        self.assertNotIn(self.context.tenant_id, quark.plugin._TENANT_WRITES)
+
+    def test_old_writes_are_pruned(self):
+        cfg.CONF.set_override('read_replica_write_pin_seconds', 5, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override,
+                        'read_replica_write_pin_seconds', 'QUARK')
+        with mock.patch("quark.plugin.time.time") as now:
+            for i, tenant_id in enumerate(("a", "b", "c")):
+                now.return_value = 1000 + i * 3
+                quark.plugin._record_write(mock.Mock(tenant_id=tenant_id))
+        # a wrote 6 seconds before c, b 3 seconds before
+        self.assertEqual(["b", "c"], quark.plugin._TENANT_WRITES.keys())
+
+    def _get_ports_chunks(self):
+        patcher = mock.patch("quark.plugin.neutron_db_api.get_session")
+        get_session = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("quark.plugin.ports")
+        ports = patcher.start()
+        self.addCleanup(patcher.stop)
+        replica = get_session.return_value
+        replica.is_active = False
+        seen = []
+
+        def chunks(context, *args):
+            for chunk in ([1], [2]):
+                seen.append(context._session)
+                yield chunk
+
+        ports.get_ports_chunks.side_effect = chunks
+        return self.plugin.get_ports_chunks(self.context), replica, seen
+
+    def test_chunks_use_replica_until_exhausted(self):
+        chunks, replica, seen = self._get_ports_chunks()
+        self.assertEqual([1], next(chunks))
+        self.assertIs(replica, self.context._session)
+        self.assertFalse(replica.close.called)
+        self.assertEqual([[2]], list(chunks))
+        self.assertEqual([replica, replica], seen)
+        self.assertTrue(replica.close.called)
+        self.assertIsNone(self.context._session)
+
+    def test_closed_chunks_close_session(self):
+        chunks, replica, seen = self._get_ports_chunks()
+        next(chunks)
+        chunks.close()
+        self.assertEqual([replica], seen)
+        self.assertTrue(replica.close.called)
+        self.assertIsNone(self.context._session)
+
+
+class TestQuarkSqlStats(TestQuarkPlugin):
+    def test_calls_are_attributed(self):
+        cfg.CONF.set_override('sql_stats', True, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override, 'sql_stats', 'QUARK')
+        with contextlib.nested(
+            mock.patch("quark.plugin.ports"),
+            mock.patch("quark.sql_stats.LOG")
+        ) as (ports, log):
+            ports.get_ports.side_effect = (
+                lambda context, *args: context.session.execute("SELECT 1"))
+            self.plugin.get_ports(self.context)
+        self.assertEqual(1, log.info.call_count)
+        self.assertIn("get_ports: 1 statements", log.info.call_args[0][0])
+
+    def test_chunks_are_attributed(self):
+        cfg.CONF.set_override('sql_stats', True, 'QUARK')
+        self.addCleanup(cfg.CONF.clear_override, 'sql_stats', 'QUARK')
+
+        def chunks(context, *args):
+            context.session.execute("SELECT 1")
+            yield [1]
+
+        with contextlib.nested(
+            mock.patch("quark.plugin.ports"),
+            mock.patch("quark.sql_stats.LOG")
+        ) as (ports, log):
+            ports.get_ports_chunks.side_effect = chunks
+            self.assertEqual([[1]],
+                             list(self.plugin.get_ports_chunks(self.context)))
+        self.assertEqual(1, log.info.call_count)
+        self.assertIn("get_ports_chunks: 1 statements",
+                      log.info.call_args[0][0])
@@ -0,0 +1,107 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+import sqlalchemy as sa
+
+from quark import sql_stats
+from quark.tests import test_base
+
+
+class TestSqlStats(test_base.TestBase):
+    def setUp(self):
+        super(TestSqlStats, self).setUp()
+        self.engine = sa.create_engine("sqlite://")
+        self._override("sql_stats", True)
+
+    def _override(self, opt, value):
+        cfg.CONF.set_override(opt, value, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override, opt, "QUARK")
+
+    def _collect(self, *statements):
+        with mock.patch("quark.sql_stats.LOG") as log:
+            with sql_stats.collect("get_ports") as stats:
+                for statement in statements:
+                    self.engine.execute(statement)
+        return stats, log
+
+    def test_counts_and_times_statements(self):
+        stats, log = self._collect("SELECT 1", "SELECT 2")
+        self.assertEqual(2, stats.count)
+        self.assertEqual(["SELECT 1", "SELECT 2"],
+                         [s for s, _seconds in stats.statements])
+        self.assertIsNotNone(stats.elapsed)
+        self.assertEqual(1, log.info.call_count)
+        self.assertIn("get_ports: 2 statements", log.info.call_args[0][0])
+        self.assertFalse(log.warning.called)
+
+    def test_statements_outside_a_call_are_ignored(self):
+        stats, log = self._collect("SELECT 1")
+        self.engine.execute("SELECT 2")
+        self.assertEqual(1, stats.count)
+
+    def test_nested_calls_count_towards_outer(self):
+        with mock.patch("quark.sql_stats.LOG") as log:
+            with sql_stats.collect("create_port") as outer:
+                with sql_stats.collect("get_port") as inner:
+                    self.engine.execute("SELECT 1")
+        self.assertIsNone(inner)
+        self.assertEqual(1, outer.count)
+        self.assertEqual(1, log.info.call_count)
+
+    def test_disabled(self):
+        self._override("sql_stats", False)
+        stats, log = self._collect("SELECT 1")
+        self.assertIsNone(stats)
+        self.assertFalse(log.info.called)
+
+    def test_slow_call_logs_statements(self):
+        self._override("sql_stats_slow_count", 1)
+        stats, log = self._collect("SELECT 1", "SELECT 2")
+        self.assertEqual(1, log.warning.call_count)
+        message = log.warning.call_args[0][0]
+        self.assertIn("SELECT 1", message)
+        self.assertIn("SELECT 2", message)
+
+    def test_iterables_count_only_reads(self):
+        def chunks():
+            self.engine.execute("SELECT 1")
+            yield 1
+            self.engine.execute("SELECT 2")
+            yield 2
+
+        with mock.patch("quark.sql_stats.LOG") as log:
+            stream = sql_stats.collect_iter("get_ports_chunks", chunks())
+            self.assertEqual(1, next(stream))
+            self.engine.execute("SELECT 3")
+            self.assertFalse(log.info.called)
+            self.assertEqual([2], list(stream))
+        self.assertEqual(1, log.info.call_count)
+        self.assertIn("get_ports_chunks: 2 statements",
+                      log.info.call_args[0][0])
+
+    def test_closed_iterables_are_reported(self):
+        def chunks():
+            self.engine.execute("SELECT 1")
+            yield 1
+            yield 2
+
+        with mock.patch("quark.sql_stats.LOG") as log:
+            stream = sql_stats.collect_iter("get_ports_chunks", chunks())
+            next(stream)
+            stream.close()
+        self.assertIn("get_ports_chunks: 1 statements",
+                      log.info.call_args[0][0])
@@ -0,0 +1,102 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+
+from quark import subnet_selection
+from quark.tests import test_base
+
+
+def _candidates(*versions):
+    return [(dict(id=i, ip_version=v, first_ip=0, last_ip=255), 100 - i)
+            for i, v in enumerate(versions)]
+
+
+def _ids(ordered):
+    return [subnet["id"] for subnet, count in ordered]
+
+
+class TestSubnetSelection(test_base.TestBase):
+    def test_get_selection_falls_back_to_most_full(self):
+        selection = subnet_selection.get_selection("WTF")
+        self.assertIsInstance(selection, subnet_selection.MostFull)
+        self.assertIsInstance(subnet_selection.get_selection(None),
+                              subnet_selection.MostFull)
+
+    def test_most_full_keeps_query_order(self):
+        candidates = _candidates(4, 4, 6)
+        selection = subnet_selection.get_selection("MOST_FULL")
+        self.assertIs(candidates, selection.order(candidates))
+
+    def test_least_full_uses_least_full_query(self):
+        selection = subnet_selection.get_selection("LEAST_FULL")
+        with mock.patch("quark.db.api.subnet_find_ordered_by_least_full"
+                        ) as find:
+            selection.find("ctx", 1, lock_subnets=False)
+            find.assert_called_once_with("ctx", 1, lock_subnets=False)
+
+    def test_round_robin_rotates_within_version(self):
+        candidates = _candidates(4, 4, 4, 6, 6)
+        selection = subnet_selection.get_selection("ROUND_ROBIN")
+        orders = [_ids(selection.order(candidates, net_id=1))
+                  for _i in xrange(3)]
+        self.assertEqual([0, 1, 2, 3, 4], orders[0])
+        self.assertEqual([1, 2, 0, 4, 3], orders[1])
+        self.assertEqual([2, 0, 1, 3, 4], orders[2])
+
+    def test_round_robin_counts_per_network(self):
+        candidates = _candidates(4, 4)
+        selection = subnet_selection.get_selection("ROUND_ROBIN")
+        selection.order(candidates, net_id=1)
+        self.assertEqual([0, 1], _ids(selection.order(candidates, net_id=2)))
+
+    def test_port_hash_is_stable_per_port(self):
+        candidates = _candidates(4, 4, 4, 4)
+        selection = subnet_selection.get_selection("PORT_HASH")
+        first = _ids(selection.order(candidates, port_id="port-a"))
+        self.assertEqual(first,
+                         _ids(selection.order(candidates, port_id="port-a")))
+        self.assertEqual(sorted(first), [0, 1, 2, 3])
+        starts = set(_ids(selection.order(candidates, port_id=str(i)))[0]
+                     for i in xrange(32))
+        self.assertTrue(len(starts) > 1)
+
+    def test_port_hash_without_port(self):
+        candidates = _candidates(4, 4)
+        selection = subnet_selection.get_selection("PORT_HASH")
+        self.assertEqual([0, 1], _ids(selection.order(candidates)))
+
+    def test_weighted_random_picks_from_top_k(self):
+        cfg.CONF.set_override("ipam_subnet_selection_top_k", 2, "QUARK")
+        self.addCleanup(cfg.CONF.clear_override,
+                        "ipam_subnet_selection_top_k", "QUARK")
+        candidates = _candidates(4, 4, 4, 6)
+        selection = subnet_selection.get_selection("WEIGHTED_RANDOM")
+        with mock.patch("random.random") as rand:
+            rand.return_value = 0.0
+            self.assertEqual([0, 1, 2, 3],
+                             _ids(selection.order(candidates)))
+            rand.return_value = 0.99
+            self.assertEqual([1, 0, 2, 3],
+                             _ids(selection.order(candidates)))
+
+    def test_weighted_random_skips_full_subnets(self):
+        candidates = [(dict(id=0, ip_version=4, first_ip=0, last_ip=3), 4),
+                      (dict(id=1, ip_version=4, first_ip=0, last_ip=3), 1)]
+        selection = subnet_selection.get_selection("WEIGHTED_RANDOM")
+        with mock.patch("random.random") as rand:
+            rand.return_value = 0.0
+            self.assertEqual([1, 0], _ids(selection.order(candidates)))
@@ -0,0 +1,110 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+import netaddr
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from quark.db import api as db_api
+from quark.db import models
+from quark.tests.functional.base import BaseFunctionalTest
+from quark.tools import compaction
+
+
+class TestCompaction(BaseFunctionalTest):
+    def setUp(self):
+        super(TestCompaction, self).setUp()
+        self.later = timeutils.utcnow() + datetime.timedelta(minutes=1)
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake")
+            policy = db_api.ip_policy_create(self.context,
+                                             exclude=["192.168.0.0/30"])
+            self.subnet = db_api.subnet_create(
+                self.context, network=net, cidr="192.168.0.0/24",
+                ip_policy=policy, tenant_id="fake")
+            self.context.session.flush()
+
+            self.addresses = {}
+            for address, deallocated in (("192.168.0.1", True),
+                                         ("192.168.0.2", False),
+                                         ("192.168.0.10", True),
+                                         ("192.168.0.11", False),
+                                         ("10.0.0.1", True)):
+                ip = db_api.ip_address_create(
+                    self.context, subnet_id=self.subnet.id,
+                    network_id=net.id, version=4,
+                    address=netaddr.IPAddress(address))
+                if deallocated:
+                    ip.deallocated = True
+                self.addresses[address] = ip
+
+            self.used = db_api.transaction_create(self.context)
+            self.unused = [db_api.transaction_create(self.context)
+                           for _ in xrange(3)]
+            self.context.session.flush()
+            self.addresses["192.168.0.10"].transaction_id = self.used.id
+
+    def _remaining(self, model):
+        self.context.session.expire_all()
+        return self.context.session.query(model).all()
+
+    def test_compact_transactions(self):
+        count = compaction.compact_transactions(self.engine, self.later,
+                                                batch_size=2)
+        self.assertEqual(3, count)
+        self.assertEqual([self.used.id],
+                         [t.id for t in self._remaining(models.Transaction)])
+
+    def test_compact_transactions_keeps_recent(self):
+        cutoff = timeutils.utcnow() - datetime.timedelta(minutes=1)
+        self.assertEqual(0, compaction.compact_transactions(
+            self.engine, cutoff, batch_size=2))
+        self.assertEqual(4, len(self._remaining(models.Transaction)))
+
+    def test_compact_ip_addresses(self):
+        count = compaction.compact_ip_addresses(self.engine, self.later,
+                                                batch_size=1)
+        # Deallocated but reallocatable, or allocated, are kept
+        self.assertEqual(2, count)
+        self.assertEqual(
+            ["192.168.0.10", "192.168.0.11", "192.168.0.2"],
+            sorted(ip.address_readable
+                   for ip in self._remaining(models.IPAddress)))
+        subnet = self.context.session.query(models.Subnet).one()
+        self.assertEqual(3, subnet.used_count)
+
+    def test_compact_ip_addresses_keeps_associated(self):
+        with self.context.session.begin():
+            port = db_api.port_create(
+                self.context, network_id=self.subnet.network_id,
+                mac_address=0, tenant_id="fake")
+            self.context.session.flush()
+            db_api.port_associate_ip(self.context, [port],
+                                     self.addresses["10.0.0.1"])
+        self.assertEqual(1, compaction.compact_ip_addresses(
+            self.engine, self.later, batch_size=10))
+
+    def test_run_reports(self):
+        for opt, value in (("compaction_batch_delay", 0),
+                           ("compaction_transaction_age", -60),
+                           ("ipam_reuse_after", -60)):
+            cfg.CONF.set_override(opt, value, "QUARK")
+            self.addCleanup(cfg.CONF.clear_override, opt, "QUARK")
+        report = compaction.run(self.engine)
+        self.assertEqual(2, report["quark_ip_addresses"][0])
+        self.assertEqual(3, report["quark_transactions"][0])
@@ -0,0 +1,62 @@
+# Copyright 2016 Rackspace Hosting Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import netaddr
+
+from quark.db import api as db_api
+from quark.db import models
+from quark.tests.functional.base import BaseFunctionalTest
+from quark.tools import inet_backfill
+
+
+class TestInetBackfill(BaseFunctionalTest):
+    def setUp(self):
+        super(TestInetBackfill, self).setUp()
+        with self.context.session.begin():
+            net = db_api.network_create(self.context, name="public",
+                                        tenant_id="fake")
+            subnet = db_api.subnet_create(self.context, network=net,
+                                          cidr="192.168.0.0/24",
+                                          tenant_id="fake")
+            self.context.session.flush()
+            for i in xrange(5):
+                db_api.ip_address_create(
+                    self.context, subnet_id=subnet.id, network_id=net.id,
+                    version=4, address=netaddr.IPAddress("192.168.0.%d" % i))
+
+    def _addresses(self):
+        self.context.session.expire_all()
+        return self.context.session.query(models.IPAddress).all()
+
+    def test_inserts_fill_in_binary_copies(self):
+        for address in self._addresses():
+            self.assertEqual(address.address, address.address_bin)
+        subnet = self.context.session.query(models.Subnet).one()
+        self.assertEqual(subnet.first_ip, subnet.first_ip_bin)
+        self.assertEqual(subnet.last_ip, subnet.last_ip_bin)
+
+    def test_backfill_in_batches(self):
+        with self.context.session.begin():
+            self.context.session.query(models.IPAddress).update(
+                {"address_bin": None}, synchronize_session=False)
+        count = inet_backfill.backfill(self.engine,
+                                       models.IPAddress.__table__,
+                                       "address", batch_size=2)
+        self.assertEqual(5, count)
+        for address in self._addresses():
+            self.assertEqual(address.address, address.address_bin)
+        self.assertEqual(0, inet_backfill.backfill(
+            self.engine, models.IPAddress.__table__, "address",
+            batch_size=2))
@@ -0,0 +1,194 @@
+import datetime
+import sys
+import time
+
+from neutron.common import config
+from neutron.db import api as neutron_db_api
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import timeutils
+from sqlalchemy import and_, exists, not_, or_, select
+
+from quark.db import api as db_api
+from quark.db import models
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+compaction_opts = [
+    cfg.IntOpt("compaction_batch_size",
+               default=1000,
+               help=_("Rows quark-compact deletes per transaction")),
+    cfg.FloatOpt("compaction_batch_delay",
+                 default=0.5,
+                 help=_("Seconds quark-compact sleeps between batches, to "
+                        "leave room for regular traffic")),
+    cfg.IntOpt("compaction_transaction_age",
+               default=3600,
+               help=_("Seconds a reallocation transaction must be unused "
+                      "for before quark-compact deletes it"))
+]
+
+CONF.register_opts(compaction_opts, "QUARK")
+
+
+def main():
+    config.init(sys.argv[1:])
+    if not cfg.CONF.config_file:
+        sys.exit(_("ERROR: Unable to find configuration file via the default"
+                   " search paths (~/.neutron/, ~/, /etc/neutron/, /etc/) and"
+                   " the '--config-file' option!"))
+    config.setup_logging()
+    run(neutron_db_api.get_engine())
+
+
+def run(engine):
+    """Runs every compaction once. Suitable for a periodic task.
+
+    Returns {<table>: (rows deleted, seconds taken)}.
+    """
+    now = timeutils.utcnow()
+    batch_size = CONF.QUARK.compaction_batch_size
+    delay = CONF.QUARK.compaction_batch_delay
+    transaction_cutoff = now - datetime.timedelta(
+        seconds=CONF.QUARK.compaction_transaction_age)
+    reuse_cutoff = now - datetime.timedelta(
+        seconds=CONF.QUARK.ipam_reuse_after)
+
+    report = {}
+    # Addresses go first, as deleting them can leave transactions unused
+    for table, compact, cutoff in (
+            ("quark_ip_addresses", compact_ip_addresses, reuse_cutoff),
+            ("quark_transactions", compact_transactions,
+             transaction_cutoff)):
+        start = time.time()
+        count = compact(engine, cutoff, batch_size, delay)
+        elapsed = time.time() - start
+        LOG.info("Compacted %d rows from %s in %.2fs" % (count, table,
+                                                         elapsed))
+        report[table] = (count, elapsed)
+    return report
+
+
+def _compact(engine, find, delete, batch_size, delay):
+    """Deletes rows a batch at a time, each batch in its own transaction.
+
+    find(connection, last_id, batch_size) returns the next batch of rows
+    to delete, as (id, ...) tuples in id order, and delete(connection,
+    rows) deletes them and returns how many it did.
+    """
+    total = 0
+    last_id = None
+    while True:
+        with engine.begin() as connection:
+            rows = find(connection, last_id, batch_size)
+            if not rows:
+                return total
+            total += delete(connection, rows)
+        last_id = rows[-1][0]
+        if len(rows) < batch_size:
+            return total
+        if delay:
+            time.sleep(delay)
+
+
+def _unused_transaction(transaction_id):
+    return and_(
+        ~exists().where(models.IPAddress.transaction_id == transaction_id),
+        ~exists().where(models.MacAddress.transaction_id == transaction_id))
+
+
+def compact_transactions(engine, cutoff, batch_size, delay=0):
+    """Deletes reallocation transactions no address refers to any more.
+
+    Only transactions created before cutoff are considered, so ones an
+    allocation is still about to use are left alone.
+    """
+    transactions = models.Transaction.__table__
+
+    def find(connection, last_id, batch_size):
+        query = select([transactions.c.id])
+        query = query.where(transactions.c.created_at < cutoff)
+        query = query.where(_unused_transaction(transactions.c.id))
+        if last_id is not None:
+            query = query.where(transactions.c.id > last_id)
+        query = query.order_by(transactions.c.id).limit(batch_size)
+        return connection.execute(query).fetchall()
+
+    def delete(connection, rows):
+        # Checked again in case an allocation picked one up meanwhile
+        statement = transactions.delete().where(and_(
+            transactions.c.id.in_([row[0] for row in rows]),
+            _unused_transaction(transactions.c.id)))
+        return connection.execute(statement).rowcount
+
+    return _compact(engine, find, delete, batch_size, delay)
+
+
+def compact_ip_addresses(engine, cutoff, batch_size, delay=0):
+    """Deletes deallocated addresses that can never be reallocated.
+
+    These are the addresses deallocated before cutoff that have no subnet,
+    are outside their subnet's CIDR or are covered by its IP policy, the
+    same ones ip_address_reallocate_find deletes when it comes across
+    them. Addresses that are locked or still associated are kept.
+    """
+    address = models.IPAddress
+    subnet = models.Subnet
+    ippc = models.IPPolicyCIDR
+    addresses = address.__table__
+    assocs = models.port_ip_association_table
+    flip_assocs = models.flip_to_fixed_ip_assoc_tbl
+
+    in_policy = exists().where(and_(
+        ippc.ip_policy_id == subnet.ip_policy_id,
+        db_api.inet_within(address.address, ippc.first_ip, ippc.last_ip)))
+    unusable = or_(
+        address.subnet_id.is_(None),
+        not_(db_api.inet_within(address.address, subnet.first_ip,
+                                subnet.last_ip)),
+        in_policy)
+
+    def find(connection, last_id, batch_size):
+        query = select([address.id, address.subnet_id]).select_from(
+            addresses.outerjoin(subnet.__table__,
+                                address.subnet_id == subnet.id))
+        query = query.where(address._deallocated == 1)
+        query = query.where(address.deallocated_at < cutoff)
+        query = query.where(address.lock_id.is_(None))
+        query = query.where(~exists().where(
+            assocs.c.ip_address_id == address.id))
+        query = query.where(~exists().where(or_(
+            flip_assocs.c.floating_ip_address_id == address.id,
+            flip_assocs.c.fixed_ip_address_id == address.id)))
+        query = query.where(unusable)
+        if last_id is not None:
+            query = query.where(address.id > last_id)
+        query = query.order_by(address.id).limit(batch_size)
+        return connection.execute(query).fetchall()
+
+    def delete(connection, rows):
+        by_subnet = {}
+        for address_id, subnet_id in rows:
+            by_subnet.setdefault(subnet_id, []).append(address_id)
+
+        deleted = 0
+        subnets = subnet.__table__
+        for subnet_id, ids in by_subnet.items():
+            # Checked again in case the address was reallocated meanwhile
+            count = connection.execute(addresses.delete().where(and_(
+                address.id.in_(ids),
+                address._deallocated == 1,
+                address.lock_id.is_(None)))).rowcount
+            if subnet_id and count:
+                connection.execute(subnets.update().where(
+                    subnets.c.id == subnet_id).values(
+                    used_count=subnets.c.used_count - count))
+            deleted += count
+        return deleted
+
+    return _compact(engine, find, delete, batch_size, delay)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import sys
+import time
+
+from neutron.common import config
+from neutron.db import api as neutron_db_api
+from oslo_config import cfg
+from oslo_log import log as logging
+from sqlalchemy import bindparam, select
+
+from quark.db import models
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+inet_backfill_opts = [
+    cfg.IntOpt("inet_backfill_batch_size",
+               default=1000,
+               help=_("Rows quark-inet-backfill rewrites per transaction")),
+    cfg.FloatOpt("inet_backfill_batch_delay",
+                 default=0.1,
+                 help=_("Seconds quark-inet-backfill sleeps between batches, "
+                        "to leave room for regular traffic"))
+]
+
+CONF.register_opts(inet_backfill_opts, "QUARK")
+
+# (table, INET column) pairs that have a BINARY(16) <column>_bin copy
+COLUMNS = [(models.IPAddress.__table__, "address"),
+           (models.Subnet.__table__, "first_ip"),
+           (models.Subnet.__table__, "last_ip"),
+           (models.IPPolicyCIDR.__table__, "first_ip"),
+           (models.IPPolicyCIDR.__table__, "last_ip")]
+
+
+def main():
+    config.init(sys.argv[1:])
+    if not cfg.CONF.config_file:
+        sys.exit(_("ERROR: Unable to find configuration file via the default"
+                   " search paths (~/.neutron/, ~/, /etc/neutron/, /etc/) and"
+                   " the '--config-file' option!"))
+    config.setup_logging()
+
+    engine = neutron_db_api.get_engine()
+    for table, column in COLUMNS:
+        count = backfill(engine, table, column,
+                         CONF.QUARK.inet_backfill_batch_size,
+                         CONF.QUARK.inet_backfill_batch_delay)
+        LOG.info("Filled in %s.%s_bin for %d rows" % (table.name, column,
+                                                      count))
+
+
+def backfill(engine, table, column, batch_size, delay=0):
+    """Copies column into column_bin wherever the copy is missing.
+
+    Rows are walked in primary key order, batch_size at a time, with each
+    batch in its own short transaction so locks are never held for long.
+    Returns the number of rows filled in.
+    """
+    source = table.c[column]
+    target = table.c[column + "_bin"]
+    update = table.update().where(table.c.id == bindparam("_id")).values(
+        {target: bindparam("_value")})
+
+    total = 0
+    last_id = None
+    while True:
+        query = select([table.c.id, source]).where(target.is_(None))
+        query = query.where(source.isnot(None))
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        query = query.order_by(table.c.id).limit(batch_size)
+
+        with engine.begin() as connection:
+            rows = connection.execute(query).fetchall()
+            if not rows:
+                return total
+            connection.execute(update, [dict(_id=row[0], _value=row[1])
+                                        for row in rows])
+        total += len(rows)
+        last_id = rows[-1][0]
+        if len(rows) < batch_size:
+            return total
+        if delay:
+            time.sleep(delay)
+
+
+if __name__ == "__main__":
+    main()